@@ -9,22 +9,23 @@ from datetime import date
 import threading
 
 # --- 導入核心處理函式 (不變) ---
-from scripts.health_check import check_and_start_ollama
+from scripts.health_check import check_and_start_ollama, start_model_warmup, WARMUP_STATUS
 from scripts.inbox_agent import get_content_from_url, get_text_from_image, process_inbox_item
-from scripts.knowledge_agent import create_knowledge_node
-from scripts.review_agent import generate_periodic_review
+from scripts.review_agent import generate_periodic_review, build_review_input
 from scripts.notion_handler import (
-    create_notion_page, format_inbox_properties, format_knowledge_properties,
-    query_notion_database, update_notion_page_status, get_page_content_as_text,
-    build_date_filter, format_review_properties
+    get_notion_client, format_inbox_properties, build_date_filter, format_review_properties
 )
 from scripts.email_handler import send_email, format_knowledge_node_as_html, format_review_as_html
+from scripts.mirror_handler import query_database_cached
+from scripts.synthesis_pipeline import run_synthesis_pipeline
+from scripts.dedup_handler import check_duplicate, register_content, describe_duplicate
 
 # --- 背景任務函式 ---
 
 # --- 核心修改 1: 背景函式現在接收一個 status_dict 作為參數 ---
 def background_add_to_inbox(config: dict, status_dict: dict, task_type: str, content: str, url: str = None):
     """通用於新增到 Inbox 的背景任務。"""
+    notion = get_notion_client(config['NOTION_TOKEN'], config)
     try:
         status_dict["running"] = True
         status_dict["message"] = "正在處理..."
@@ -37,29 +38,42 @@ def background_add_to_inbox(config: dict, status_dict: dict, task_type: str, con
             status_dict["message"] = "🤖 正在呼叫 AI 處理文本..."
         elif task_type == 'url':
             status_dict["message"] = "🕸️ 正在抓取網頁內容..."
-            raw_content = get_content_from_url(content)
+            raw_content = get_content_from_url(content, config)
             url = content
         elif task_type == 'image':
             status_dict["message"] = "🖼️ 正在進行 OCR 識別..."
-            raw_content = get_text_from_image(content)
+            raw_content = get_text_from_image(content, config)
             os.remove(content)
 
         if not raw_content or not raw_content.strip():
             status_dict["error"] = f"❌ 無法獲取內容 ({task_type})。"
             return
 
+        # 在呼叫 LLM 與寫入 Notion 之前，先排除已收錄過的內容
+        duplicate = check_duplicate(raw_content, config)
+        if duplicate:
+            status_dict["success"] = f"⏭️ {describe_duplicate(duplicate)}，已略過。"
+            return
+
         status_dict["message"] = "🤖 正在進行智能摘要..."
-        processed_data = process_inbox_item(raw_content, config)
+
+        def on_partial(fields):
+            # 串流生成時，標題一出現就先顯示在 UI 上
+            if "title" in fields:
+                status_dict["message"] = f"🤖 AI 生成中：「{fields['title']}」..."
+
+        processed_data = process_inbox_item(raw_content, config, on_partial=on_partial)
         if not processed_data:
             status_dict["logs"].append("⚠️ AI 智能處理失敗，但原始筆記仍會保存。")
             processed_data = {}
 
         status_dict["message"] = "✍️ 正在寫入 Notion..."
         properties = format_inbox_properties(processed_data, raw_content, url, source_type=source_type)
-        result = create_notion_page(config['NOTION_TOKEN'], config['INBOX_DB_ID'], properties, page_content=raw_content)
+        result = notion.create_page(config['INBOX_DB_ID'], properties, page_content=raw_content)
 
         if result:
             status_dict["success"] = "✅ 成功新增至 Notion Inbox！"
+            register_content(raw_content, config, page_id=result.get("id"), url=url, title=processed_data.get("title"))
         else:
             status_dict["error"] = "❌ 新增至 Notion Inbox 失敗。"
 
@@ -76,7 +90,7 @@ def background_knowledge_synthesis(config: dict, status_dict: dict):
                 
         status_dict["logs"].append("正在查詢需要處理的新項目...")
         filter_payload = {"property": "Status", "select": {"equals": "New"}}
-        new_items = query_notion_database(config['NOTION_TOKEN'], config['INBOX_DB_ID'], filter_payload, config.get("DEBUG_MODE", False))
+        new_items = query_database_cached(config, config['INBOX_DB_ID'], filter_payload, live=True)
         
         if not new_items:
             status_dict["logs"].append("✅ Inbox 中沒有需要合成的新項目。")
@@ -86,41 +100,17 @@ def background_knowledge_synthesis(config: dict, status_dict: dict):
         status_dict["total"] = total_items
         status_dict["logs"].append(f"找到 {total_items} 個新項目需要處理。")
 
-        synthesis_successful = False
-        for i, item in enumerate(new_items):
-            page_id = item['id']
-            status_dict["current_task"] = f"正在處理項目 {i+1}/{total_items}..."
-            content_to_process, metadata = get_page_content_as_text(config['NOTION_TOKEN'], item)
-            
-            if not content_to_process.strip():
-                status_dict["logs"].append(f"⚠️ 項目 {page_id} 內容為空，已跳過。")
-                continue
-
-            try:
-                status_dict["logs"].append(f"🧠 項目 '{content_to_process[:30]}...': 正在呼叫 AI...")
-                knowledge_data = create_knowledge_node(content_to_process, config)
-                if not knowledge_data:
-                    status_dict["logs"].append(f"❌ AI 未能生成有效節點。")
-                    continue
-
-                status_dict["logs"].append(f"✍️ 正在寫入 Notion: '{knowledge_data.get('title', 'Untitled')}'")
-                properties = format_knowledge_properties(knowledge_data, metadata=metadata)
-                result = create_notion_page(config['NOTION_TOKEN'], config['KNOWLEDGE_DB_ID'], properties)
-                
-                if result:
-                    status_dict["logs"].append(f"✅ 合成成功！")
-                    update_notion_page_status(config['NOTION_TOKEN'], page_id, "Processed")
-                    # --- 核心修改 2: 更新 status_dict 中的標記，而不是 session_state ---
-                    status_dict["synthesis_happened"] = True
-                else:
-                    status_dict["logs"].append(f"❌ 寫入 Notion 失敗！")
-            except Exception as e:
-                status_dict["logs"].append(f"❌ 處理項目時發生錯誤: {e}")
-            
-            status_dict["progress"] = i + 1
-            if i < total_items - 1:
-                status_dict["logs"].append("🔄 等待 5 秒...")
-                time.sleep(5)
+        def on_progress(ok: bool):
+            status_dict["progress"] += 1
+            status_dict["current_task"] = f"已完成 {status_dict['progress']}/{total_items} 個項目..."
+            # --- 核心修改 2: 更新 status_dict 中的標記，而不是 session_state ---
+            if ok:
+                status_dict["synthesis_happened"] = True
+
+        # 流水線：正文並發抓取 → LLM → 寫入 Notion → 更新狀態，各階段以有界佇列重疊執行
+        status_dict["current_task"] = "正在以流水線處理項目..."
+        run_synthesis_pipeline(config, new_items, log=status_dict["logs"].append,
+                               on_progress=on_progress, send_emails=False)
 
         # --- 核心修改 3: 移除舊的、錯誤的 session_state 寫入 ---
         # if synthesis_successful:
@@ -133,6 +123,7 @@ def background_knowledge_synthesis(config: dict, status_dict: dict):
 
 def background_run_review(config: dict, status_dict: dict, period: str):
     """趨勢分析的背景任務。"""
+    notion = get_notion_client(config['NOTION_TOKEN'], config)
     try:
         # --- 核心修改 1: 初始化成功標記 ---
         status_dict["review_happened"] = False
@@ -140,18 +131,21 @@ def background_run_review(config: dict, status_dict: dict, period: str):
         status_dict["running"] = True
         status_dict["message"] = f"🔍 正在從 Notion 抓取 {period} 筆記..."
         date_filter = build_date_filter(period)
-        notes = query_notion_database(config['NOTION_TOKEN'], config['KNOWLEDGE_DB_ID'], date_filter, config.get("DEBUG_MODE", False))
+        notes = query_database_cached(config, config['KNOWLEDGE_DB_ID'], date_filter)
         
         if not notes:
             status_dict["success"] = f"✅ 在指定期間内沒有找到新的知識節點。"
             return
 
         status_dict["message"] = f"找到 {len(notes)} 篇筆記，正在進行濃縮..."
-        consolidated_notes = [f"## {note['properties']['Title']['title'][0]['text']['content']}\n> {note['properties']['Core Idea']['rich_text'][0]['text']['content']}\n" for note in notes]
-        consolidated_text = "\n---\n".join(consolidated_notes)
+        consolidated_text = build_review_input(notes, period, config)
         
         status_dict["message"] = f"🤖 正在呼叫 AI 生成 {period} 趨勢報告..."
-        review_data = generate_periodic_review(consolidated_text, period, config)
+        def on_partial(fields):
+            completed = ", ".join(fields.keys())
+            status_dict["message"] = f"🤖 正在生成 {period} 趨勢報告... (已完成: {completed})"
+
+        review_data = generate_periodic_review(consolidated_text, period, config, on_partial=on_partial)
         if not review_data:
             status_dict["error"] = "❌ 趨勢分析失敗，AI 未返回有效數據。"
             return
@@ -160,7 +154,7 @@ def background_run_review(config: dict, status_dict: dict, period: str):
         start_date = date.fromisoformat(date_filter['created_time']['on_or_after'])
         end_date = date.today()
         review_properties = format_review_properties(review_data, period, start_date, end_date)
-        result = create_notion_page(config['NOTION_TOKEN'], config['REVIEW_DB_ID'], review_properties)
+        result = notion.create_page(config['REVIEW_DB_ID'], review_properties)
         
         if result:
             status_dict["success"] = f"✅ {period.capitalize()} 趨勢分析報告已成功生成！"
@@ -210,6 +204,9 @@ def load_config_and_init():
             if not check_and_start_ollama(local_api_url):
                 st.error("❌ 無法啟動或連接到本地 Ollama 服務。請手動檢查。")
                 st.stop()
+        # 在背景預熱模型並設定 keep_alive，避免第一個任務承擔完整的模型載入時間
+        local_config = config.get("LOCAL_CONFIG", {})
+        start_model_warmup(local_api_url, local_config.get("LLM_MODEL_NAME"), local_config.get("KEEP_ALIVE", "30m"))
     return config
 
 CONFIG = load_config_and_init()
@@ -218,6 +215,8 @@ if not CONFIG:
 
 provider_display = {"local": "💻 本地模式 (Local)", "cloud": "☁️ 雲端模式 (Cloud)"}.get(CONFIG.get("LLM_PROVIDER"), "未知")
 st.info(f"當前運行模式: **{provider_display}**")
+if WARMUP_STATUS["state"] != "idle":
+    st.caption(f"🔥 模型預熱: {WARMUP_STATUS['message']}")
 
 # --- 1. Quick Add to Inbox ---
 st.header("📥 Quick Add to Inbox")
@@ -1,19 +1,26 @@
 # main.py (支援雙模式)
 import os
+import sys
 import json
 import typer
 from typing_extensions import Annotated
 
-from scripts.health_check import check_and_start_ollama
-from scripts.inbox_agent import process_inbox_item, get_content_from_url, get_text_from_image
-from scripts.knowledge_agent import create_knowledge_node
+from scripts.health_check import check_and_start_ollama, start_model_warmup
+from scripts.inbox_agent import process_inbox_item, process_inbox_items_batch, get_content_from_url, get_text_from_image
 from scripts.notion_handler import (
-    create_notion_page, format_inbox_properties, format_knowledge_properties,
-    query_notion_database, update_notion_page_status, get_page_content_as_text, build_date_filter, format_review_properties
+    get_notion_client, format_inbox_properties, build_date_filter, format_review_properties
 )
 from datetime import date
-from scripts.review_agent import generate_periodic_review
-from scripts.email_handler import send_email, format_knowledge_node_as_html, format_review_as_html
+from scripts.review_agent import generate_periodic_review, build_review_input
+from scripts.mirror_handler import query_database_cached, sync_all_databases
+from scripts.synthesis_pipeline import run_synthesis_pipeline
+from scripts.similarity_handler import index_knowledge_nodes
+from scripts.vector_store import get_vector_store, knowledge_node_text
+from scripts.embedding_benchmark import run_embedding_benchmark
+from scripts.email_handler import send_email, format_review_as_html
+from scripts.dedup_handler import BatchDeduplicator, check_duplicate, register_content, describe_duplicate
+from scripts.url_ingest import read_url_list, run_url_ingest, format_ingest_report
+from scripts.ocr_engine import get_ocr_engine, list_image_files, format_timings
 
 CONFIG_FILE = 'config.json'
 app = typer.Typer(help="JimLocalBrain - 本地 AI 外腦 + 知識庫系統")
@@ -29,6 +36,8 @@ def load_config():
         raise typer.Exit(code=1)
 
 CONFIG = load_config()
+# 整個 CLI 進程共用一個 Notion 客戶端 (連線池 + 限速)
+NOTION = get_notion_client(CONFIG['NOTION_TOKEN'], CONFIG)
 
 # 如果是本地模式，才執行健康檢查
 if CONFIG.get("LLM_PROVIDER", "local") == "local":
@@ -37,53 +46,176 @@ if CONFIG.get("LLM_PROVIDER", "local") == "local":
         print("❌ 無法繼續執行，程式即將退出。")
         raise typer.Exit(code=1)
 
-def process_and_save_content(raw_content: str, url: str = None, source_type: str = None):
+# 會呼叫 LLM 的指令；sync、index、bench-embed 等不需要 LLM 的指令不預熱模型
+LLM_COMMANDS = {"add", "add-batch", "add-url", "add-urls", "add-img", "synthesis", "review"}
+
+@app.callback()
+def main_callback(ctx: typer.Context):
+    """JimLocalBrain - 本地 AI 外腦 + 知識庫系統"""
+    # 需要呼叫 LLM 的指令，在背景預熱模型，讓模型載入與抓取內容/讀取 Notion 同時進行
+    if CONFIG.get("LLM_PROVIDER", "local") == "local" and ctx.invoked_subcommand in LLM_COMMANDS:
+        local_config = CONFIG.get("LOCAL_CONFIG", {})
+        start_model_warmup(local_api_url, local_config.get("LLM_MODEL_NAME"), local_config.get("KEEP_ALIVE", "30m"))
+
+def process_and_save_content(raw_content: str, url: str = None, source_type: str = None, force: bool = False):
     """後端處理與儲存的核心邏輯"""
     if not raw_content or not raw_content.strip():
         print("⚠️ 內容為空，已跳過處理。")
         return
 
+    # 在呼叫 LLM 與寫入 Notion 之前，先排除已收錄過的內容
+    duplicate = None if force else check_duplicate(raw_content, CONFIG)
+    if duplicate:
+        print(f"⏭️ {describe_duplicate(duplicate)}，已略過。(使用 --force 可強制新增)")
+        return
+
     print("🤖 正在使用 AI 進行智能處理...")
     processed_data = process_inbox_item(raw_content, CONFIG)
     if not processed_data:
         print("⚠️ AI 智能處理失敗。原始筆記仍會被保存。")
         processed_data = {}
+    save_to_inbox(processed_data, raw_content, url, source_type)
 
+def save_to_inbox(processed_data: dict, raw_content: str, url: str = None, source_type: str = None):
+    """將處理結果與原始內容寫入 Notion Inbox。"""
     # 將 source_type 傳遞下去
     properties = format_inbox_properties(processed_data, raw_content, url, source_type=source_type)
     
     # 將 raw_content 作為 page_content 傳遞
-    if create_notion_page(CONFIG['NOTION_TOKEN'], CONFIG['INBOX_DB_ID'], properties, page_content=raw_content):
+    page = NOTION.create_page(CONFIG['INBOX_DB_ID'], properties, page_content=raw_content)
+    if page:
         print("✅ 成功新增至 Notion Inbox！")
+        register_content(raw_content, CONFIG, page_id=page.get("id"), url=url, title=processed_data.get("title"))
     else:
         print("❌ 新增至 Notion Inbox 失敗。")
 
 @app.command(name="add")
-def run_add(content: str = typer.Argument(..., help="要新增的文字內容")):
+def run_add(
+    content: str = typer.Argument(..., help="要新增的文字內容"),
+    force: bool = typer.Option(False, "--force", help="即使內容已收錄過也強制新增")
+):
     """新增一條文字筆記或靈感至 Inbox。"""
     print("\n--- 🚀 正在新增文字筆記 ---")
     # 傳遞 source_type='text'
-    process_and_save_content(content, source_type='text')
+    process_and_save_content(content, source_type='text', force=force)
+
+@app.command(name="add-batch")
+def run_add_batch(
+    file: str = typer.Argument("-", help="每行一則筆記的文字檔路徑；省略或為 '-' 時從標準輸入讀取"),
+    force: bool = typer.Option(False, "--force", help="即使內容已收錄過也強制新增")
+):
+    """批次新增多則短筆記至 Inbox，多則筆記共用一次 LLM 呼叫。"""
+    print("\n--- 🚀 正在批次新增文字筆記 ---")
+    try:
+        if file == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(file, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+    except OSError as e:
+        print(f"❌ 無法讀取檔案: {e}")
+        raise typer.Exit(code=1)
+
+    notes = []
+    seen = set()
+    # 同時比對已收錄的內容與本批次中先前的筆記 (後者還沒寫入 Notion，不在索引中)
+    deduplicator = BatchDeduplicator(CONFIG, force)
+    for note in (line.strip() for line in lines):
+        if not note or note in seen:
+            continue
+        seen.add(note)
+        duplicate = deduplicator.check(note, label=f"'{note[:30]}'")
+        if duplicate:
+            print(f"⏭️ '{note[:30]}': {describe_duplicate(duplicate)}，已略過。")
+            continue
+        notes.append(note)
+    if not notes:
+        print("⚠️ 沒有可新增的筆記。")
+        return
+
+    print(f"🤖 共 {len(notes)} 則筆記，正在使用 AI 批次處理...")
+    results = process_inbox_items_batch(notes, CONFIG)
+    for note, processed_data in zip(notes, results):
+        if not processed_data:
+            print(f"⚠️ 筆記 '{note[:30]}' 的 AI 智能處理失敗。原始筆記仍會被保存。")
+        save_to_inbox(processed_data or {}, note, source_type='text')
 
 @app.command(name="add-url")
-def run_add_url(url: str = typer.Argument(..., help="要抓取和新增的網址")):
+def run_add_url(
+    url: str = typer.Argument(..., help="要抓取和新增的網址"),
+    force: bool = typer.Option(False, "--force", help="即使內容已收錄過也強制新增")
+):
     """從 URL 抓取內容並新增至 Inbox。"""
     print(f"\n--- 🚀 正在從 URL 新增: {url} ---")
-    content = get_content_from_url(url)
+    content = get_content_from_url(url, CONFIG)
     if content:
         # 傳遞 source_type='url'
-        process_and_save_content(content, url=url, source_type='url')
+        process_and_save_content(content, url=url, source_type='url', force=force)
     else:
         print("❌ 無法從該網址抓取內容。")
 
+@app.command(name="add-urls")
+def run_add_urls(
+    file: str = typer.Argument("-", help="每行一個網址的文字檔路徑 (# 開頭為註解)；省略或為 '-' 時從標準輸入讀取"),
+    force: bool = typer.Option(False, "--force", help="即使內容已收錄過也強制新增"),
+    report: str = typer.Option(None, "--report", help="將失敗的網址寫入此檔案，可直接再用 add-urls 重試")
+):
+    """批次從多個網址抓取內容並新增至 Inbox (並發抓取，限制每個網域的併發數)。"""
+    print("\n--- 🚀 正在批次新增網址 ---")
+    try:
+        if file == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(file, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+    except OSError as e:
+        print(f"❌ 無法讀取檔案: {e}")
+        raise typer.Exit(code=1)
+
+    urls = read_url_list(lines)
+    if not urls:
+        print("⚠️ 沒有可新增的網址。")
+        return
+
+    print(f"🕸️ 共 {len(urls)} 個網址，開始抓取與處理...")
+    result = run_url_ingest(CONFIG, urls, force=force)
+    print("\n" + format_ingest_report(result))
+
+    if report and result["failed"]:
+        with open(report, 'w', encoding='utf-8') as f:
+            for url, reason in result["failed"]:
+                f.write(f"# {reason}\n{url}\n")
+        print(f"📝 失敗的網址已寫入 {report}")
+
 @app.command(name="add-img")
-def run_add_image(image_path: str = typer.Argument(..., help="要進行 OCR 的圖片路徑")):
+def run_add_image(
+    image_path: str = typer.Argument(..., help="要進行 OCR 的圖片路徑；若為資料夾則處理其中所有圖片"),
+    force: bool = typer.Option(False, "--force", help="即使內容已收錄過也強制新增")
+):
     """從圖片提取文字並新增至 Inbox。"""
+    if os.path.isdir(image_path):
+        image_files = list_image_files(image_path)
+        print(f"\n--- 🚀 正在從資料夾新增 {len(image_files)} 張圖片: {image_path} ---")
+        failed = []
+        # 下一張圖片的前處理與目前圖片的區域辨識同時進行
+        for path, content, timings in get_ocr_engine(CONFIG).recognize_many(image_files):
+            print(f"\n🖼️ {os.path.basename(path)}")
+            if not content or not content.strip():
+                print(f"❌ 無法從圖片中提取文字{f': {timings}' if isinstance(timings, str) else '。'}")
+                failed.append(path)
+                continue
+            print(f"⏱️ OCR 耗時: {format_timings(timings)}")
+            process_and_save_content(content, source_type='image', force=force)
+        print(f"\n📊 已處理 {len(image_files)} 張圖片，其中 {len(failed)} 張無法提取文字。")
+        for path in failed:
+            print(f"   - {path}")
+        return
+
     print(f"\n--- 🚀 正在從圖片新增: {image_path} ---")
-    content = get_text_from_image(image_path)
+    content = get_text_from_image(image_path, CONFIG)
     if content:
         # 傳遞 source_type='image'
-        process_and_save_content(content, source_type='image')
+        process_and_save_content(content, source_type='image', force=force)
     else:
         print("❌ 無法從圖片中提取文字。")
 
@@ -93,40 +225,16 @@ def run_knowledge_synthesis():
     """將 Inbox 中『New』狀態的項目，轉換為知識節點。"""
     print("\n--- 🚀 開始知識合成 ---")
     filter_payload = {"property": "Status", "select": {"equals": "New"}}
-    new_items = query_notion_database(CONFIG['NOTION_TOKEN'], CONFIG['INBOX_DB_ID'], filter_payload, CONFIG.get("DEBUG_MODE", False))
+    new_items = query_database_cached(CONFIG, CONFIG['INBOX_DB_ID'], filter_payload, live=True)
 
     if not new_items:
         print("✅ Inbox 中沒有需要合成的新項目。")
         return
 
-    for item in new_items:
-        page_id = item['id']
-        print(f"   - 正在處理項目: {page_id}")
-        
-        # --- 核心修改：傳入 CONFIG['NOTION_TOKEN'] ---
-        content_to_process, metadata = get_page_content_as_text(CONFIG['NOTION_TOKEN'], item)
-        # -----------------------------------------------
-        
-        if not content_to_process.strip():
-            print(f"   - 項目 {page_id} 內容為空，跳過。")
-            continue
-
-        knowledge_data = create_knowledge_node(content_to_process, CONFIG)
-        if not knowledge_data:
-            print(f"   - 知識節點生成失敗，跳過項目 {page_id}"); continue
-        
-        # --- 核心修改：傳遞 metadata 字典，而不是 url ---
-        properties = format_knowledge_properties(knowledge_data, metadata=metadata)
-        # -----------------------------------------------
-        
-        if create_notion_page(CONFIG['NOTION_TOKEN'], CONFIG['KNOWLEDGE_DB_ID'], properties):
-            update_notion_page_status(CONFIG['NOTION_TOKEN'], page_id, "Processed")
-            
-            # --- 新增：發送 Email ---
-            email_subject, email_body = format_knowledge_node_as_html(knowledge_data, metadata)
-            send_email(f"New Knowledge Node: {email_subject}", email_body, CONFIG)
-            # ------------------------     
-        
+    # 流水線：正文並發抓取 → LLM → 寫入 Notion → 更新狀態 → Email，各階段以有界佇列重疊執行
+    print(f"📥 找到 {len(new_items)} 個新項目，開始流水線處理...")
+    stats = run_synthesis_pipeline(CONFIG, new_items, log=lambda msg: print(f"   - {msg}"))
+    print(f"\n📊 成功合成 {stats['completed']} 個項目，跳過或失敗 {stats['dropped']} 個。")
     print("\n--- ✅ 知識合成完成 ---\n")
  
 @app.command(name="review")
@@ -138,27 +246,14 @@ def run_periodic_review(
     
     # 1. 建立日期過濾器並獲取筆記
     date_filter = build_date_filter(period)
-    notes = query_notion_database(CONFIG['NOTION_TOKEN'], CONFIG['KNOWLEDGE_DB_ID'], date_filter)
+    notes = query_database_cached(CONFIG, CONFIG['KNOWLEDGE_DB_ID'], date_filter)
     
     if not notes:
         print(f"✅ 在指定期間內沒有找到新的知識節點。")
         return
         
-    # 2. 資訊濃縮
-    consolidated_notes = []
-    for note in notes:
-        props = note.get("properties", {})
-        title = props.get("Title", {}).get("title", [{}])[0].get("text", {}).get("content", "")
-        core_idea = props.get("Core Idea", {}).get("rich_text", [{}])[0].get("text", {}).get("content", "")
-        # --- 核心修改 2：在濃縮文本中加入標記 ---
-        note_prefix = ""
-        # 檢查標題是否以燈泡 emoji 開頭
-        if title.strip().startswith("💡"):
-            note_prefix = "[ORIGINAL IDEA] "
-        # ------------------------------------
-        consolidated_notes.append(f"## {title}\n> {core_idea}\n")
-    
-    consolidated_text = "\n---\n".join(consolidated_notes)
+    # 2. 資訊濃縮 (月度/季度回顧使用快取的週摘要)
+    consolidated_text = build_review_input(notes, period, CONFIG)
     
     # 3. 趨勢合成
     review_data = generate_periodic_review(consolidated_text, period, CONFIG)
@@ -175,8 +270,7 @@ def run_periodic_review(
     review_properties = format_review_properties(review_data, period, start_date, end_date)
     
     # --- 核心修改：檢查 create_notion_page 的返回值 ---
-    result = create_notion_page(
-        CONFIG['NOTION_TOKEN'],
+    result = NOTION.create_page(
         CONFIG['REVIEW_DB_ID'],
         review_properties
     )
@@ -191,5 +285,56 @@ def run_periodic_review(
         print(f"\n--- ❌ {period.capitalize()} 趨勢分析報告儲存失敗。請檢查上面的錯誤訊息。 ---\n")
     # ------------------------------------------------- 
 
+@app.command(name="sync")
+def run_sync(full: bool = typer.Option(False, "--full", help="忽略水位線，重新完整同步所有頁面")):
+    """將 Notion 的三個資料庫同步到本地 SQLite 鏡像。"""
+    print(f"\n--- 🚀 開始{'完整' if full else '增量'}同步本地鏡像 ---")
+    counts = sync_all_databases(CONFIG, full=full)
+    for key, count in counts.items():
+        print(f"   - {key}: 更新 {count} 筆頁面")
+    print("\n--- ✅ 同步完成 ---\n")
+
+@app.command(name="index")
+def run_index(rebuild: bool = typer.Option(False, "--rebuild", help="重新寫入所有節點的向量，並重新訓練 IVF 索引")):
+    """將 Knowledge Base 中尚未建立向量的知識節點寫入本地向量庫。"""
+    print("\n--- 🚀 開始更新向量庫 ---")
+    store = get_vector_store(CONFIG)
+    if store is None:
+        print("⚠️ 向量庫已停用 (VECTOR_STORE.enabled = false)。")
+        return
+
+    nodes = []
+    for page in query_database_cached(CONFIG, CONFIG['KNOWLEDGE_DB_ID'], None):
+        if not rebuild and page['id'] in store:
+            continue
+        props = page.get("properties", {})
+        title = (props.get("Title", {}).get("title") or [{}])[0].get("text", {}).get("content", "")
+        core_idea = (props.get("Core Idea", {}).get("rich_text") or [{}])[0].get("text", {}).get("content", "")
+        nodes.append((page['id'], title, core_idea))
+
+    count = index_knowledge_nodes(nodes, CONFIG)
+    if rebuild and store.mode == "ivf" and len(store):
+        store.train_ivf()
+    print(f"\n--- ✅ 已寫入 {count} 個節點，向量庫共 {len(store)} 個節點 ---\n")
+
+@app.command(name="bench-embed")
+def run_bench_embed(
+    limit: int = typer.Option(500, "--limit", help="最多使用多少個知識節點作為測試文本"),
+    repeats: int = typer.Option(3, "--repeats", help="每個後端重複編碼的次數")
+):
+    """比較 PyTorch 與 ONNX int8 嵌入後端的準確度與吞吐量。"""
+    print("\n--- 🚀 開始比較嵌入後端 ---")
+    texts = []
+    for page in query_database_cached(CONFIG, CONFIG['KNOWLEDGE_DB_ID'], None)[:limit]:
+        props = page.get("properties", {})
+        title = (props.get("Title", {}).get("title") or [{}])[0].get("text", {}).get("content", "")
+        core_idea = (props.get("Core Idea", {}).get("rich_text") or [{}])[0].get("text", {}).get("content", "")
+        if title or core_idea:
+            texts.append(knowledge_node_text(title, core_idea))
+    if len(texts) < 10:
+        print("⚠️ 知識節點太少，改用內建的範例文本。")
+        texts = None
+    run_embedding_benchmark(CONFIG, texts, repeats=repeats)
+
 if __name__ == "__main__":
     app()
@@ -11,15 +11,15 @@ import tzlocal  # <--- 導入新的套件
 
 # 導入我們自己的函式
 # Streamlit 的多頁面應用會自動處理路徑問題
-from scripts.notion_handler import query_notion_database
+from scripts.mirror_handler import query_database_cached
 
 # --- 數據加載與處理 ---
 
-@st.cache_data(ttl=600) # 快取數據 10 分鐘，避免頻繁請求 Notion
+@st.cache_data(ttl=600) # 快取數據 10 分鐘；過期後只需增量同步本地鏡像，而不是重新分頁抓取整個資料庫
 def load_knowledge_data(config):
-    """從 Notion 加載所有知識節點並轉換為 Pandas DataFrame。"""
-    print("Fetching data from Notion...")
-    all_pages = query_notion_database(config['NOTION_TOKEN'], config['KNOWLEDGE_DB_ID'], filter_payload={}, debug_mode=config.get("DEBUG_MODE", False))
+    """從本地鏡像 (先與 Notion 增量同步) 加載所有知識節點並轉換為 Pandas DataFrame。"""
+    print("Syncing local mirror with Notion...")
+    all_pages = query_database_cached(config, config['KNOWLEDGE_DB_ID'], filter_payload={})
     
     if not all_pages:
         return pd.DataFrame()
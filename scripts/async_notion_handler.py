@@ -0,0 +1,192 @@
+# scripts/async_notion_handler.py
+# 以 asyncio + httpx 實作的 Notion 讀取路徑，用於並發預取多個頁面的正文。
+import asyncio
+import queue
+import threading
+
+import httpx
+
+from .notion_handler import (
+    NOTION_API_BASE, NOTION_VERSION, RETRYABLE_STATUS_CODES,
+    TokenBucket, get_notion_client, _block_to_text, _should_descend, _extract_content_and_metadata
+)
+
+class AsyncNotionClient:
+    """
+    NotionClient 的 asyncio 版本 (僅實作讀取)。
+    與同步客戶端共用同一個 TokenBucket，所以同步與非同步請求加總後仍然遵守同一個速率上限，
+    而 Semaphore 則限制同時在途的請求數。
+    """
+
+    def __init__(self, token: str, rate_limiter: TokenBucket, concurrency: int = 8,
+                 max_retries: int = 5, timeout: int = 30, max_block_depth: int = 5):
+        self.token = token
+        self.max_block_depth = max_block_depth
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.client = httpx.AsyncClient(
+            base_url=NOTION_API_BASE,
+            headers={"Authorization": f"Bearer {token}", "Notion-Version": NOTION_VERSION},
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+
+    async def _acquire_token(self):
+        while (wait := self.rate_limiter.try_acquire()) > 0:
+            await asyncio.sleep(wait)
+
+    async def request(self, method: str, path: str, payload: dict = None, params: dict = None) -> httpx.Response:
+        """發送請求；可重試的錯誤會自動退避重試，最終失敗時拋出 httpx.HTTPError。"""
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self._acquire_token()
+                try:
+                    response = await self.client.request(method, path, json=payload, params=params)
+                except httpx.TransportError:
+                    if attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(min(2 ** attempt, 30))
+                    continue
+
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    retry_after = response.headers.get("Retry-After")
+                    try:
+                        wait = float(retry_after) if retry_after else min(2 ** attempt, 30)
+                    except ValueError:
+                        wait = min(2 ** attempt, 30)
+                    print(f"⏳ Notion 回應 {response.status_code}，{wait:.1f} 秒後重試 ({attempt + 1}/{self.max_retries})...")
+                    if response.status_code == 429:
+                        self.rate_limiter.pause(wait)
+                    else:
+                        await asyncio.sleep(wait)
+                    continue
+
+                response.raise_for_status()
+                return response
+
+    async def iter_block_text(self, block_id: str, max_depth: int = 5, _depth: int = 0):
+        """
+        非同步地走訪區塊樹並依文件順序產出文字。
+        每取得一頁子區塊，就立即為其中有子區塊的項目並發啟動子樹抓取 (受 semaphore 與限速器約束)，
+        然後按順序產出：本頁文字可以先行輸出，子樹文字在輪到它時才等待。
+        """
+        params = {"page_size": 100}
+        while True:
+            response = await self.request("GET", f"/blocks/{block_id}/children", params=params)
+            data = response.json()
+            blocks = data.get("results", [])
+
+            subtrees = {}
+            if _depth < max_depth:
+                subtrees = {
+                    block["id"]: asyncio.create_task(self._collect_block_text(block["id"], max_depth, _depth + 1))
+                    for block in blocks if _should_descend(block)
+                }
+            try:
+                for block in blocks:
+                    text = _block_to_text(block)
+                    if text is not None:
+                        yield text
+                    if block["id"] in subtrees:
+                        for child_text in await subtrees[block["id"]]:
+                            yield child_text
+            finally:
+                # 出錯或提前結束時，取消尚未完成的子樹抓取
+                for task in subtrees.values():
+                    task.cancel()
+
+            if not data.get("has_more"):
+                return
+            params["start_cursor"] = data.get("next_cursor")
+
+    async def _collect_block_text(self, block_id: str, max_depth: int, depth: int) -> list:
+        return [text async for text in self.iter_block_text(block_id, max_depth, depth)]
+
+    async def get_page_blocks_as_text(self, page_id: str, max_depth: int = None) -> str:
+        """
+        獲取指定頁面 ID 下所有區塊 (包含分頁與巢狀子區塊) 的文字內容。
+        任何一次請求失敗都返回空字串，避免以不完整的內容進行合成。
+        """
+        max_depth = self.max_block_depth if max_depth is None else max_depth
+        try:
+            return "\n".join([text async for text in self.iter_block_text(page_id, max_depth)])
+        except httpx.HTTPError as e:
+            print(f"❌ 獲取頁面區塊時發生錯誤: {e}")
+            return ""
+
+    async def get_page_content_as_text(self, page: dict) -> tuple[str, dict]:
+        content_to_process = await self.get_page_blocks_as_text(page['id'])
+        return _extract_content_and_metadata(page, content_to_process)
+
+    async def get_page_content_safely(self, page: dict) -> tuple[str, dict]:
+        """與 get_page_content_as_text 相同，但任何錯誤都只影響這一頁：記錄後返回 ("", {})，讓其他頁面繼續抓取。"""
+        try:
+            return await self.get_page_content_as_text(page)
+        except Exception as e:
+            print(f"❌ 抓取頁面 {page.get('id')} 的正文時發生錯誤: {e}")
+            return "", {}
+
+    async def prefetch_page_contents(self, pages: list) -> list:
+        """並發抓取所有頁面的正文，返回與 pages 順序一致的 (content, metadata) 列表；抓取失敗的頁面內容為空字串。"""
+        return await asyncio.gather(*(self.get_page_content_safely(page) for page in pages))
+
+def _open_client(config: dict) -> AsyncNotionClient:
+    notion_config = config.get("NOTION_CONFIG", {})
+    # 使用同步客戶端的限速器，確保整個進程共用同一個請求預算
+    rate_limiter = get_notion_client(config['NOTION_TOKEN'], config).rate_limiter
+    return AsyncNotionClient(
+        config['NOTION_TOKEN'], rate_limiter,
+        concurrency=notion_config.get("concurrency", 8),
+        max_retries=notion_config.get("max_retries", 5),
+        timeout=notion_config.get("timeout", 30),
+        max_block_depth=notion_config.get("max_block_depth", 5),
+    )
+
+async def _prefetch(config: dict, pages: list) -> list:
+    async with _open_client(config) as client:
+        return await client.prefetch_page_contents(pages)
+
+def prefetch_page_contents(config: dict, pages: list) -> list:
+    """
+    同步包裝：在新的事件迴圈中並發抓取所有頁面正文。
+    可在 CLI 主執行緒或 Streamlit 的背景執行緒中直接呼叫。
+    """
+    if not pages:
+        return []
+    return asyncio.run(_prefetch(config, pages))
+
+def iter_page_contents(config: dict, pages: list):
+    """
+    同步產生器：在背景執行緒中並發抓取頁面正文，每完成一頁就產出 (page, content, metadata)，
+    讓下游 (例如合成流水線的 LLM 階段) 不必等到全部頁面都抓完才開始工作。產出順序為完成順序。
+    單一頁面抓取失敗時仍會產出該頁，content 為空字串，不會中斷其他頁面。
+    """
+    results = queue.Queue()
+    done = object()
+
+    async def fetch_all():
+        async with _open_client(config) as client:
+            async def fetch(page):
+                content, metadata = await client.get_page_content_safely(page)
+                results.put((page, content, metadata))
+            await asyncio.gather(*(fetch(page) for page in pages))
+
+    def run():
+        try:
+            asyncio.run(fetch_all())
+        except Exception as e:
+            print(f"❌ 並發抓取頁面正文時發生錯誤: {e}")
+        finally:
+            results.put(done)
+
+    threading.Thread(target=run, daemon=True).start()
+    while (result := results.get()) is not done:
+        yield result
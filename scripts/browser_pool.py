@@ -0,0 +1,146 @@
+# scripts/browser_pool.py
+# 長駐的 headless Chromium 與可重複使用的分頁池，供網址抓取的第三層 (playwright) 使用。
+# 避免每個網址都重新啟動瀏覽器 (每次 1–3 秒、數百 MB)。
+import atexit
+import asyncio
+import threading
+
+DEFAULT_BLOCKED_RESOURCES = ("image", "font", "media")
+
+class _Slot:
+    """池中的一個工作位置：一個獨立的 browser context 與其中重複使用的分頁。"""
+
+    def __init__(self, context, page):
+        self.context = context
+        self.page = page
+        self.uses = 0
+
+class BrowserPool:
+    """
+    Playwright 的物件只能在建立它的執行緒上使用，所以瀏覽器由一條專屬執行緒上的 asyncio 事件迴圈持有；
+    其他執行緒透過 fetch_html() 提交工作並等待結果，最多 size 個網址同時載入。
+    - 圖片、字型與影音等請求在送出前就被攔截 (只需要 HTML 文字)。
+    - 每個 context 服務 recycle_after 個網頁後關閉重建，限制記憶體成長；瀏覽器崩潰時自動重新啟動。
+    - 等到 load 事件後，再最多等待 settle_timeout 秒讓網路閒置，讓前端渲染 (JS 載入的正文) 有時間完成。
+    """
+
+    def __init__(self, size: int = 2, recycle_after: int = 50, blocked_resources=DEFAULT_BLOCKED_RESOURCES, timeout: float = 20,
+                 settle_timeout: float = 5):
+        self.size = max(1, size)
+        self.recycle_after = max(1, recycle_after)
+        self.blocked_resources = frozenset(blocked_resources)
+        self.timeout = timeout
+        self.settle_timeout = settle_timeout
+        self._playwright = None
+        self._browser = None
+        self._browser_lock = None
+        self._slots = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="browser-pool", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+
+    async def _setup(self):
+        self._browser_lock = asyncio.Lock()
+        self._slots = asyncio.Queue()
+        for _ in range(self.size):
+            self._slots.put_nowait(None)  # None 代表尚未建立 (或已回收) 的位置，用到時才建立
+
+    async def _get_browser(self):
+        async with self._browser_lock:
+            if self._browser is None or not self._browser.is_connected():
+                if self._playwright is None:
+                    from playwright.async_api import async_playwright
+                    self._playwright = await async_playwright().start()
+                print("🌐 正在啟動 headless Chromium...")
+                self._browser = await self._playwright.chromium.launch(headless=True)
+            return self._browser
+
+    async def _block_resources(self, route):
+        if route.request.resource_type in self.blocked_resources:
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def _new_slot(self) -> _Slot:
+        browser = await self._get_browser()
+        context = await browser.new_context()
+        if self.blocked_resources:
+            await context.route("**/*", self._block_resources)
+        return _Slot(context, await context.new_page())
+
+    @staticmethod
+    async def _close_slot(slot: _Slot):
+        try:
+            await slot.context.close()
+        except Exception:
+            pass  # 瀏覽器已崩潰或已關閉時，context 也已不存在
+
+    async def _fetch(self, url: str) -> str:
+        slot = await self._slots.get()
+        try:
+            if slot is None or not slot.context.browser or not slot.context.browser.is_connected():
+                slot = await self._new_slot()
+            await slot.page.goto(url, timeout=self.timeout * 1000, wait_until="load")
+            if self.settle_timeout:
+                try:
+                    await slot.page.wait_for_load_state("networkidle", timeout=self.settle_timeout * 1000)
+                except Exception:
+                    pass  # 持續有長輪詢或追蹤請求的網站不會閒置，逾時後直接使用目前渲染的內容
+            html = await slot.page.content()
+            slot.uses += 1
+            return html
+        except Exception:
+            # 出錯的分頁狀態不明 (可能卡在載入中)，直接丟棄整個 context
+            if slot is not None:
+                await self._close_slot(slot)
+                slot = None
+            raise
+        finally:
+            if slot is not None and slot.uses >= self.recycle_after:
+                await self._close_slot(slot)
+                slot = None
+            self._slots.put_nowait(slot)
+
+    def fetch_html(self, url: str) -> str:
+        """以池中的分頁載入網址並返回渲染後的 HTML；可從任意執行緒呼叫。失敗時拋出例外。"""
+        future = asyncio.run_coroutine_threadsafe(self._fetch(url), self._loop)
+        return future.result()
+
+    async def _close(self):
+        while not self._slots.empty():
+            slot = self._slots.get_nowait()
+            if slot is not None:
+                await self._close_slot(slot)
+        if self._browser is not None:
+            await self._browser.close()
+        if self._playwright is not None:
+            await self._playwright.stop()
+
+    def close(self):
+        if not self._loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(), self._loop).result(timeout=10)
+        except Exception as e:
+            print(f"⚠️ 關閉瀏覽器池時發生錯誤: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_browser_pool(config: dict = None) -> BrowserPool:
+    """返回進程內共用的 BrowserPool (第一次使用時建立，進程結束時關閉)。"""
+    global _pool
+    pool_config = (config or {}).get("BROWSER_POOL", {})
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool(
+                size=pool_config.get("size", 2),
+                recycle_after=pool_config.get("recycle_after", 50),
+                blocked_resources=pool_config.get("blocked_resources", DEFAULT_BLOCKED_RESOURCES),
+                timeout=pool_config.get("timeout", 20),
+                settle_timeout=pool_config.get("settle_timeout", 5),
+            )
+            atexit.register(_pool.close)
+        return _pool
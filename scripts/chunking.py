@@ -0,0 +1,87 @@
+# scripts/chunking.py
+# 長文本的 map-reduce 前處理：依 token 預算切塊，併發地為每塊生成重點筆記 (map)，再交給原本的 agent 做最終合成 (reduce)。
+import re
+
+from .llm_handler import query_llm, estimate_tokens
+from .llm_executor import get_llm_executor
+
+MAP_SYSTEM_PROMPT = """
+你是一位嚴謹的筆記整理助理。使用者會提供一篇長文的其中一段，你的任務是把這一段濃縮成條理清楚的重點筆記。
+**重要規則：所有輸出都必須使用「繁體中文」(Traditional Chinese) 來書寫，絕對不允許出現任何簡體字。**
+保留所有關鍵事實、數據、名詞、論點與結論，刪去重複、廣告、導覽列等雜訊。只輸出筆記本身，不要加任何開場白或說明。
+"""
+
+_SENTENCE_PATTERN = re.compile(r'(?<=[。！？!?；;])|(?<=\.)\s+')
+
+def _split_oversized(text: str, max_tokens: int) -> list:
+    """把超過預算的單一段落依句子切開；單一句子仍然過長時，依字元數硬切。"""
+    pieces = []
+    for sentence in (s for s in _SENTENCE_PATTERN.split(text) if s and s.strip()):
+        if estimate_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+            continue
+        # 以最保守的比例 (1 字元約 1 token) 估算每段的字元數
+        for start in range(0, len(sentence), max_tokens):
+            pieces.append(sentence[start:start + max_tokens])
+    return pieces
+
+def split_into_chunks(text: str, max_tokens: int) -> list:
+    """
+    將文本切成估算 token 數不超過 max_tokens 的區塊。
+    優先在段落邊界切分，其次是句子邊界，盡量讓每塊都是語意完整的片段。
+    """
+    units = []
+    for paragraph in text.split("\n"):
+        if not paragraph.strip():
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            units.append(paragraph)
+        else:
+            units.extend(_split_oversized(paragraph, max_tokens))
+
+    chunks, current, current_tokens = [], [], 0
+    for unit in units:
+        tokens = estimate_tokens(unit) + 1
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def _summarize_chunk(numbered_chunk) -> str:
+    (number, total, chunk), config = numbered_chunk
+    user_prompt = f"以下是長文的第 {number}/{total} 段，請整理成重點筆記：\n\n---\n{chunk}\n---"
+    return query_llm(MAP_SYSTEM_PROMPT, user_prompt, config, use_json_format=False)
+
+def condense_long_content(content: str, config: dict) -> str:
+    """
+    若內容超過 CHUNKING.max_input_tokens，先切塊並併發生成每塊的重點筆記 (map)，
+    返回依原順序拼接的筆記，供呼叫端以原本的 prompt 產生相同 JSON 結構的結果 (reduce)。
+    拼接後仍然過長時 (極長的輸入)，會對筆記再做一輪 map，最多 CHUNKING.max_rounds 輪。
+    未超過預算的內容原樣返回；某一塊處理失敗時，保留該塊原文，避免遺失內容。
+    """
+    chunking_config = config.get("CHUNKING", {})
+    if not chunking_config.get("enabled", True) or not content:
+        return content
+
+    max_input_tokens = chunking_config.get("max_input_tokens", 6000)
+    chunk_tokens = chunking_config.get("chunk_tokens", 2000)
+    executor = get_llm_executor(config)
+
+    for round_number in range(1, chunking_config.get("max_rounds", 2) + 1):
+        input_tokens = estimate_tokens(content)
+        if input_tokens <= max_input_tokens:
+            break
+        chunks = split_into_chunks(content, chunk_tokens)
+        print(f"✂️ 內容約 {input_tokens} tokens，超過上限 {max_input_tokens}；第 {round_number} 輪切成 {len(chunks)} 塊並行摘要...")
+        numbered = [((number, len(chunks), chunk), config) for number, chunk in enumerate(chunks, start=1)]
+        summaries = executor.map(_summarize_chunk, numbered)
+        content = "\n\n".join(
+            f"[第 {number} 段重點]\n{(summary or chunk).strip()}"
+            for number, (chunk, summary) in enumerate(zip(chunks, summaries), start=1)
+        )
+        print(f"✅ 第 {round_number} 輪摘要完成，內容縮減為約 {estimate_tokens(content)} tokens。")
+    return content
@@ -0,0 +1,241 @@
+# scripts/dedup_handler.py
+# 收錄時的重複偵測：完全相同的內容以雜湊比對，近似重複以 MinHash + LSH 比對，都在呼叫 LLM 與寫入 Notion 之前完成。
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from contextlib import closing
+
+import numpy as np
+
+DEFAULT_INDEX_PATH = os.path.join("data", "dedup_index.db")
+
+_CJK_CHAR = r'぀-ヿ㐀-䶿一-鿿豈-﫿가-힯'
+_TOKEN_PATTERN = re.compile(rf'[{_CJK_CHAR}]+|[^\W{_CJK_CHAR}]+')
+_CJK_RUN = re.compile(rf'^[{_CJK_CHAR}]+$')
+_HASH_SHIFT = np.uint64(32)
+
+def normalize_text(text: str) -> str:
+    """全形/半形統一 (NFKC)、轉小寫並合併空白，讓排版上的差異不影響比對。"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize("NFKC", text).lower()).strip()
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+def make_shingles(text: str, word_size: int = 3) -> set:
+    """
+    產生用於 MinHash 的片段集合。
+    中日韓文字沒有空白分詞，以連續字元的 2-gram 作為片段；其餘文字以連續 word_size 個單字為片段。
+    標點符號與空白不參與比對。
+    """
+    shingles, words = set(), []
+    for token in _TOKEN_PATTERN.findall(normalize_text(text)):
+        if _CJK_RUN.match(token):
+            if len(token) == 1:
+                shingles.add(token)
+            shingles.update(token[i:i + 2] for i in range(len(token) - 1))
+        else:
+            words.append(token)
+    if len(words) < word_size:
+        shingles.update(words)
+    else:
+        shingles.update(" ".join(words[i:i + word_size]) for i in range(len(words) - word_size + 1))
+    return shingles
+
+class MinHasher:
+    """以 multiply-shift 雜湊族一次計算所有排列的 MinHash 簽章 (NumPy 向量化)。"""
+
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        # 乘數必須為奇數，才能讓 uint64 乘法成為一對一映射
+        self.a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingles: set) -> np.ndarray:
+        if not shingles:
+            return np.full(len(self.a), np.iinfo(np.uint32).max, dtype=np.uint32)
+        values = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles],
+            dtype=np.uint64
+        )
+        with np.errstate(over="ignore"):
+            hashed = (self.a[:, None] * values[None, :] + self.b[:, None]) >> _HASH_SHIFT
+        return hashed.min(axis=1).astype(np.uint32)
+
+class DedupIndex:
+    """
+    收錄內容的本地索引 (SQLite)。
+    - 完全重複：正規化後內容的 SHA-256 相同。
+    - 近似重複：MinHash 簽章切成 bands 段，任一段完全相同即為候選，再以簽章估算的 Jaccard 相似度確認。
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH, num_perm: int = 128, bands: int = 32, threshold: float = 0.8):
+        if num_perm % bands:
+            raise ValueError("num_perm 必須能被 bands 整除")
+        self.path = path
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm)
+        self.lock = threading.Lock()
+        index_dir = os.path.dirname(path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    content_hash TEXT NOT NULL UNIQUE,
+                    signature BLOB NOT NULL,
+                    page_id TEXT,
+                    url TEXT,
+                    title TEXT,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, bucket TEXT NOT NULL, doc_id INTEGER NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_bands ON bands (band, bucket)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _band_buckets(self, signature: np.ndarray) -> list:
+        return [
+            (band, signature[band * self.rows_per_band:(band + 1) * self.rows_per_band].tobytes().hex())
+            for band in range(self.bands)
+        ]
+
+    def fingerprint(self, text: str) -> tuple[str, np.ndarray]:
+        return content_hash(text), self.hasher.signature(make_shingles(text))
+
+    def find_duplicate(self, text: str, fingerprint: tuple = None):
+        """
+        返回最相似的已收錄內容：{"kind": "exact" 或 "near", "similarity", "page_id", "url", "title"}；
+        沒有達到閾值的內容時返回 None。
+        """
+        digest, signature = fingerprint or self.fingerprint(text)
+        with self.lock, closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT page_id, url, title FROM documents WHERE content_hash = ?", (digest,)).fetchone()
+            if row:
+                return {"kind": "exact", "similarity": 1.0, "page_id": row[0], "url": row[1], "title": row[2]}
+
+            candidate_ids = set()
+            for band, bucket in self._band_buckets(signature):
+                candidate_ids.update(doc_id for (doc_id,) in conn.execute(
+                    "SELECT doc_id FROM bands WHERE band = ? AND bucket = ?", (band, bucket)))
+            best = None
+            for doc_id in candidate_ids:
+                blob, page_id, url, title = conn.execute(
+                    "SELECT signature, page_id, url, title FROM documents WHERE id = ?", (doc_id,)).fetchone()
+                similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+                if similarity >= self.threshold and (best is None or similarity > best["similarity"]):
+                    best = {"kind": "near", "similarity": similarity, "page_id": page_id, "url": url, "title": title}
+            return best
+
+    def add(self, text: str, page_id: str = None, url: str = None, title: str = None, fingerprint: tuple = None):
+        """登記一筆已收錄的內容；相同內容重複登記時忽略。"""
+        digest, signature = fingerprint or self.fingerprint(text)
+        with self.lock, closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO documents (content_hash, signature, page_id, url, title, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (digest, signature.tobytes(), page_id, url, title, time.time())
+            )
+            if cursor.rowcount:
+                conn.executemany(
+                    "INSERT INTO bands (band, bucket, doc_id) VALUES (?, ?, ?)",
+                    [(band, bucket, cursor.lastrowid) for band, bucket in self._band_buckets(signature)]
+                )
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_dedup_index(config: dict):
+    """返回進程內共用的 DedupIndex；若 DEDUP_CONFIG.enabled 為 false 則返回 None。"""
+    global _index
+    dedup_config = config.get("DEDUP_CONFIG", {})
+    if not dedup_config.get("enabled", True):
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = DedupIndex(
+                path=dedup_config.get("path", DEFAULT_INDEX_PATH),
+                num_perm=dedup_config.get("num_perm", 128),
+                bands=dedup_config.get("bands", 32),
+                threshold=dedup_config.get("threshold", 0.8),
+            )
+        return _index
+
+def check_duplicate(raw_content: str, config: dict):
+    """收錄前的檢查：返回已收錄的重複內容資訊 (見 DedupIndex.find_duplicate)，或 None。"""
+    index = get_dedup_index(config)
+    if index is None:
+        return None
+    try:
+        return index.find_duplicate(raw_content)
+    except sqlite3.Error as e:
+        print(f"⚠️ 無法讀取重複內容索引，略過重複檢查: {e}")
+        return None
+
+def register_content(raw_content: str, config: dict, page_id: str = None, url: str = None, title: str = None):
+    """成功寫入 Notion 後，將內容登記到重複內容索引。"""
+    index = get_dedup_index(config)
+    if index is None:
+        return
+    try:
+        index.add(raw_content, page_id=page_id, url=url, title=title)
+    except sqlite3.Error as e:
+        print(f"⚠️ 無法寫入重複內容索引: {e}")
+
+class BatchDeduplicator:
+    """
+    批次匯入 (add-batch、add-urls) 用的重複檢查：除了已收錄的內容，也比對同一批次中先前已被接受的項目。
+    這些項目要等寫入 Notion 後才會登記到索引，若只查索引，同一批次中兩則相似的內容都會通過。
+    check() 可從多個執行緒同時呼叫；通過檢查的內容會立即記入本批次。
+    """
+
+    def __init__(self, config: dict, force: bool = False):
+        self.index = None if force else get_dedup_index(config)
+        self.accepted = []
+        self.lock = threading.Lock()
+
+    def check(self, raw_content: str, label: str = None):
+        """返回重複內容資訊 (格式同 DedupIndex.find_duplicate)，或 None (並將此內容記入本批次)。"""
+        if self.index is None:
+            return None
+        digest, signature = fingerprint = self.index.fingerprint(raw_content)
+        try:
+            duplicate = self.index.find_duplicate(raw_content, fingerprint)
+        except sqlite3.Error as e:
+            print(f"⚠️ 無法讀取重複內容索引，只檢查本批次內的重複: {e}")
+            duplicate = None
+        if duplicate:
+            return duplicate
+
+        with self.lock:
+            best = None
+            for accepted_digest, accepted_signature, accepted_label in self.accepted:
+                if accepted_digest == digest:
+                    best = {"kind": "exact", "similarity": 1.0}
+                else:
+                    similarity = float(np.mean(accepted_signature == signature))
+                    if similarity < self.index.threshold or (best is not None and similarity <= best["similarity"]):
+                        continue
+                    best = {"kind": "near", "similarity": similarity}
+                best.update(page_id=None, url=None, title=f"本批次中的 {accepted_label}")
+                if best["kind"] == "exact":
+                    break
+            if best is None:
+                self.accepted.append((digest, signature, label or raw_content.strip()[:30]))
+            return best
+
+def describe_duplicate(duplicate: dict) -> str:
+    """重複內容的簡短說明，用於日誌與 UI。"""
+    kind = "完全相同" if duplicate["kind"] == "exact" else f"相似度約 {duplicate['similarity']:.0%}"
+    title = duplicate.get("title") or "(無標題)"
+    link = f" (https://www.notion.so/{duplicate['page_id'].replace('-', '')})" if duplicate.get("page_id") else ""
+    return f"此內容已收錄過 ({kind})：「{title}」{link}"
@@ -0,0 +1,105 @@
+# scripts/embedding_benchmark.py
+# 比較 PyTorch 與 ONNX Runtime int8 兩種嵌入後端的準確度、吞吐量與記憶體用量。
+import os
+import time
+
+import numpy as np
+
+from .similarity_handler import get_model, _get_backend
+
+SAMPLE_TEXTS = [
+    "如何在本地端部署大型語言模型並控制記憶體用量",
+    "Notion API 的速率限制與重試策略",
+    "向量資料庫的近似最近鄰搜尋：IVF 與 HNSW 的取捨",
+    "每週回顧的習慣如何幫助長期知識累積",
+    "Using SQLite WAL mode to allow concurrent readers",
+    "A practical guide to int8 quantization for CPU inference",
+    "番茄工作法與深度工作的比較",
+    "閱讀筆記：原子習慣中的兩分鐘法則",
+]
+
+def _rss_mb():
+    """目前進程的常駐記憶體 (MB)；未安裝 psutil 時返回 None。"""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process(os.getpid()).memory_info().rss / (1024 * 1024)
+
+def _measure(config: dict, texts: list, batch_size: int, repeats: int) -> dict:
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    model = get_model(config)
+    load_seconds = time.perf_counter() - start
+    rss_after = _rss_mb()
+
+    model.encode(texts[:batch_size], batch_size=batch_size)  # 預熱
+    start = time.perf_counter()
+    for _ in range(repeats):
+        vectors = model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    elapsed = time.perf_counter() - start
+    return {
+        "vectors": np.asarray(vectors, dtype=np.float32),
+        "load_seconds": load_seconds,
+        "texts_per_second": len(texts) * repeats / elapsed,
+        "rss_delta_mb": None if rss_before is None else rss_after - rss_before,
+    }
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def run_embedding_benchmark(config: dict, texts: list = None, batch_size: int = 32, repeats: int = 3, k: int = 5) -> dict:
+    """
+    以同一批文本分別執行 PyTorch 與 ONNX int8 後端 (ONNX 使用 EMBEDDING_CONFIG.quantization)，返回並印出：
+    - 準確度：兩個後端對同一文本的向量餘弦相似度 (平均/最小)，以及 top-k 近鄰的重疊比例。
+    - 吞吐量：每秒編碼的文本數 (以及除以 CPU 核心數的每核數值)。
+    - 記憶體：載入模型前後的常駐記憶體差 (需要 psutil)。
+    先量測 PyTorch 再量測 ONNX，ONNX 的記憶體差不含已載入的 torch。
+    """
+    texts = texts or SAMPLE_TEXTS
+    _, quantization = _get_backend(config)
+    embedding_config = config.get("EMBEDDING_CONFIG", {})
+    backends = {
+        "torch": {**config, "EMBEDDING_CONFIG": {**embedding_config, "backend": "torch"}},
+        "onnx-int8": {**config, "EMBEDDING_CONFIG": {**embedding_config, "backend": "onnx-int8", "quantization": quantization}},
+    }
+    cores = os.cpu_count() or 1
+    results = {}
+    for name, backend_config in backends.items():
+        print(f"⏱️ 正在量測 {name} 後端 ({len(texts)} 段文本 × {repeats} 次)...")
+        results[name] = _measure(backend_config, texts, batch_size, repeats)
+
+    reference = _normalize(results["torch"]["vectors"])
+    candidate = _normalize(results["onnx-int8"]["vectors"])
+    cosine = np.sum(reference * candidate, axis=1)
+
+    # 以 torch 向量的 top-k 近鄰為基準，計算 int8 向量的 top-k 重疊比例
+    k = min(k, len(texts) - 1)
+    overlap = None
+    if k > 0:
+        def neighbours(vectors):
+            similarity = vectors @ vectors.T
+            np.fill_diagonal(similarity, -np.inf)
+            return np.argsort(-similarity, axis=1)[:, :k]
+        overlap = float(np.mean([
+            len(set(a) & set(b)) / k for a, b in zip(neighbours(reference), neighbours(candidate))
+        ]))
+
+    print("\n--- 📊 嵌入後端比較 ---")
+    for name, result in results.items():
+        rss = f"{result['rss_delta_mb']:.0f} MB" if result["rss_delta_mb"] is not None else "n/a (未安裝 psutil)"
+        print(f"   - {name}: {result['texts_per_second']:.1f} 段/秒 ({result['texts_per_second'] / cores:.1f} 段/秒/核)，"
+              f"載入 {result['load_seconds']:.1f} 秒，記憶體增加 {rss}")
+    speedup = results["onnx-int8"]["texts_per_second"] / results["torch"]["texts_per_second"]
+    print(f"   - 加速比: {speedup:.2f}x")
+    print(f"   - 向量餘弦相似度: 平均 {cosine.mean():.4f}，最小 {cosine.min():.4f}")
+    if overlap is not None:
+        print(f"   - top-{k} 近鄰重疊率: {overlap:.1%}")
+
+    return {
+        "speedup": speedup,
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        "neighbour_overlap": overlap,
+        "backends": {name: {key: value for key, value in result.items() if key != "vectors"} for name, result in results.items()},
+    }
@@ -0,0 +1,63 @@
+# scripts/embedding_cache.py
+# 文本向量的磁碟快取 (SQLite)。鍵為模型名稱 + 文本內容的雜湊，值為 float32 向量的原始位元組。
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import closing
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.path.join("data", "embedding_cache.db")
+
+class EmbeddingCache:
+    """以內容雜湊快取向量；同一段文字只需計算一次。同一進程內的多個執行緒可共用一個實例。"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\n{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list) -> dict:
+        """返回 {鍵: 向量}，只包含已快取的鍵。"""
+        found = {}
+        with self.lock, closing(self._connect()) as conn, conn:
+            # SQLite 對單一查詢的參數數量有上限，分批查詢
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, blob in conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch):
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, items: dict):
+        now = time.time()
+        with self.lock, closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items.items()]
+            )
+
+    def clear(self):
+        with self.lock, closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM embeddings")
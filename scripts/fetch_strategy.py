@@ -0,0 +1,115 @@
+# scripts/fetch_strategy.py
+# 依網域學習網址抓取方法的成效：記錄每個方法 (tier) 的成功率、耗時與抽取到的文字量，下次優先嘗試最可能成功且最省時的方法。
+import os
+import time
+import sqlite3
+import threading
+from contextlib import closing
+from urllib.parse import urlparse
+
+DEFAULT_STRATEGY_PATH = os.path.join("data", "fetch_strategy.db")
+
+# 沒有紀錄時的預估耗時 (秒)；也決定了新網域的嘗試順序
+DEFAULT_TIER_COST = {"newspaper": 2.0, "cloudscraper": 3.0, "playwright": 6.0}
+# 舊紀錄的衰減係數：網站改版後，新的結果能較快反映在排序上
+DECAY = 0.9
+# 平均耗時與文字量以指數移動平均更新
+SMOOTHING = 0.3
+# 平均文字量不到該網域最佳方法的這個比例時，視為只拿到摘要、同意頁等殘缺內容，依比例提高預期成本
+FULL_CONTENT_RATIO = 0.5
+
+def get_domain(url: str) -> str:
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+class FetchStrategy:
+    """
+    每個 (網域, 方法) 一筆統計，存在本地 SQLite。
+    排序依「預期成本」= 平均耗時 / 成功機率 由小到大，這是依序嘗試多個可能失敗的方法時，期望總耗時最小的順序。
+    成功機率以 (成功 + 1) / (嘗試 + 2) 估計，所以沒有紀錄的方法為 0.5，新網域會依 DEFAULT_TIER_COST 的順序嘗試。
+    成功的結果也看內容量：平均文字量遠低於同網域最佳方法的方法 (例如總是拿到同意頁或付費牆前的摘要)，預期成本會依比例提高。
+    """
+
+    def __init__(self, path: str = DEFAULT_STRATEGY_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        strategy_dir = os.path.dirname(path)
+        if strategy_dir:
+            os.makedirs(strategy_dir, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tier_stats (
+                    domain TEXT NOT NULL,
+                    tier TEXT NOT NULL,
+                    successes REAL NOT NULL DEFAULT 0,
+                    failures REAL NOT NULL DEFAULT 0,
+                    avg_latency REAL,
+                    avg_chars REAL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (domain, tier)
+                )
+            """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def record(self, domain: str, tier: str, success: bool, latency: float, chars: int = 0):
+        with self.lock, closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT successes, failures, avg_latency, avg_chars FROM tier_stats WHERE domain = ? AND tier = ?",
+                (domain, tier)
+            ).fetchone()
+            successes, failures, avg_latency, avg_chars = row or (0.0, 0.0, None, None)
+            successes = successes * DECAY + (1 if success else 0)
+            failures = failures * DECAY + (0 if success else 1)
+            avg_latency = latency if avg_latency is None else avg_latency + (latency - avg_latency) * SMOOTHING
+            if success:
+                avg_chars = chars if avg_chars is None else avg_chars + (chars - avg_chars) * SMOOTHING
+            conn.execute(
+                "INSERT OR REPLACE INTO tier_stats (domain, tier, successes, failures, avg_latency, avg_chars, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (domain, tier, successes, failures, avg_latency, avg_chars, time.time())
+            )
+
+    def stats(self, domain: str) -> dict:
+        with self.lock, closing(self._connect()) as conn, conn:
+            rows = conn.execute(
+                "SELECT tier, successes, failures, avg_latency, avg_chars FROM tier_stats WHERE domain = ?", (domain,)
+            ).fetchall()
+        return {
+            tier: {"successes": s, "failures": f, "avg_latency": latency, "avg_chars": chars}
+            for tier, s, f, latency, chars in rows
+        }
+
+    def order(self, domain: str, tiers: list) -> list:
+        """返回依預期成本排序的方法列表 (同分時保持 tiers 原本的順序)。"""
+        stats = self.stats(domain)
+        best_chars = max((entry["avg_chars"] or 0 for entry in stats.values()), default=0)
+
+        def expected_cost(tier):
+            entry = stats.get(tier, {})
+            successes, failures = entry.get("successes", 0), entry.get("failures", 0)
+            probability = (successes + 1) / (successes + failures + 2)
+            latency = entry.get("avg_latency") or DEFAULT_TIER_COST.get(tier, 5.0)
+            # 沒有成功紀錄的方法無從比較內容量，只依成功率與耗時排序
+            quality = 1.0
+            if entry.get("avg_chars") and best_chars:
+                quality = max(0.05, min(1.0, entry["avg_chars"] / best_chars / FULL_CONTENT_RATIO))
+            return latency / (probability * quality)
+
+        return sorted(tiers, key=expected_cost)
+
+_strategy = None
+_strategy_lock = threading.Lock()
+
+def get_fetch_strategy(config: dict = None):
+    """返回進程內共用的 FetchStrategy；若 FETCH_CONFIG.learn 為 false 則返回 None (固定順序)。"""
+    global _strategy
+    fetch_config = (config or {}).get("FETCH_CONFIG", {})
+    if not fetch_config.get("learn", True):
+        return None
+    with _strategy_lock:
+        if _strategy is None:
+            _strategy = FetchStrategy(fetch_config.get("path", DEFAULT_STRATEGY_PATH))
+        return _strategy
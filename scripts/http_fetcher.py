@@ -0,0 +1,204 @@
+# scripts/http_fetcher.py
+# 網址抓取的 HTTP 層：共用的連線池 session、串流下載 (大小上限 + 提早拒絕非 HTML 內容)，
+# 以及依 ETag/Last-Modified 進行條件式請求的本地快取，重複剪藏同一網址時只需一個 304。
+import os
+import time
+import zlib
+import sqlite3
+import threading
+from contextlib import closing
+
+import cloudscraper
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import UnicodeDammit
+
+DEFAULT_CACHE_PATH = os.path.join("data", "fetch_cache.db")
+DEFAULT_ALLOWED_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+USER_AGENT = "Mozilla/5.0"
+CHUNK_SIZE = 64 * 1024
+
+class FetchRejected(Exception):
+    """回應不適合擷取文字 (非 HTML、過大或 HTTP 錯誤)，下載已提早中止。"""
+
+class FetchCache:
+    """
+    以 SQLite 儲存已抓取網頁的驗證資訊 (ETag、Last-Modified) 與壓縮後的內容。
+    同一進程內的多個執行緒可共用一個實例；依存活時間與總大小 (LRU) 淘汰。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = 100 * 1024 * 1024, max_age_days: float = 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 86400
+        self.lock = threading.Lock()
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_access ON pages (last_access)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get(self, url: str):
+        """返回 {"etag", "last_modified", "body"}；不存在或已過期時返回 None。"""
+        now = time.time()
+        with self.lock, closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT etag, last_modified, body, created_at FROM pages WHERE url = ?", (url,)).fetchone()
+            if not row:
+                return None
+            etag, last_modified, body, created_at = row
+            if now - created_at > self.max_age_seconds:
+                conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+                return None
+            conn.execute("UPDATE pages SET last_access = ? WHERE url = ?", (now, url))
+        return {"etag": etag, "last_modified": last_modified, "body": zlib.decompress(body).decode("utf-8")}
+
+    def put(self, url: str, etag: str, last_modified: str, body: str):
+        now = time.time()
+        compressed = zlib.compress(body.encode("utf-8"))
+        with self.lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pages (url, etag, last_modified, body, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, compressed, len(compressed), now, now)
+            )
+            self._evict(conn, now)
+
+    def touch(self, url: str):
+        """304 時延長項目的存活時間。"""
+        now = time.time()
+        with self.lock, closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE pages SET created_at = ?, last_access = ? WHERE url = ?", (now, now, url))
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """先刪除過期項目，再依最後存取時間 (LRU) 刪除，直到總大小低於上限。"""
+        conn.execute("DELETE FROM pages WHERE created_at < ?", (now - self.max_age_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        stale_urls = []
+        for url, size in conn.execute("SELECT url, size FROM pages ORDER BY last_access"):
+            stale_urls.append((url,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM pages WHERE url = ?", stale_urls)
+
+_cache = None
+_session = None
+_scrapers = threading.local()
+_lock = threading.Lock()
+
+def get_fetch_cache(config: dict = None):
+    """返回進程內共用的 FetchCache；若 HTTP_FETCH.cache 為 false 則返回 None。"""
+    global _cache
+    fetch_config = (config or {}).get("HTTP_FETCH", {})
+    if not fetch_config.get("cache", True):
+        return None
+    with _lock:
+        if _cache is None:
+            _cache = FetchCache(
+                path=fetch_config.get("cache_path", DEFAULT_CACHE_PATH),
+                max_bytes=int(fetch_config.get("cache_max_mb", 100) * 1024 * 1024),
+                max_age_days=fetch_config.get("cache_max_age_days", 30),
+            )
+        return _cache
+
+def get_http_session(config: dict = None) -> requests.Session:
+    """返回進程內共用的 requests.Session；各網域的 keep-alive 連線會被重複使用。"""
+    global _session
+    pool_size = (config or {}).get("HTTP_FETCH", {}).get("pool_size", 10)
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _session.headers["User-Agent"] = USER_AGENT
+        return _session
+
+def get_scraper() -> cloudscraper.CloudScraper:
+    """
+    返回目前執行緒共用的 cloudscraper session。
+    cloudscraper 會在 session 上保存 Cloudflare 驗證狀態，不適合多執行緒同時使用，所以每個執行緒各一個。
+    """
+    scraper = getattr(_scrapers, "scraper", None)
+    if scraper is None:
+        scraper = _scrapers.scraper = cloudscraper.create_scraper()
+    return scraper
+
+def _decode(body: bytes, content_type: str) -> str:
+    if "charset=" in content_type:
+        charset = content_type.split("charset=")[-1].split(";")[0].strip().strip('"')
+        try:
+            return body.decode(charset, errors="replace")
+        except LookupError:
+            pass
+    # 沒有宣告編碼時，由 <meta charset> 或內容推測
+    return UnicodeDammit(body, is_html=True).unicode_markup or ""
+
+def fetch_html(url: str, config: dict = None, session: requests.Session = None, timeout: float = 15) -> str:
+    """
+    以串流方式下載網頁並返回文字內容。
+    - 有快取時帶上 If-None-Match / If-Modified-Since；伺服器回應 304 時直接使用快取內容。
+    - Content-Type 不在 HTTP_FETCH.allowed_content_types 中 (例如 PDF、影片) 時，讀取本文前就中止。
+    - 超過 HTTP_FETCH.max_mb 時中止下載 (先看 Content-Length，再於串流中累計)。
+    失敗時拋出 FetchRejected 或 requests 的例外。
+    """
+    fetch_config = (config or {}).get("HTTP_FETCH", {})
+    max_bytes = int(fetch_config.get("max_mb", 5) * 1024 * 1024)
+    allowed_types = tuple(fetch_config.get("allowed_content_types", DEFAULT_ALLOWED_TYPES))
+    session = session or get_http_session(config)
+    cache = get_fetch_cache(config)
+
+    cached = cache.get(url) if cache else None
+    headers = {}
+    if cached:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as res:
+        if res.status_code == 304 and cached:
+            print("♻️ 網頁未變更 (304)，使用本地快取。")
+            cache.touch(url)
+            return cached["body"]
+        if res.status_code != 200:
+            raise FetchRejected(f"HTTP {res.status_code}")
+
+        content_type = res.headers.get("Content-Type", "").lower()
+        if content_type and not content_type.split(";")[0].strip().startswith(allowed_types):
+            raise FetchRejected(f"不支援的內容類型: {content_type}")
+        declared_length = res.headers.get("Content-Length", "")
+        if declared_length.isdigit() and int(declared_length) > max_bytes:
+            raise FetchRejected(f"內容過大 ({int(declared_length) / 1024 / 1024:.1f} MB)")
+
+        chunks, received = [], 0
+        for chunk in res.iter_content(CHUNK_SIZE):
+            received += len(chunk)
+            if received > max_bytes:
+                raise FetchRejected(f"內容超過 {max_bytes / 1024 / 1024:.0f} MB，已中止下載")
+            chunks.append(chunk)
+        html = _decode(b"".join(chunks), content_type)
+
+        etag, last_modified = res.headers.get("ETag"), res.headers.get("Last-Modified")
+        if cache and (etag or last_modified):
+            cache.put(url, etag, last_modified, html)
+        return html
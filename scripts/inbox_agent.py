@@ -1,34 +1,43 @@
 import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from newspaper import Article, Config
-from PIL import Image
-import pytesseract
-from .llm_handler import query_llm # 導入新的 query_llm
-from playwright.sync_api import sync_playwright
-from bs4 import BeautifulSoup
-import cloudscraper
-from bs4 import BeautifulSoup
+from .llm_handler import query_llm, estimate_tokens # 導入新的 query_llm
+from .llm_executor import get_llm_executor
+from .browser_pool import get_browser_pool
+from .fetch_strategy import get_fetch_strategy, get_domain
+from .http_fetcher import fetch_html, get_http_session, get_scraper
+from .text_extraction import extract_main_text, prepare_for_prompt
+from .ocr_engine import get_ocr_engine, format_timings
+# 單筆與批次處理共用的輸出欄位說明
+INBOX_JSON_FIELDS = """    JSON 結構應包含以下鍵：
+    - "title": (必要欄位) 為文本生成一個簡潔、精確的標題。
+    - "short_summary"(繁體中文): 生成一個不超過 5 句話的核心摘要。
+    - "extended_summary"(繁體中文): 生成一個更詳細的摘要，約 2-3 段。
+    - "category": 從以下選項中選擇最合適的一個分類：'Knowledge', 'Tool Idea', 'Process', 'Insight', 'Book Note', 'Meeting Note'。
+    - "tags": 生成 3 到 5 個相關的關鍵字標籤，以陣列形式提供。
+"""
+
 # 修改函式簽名
-def process_inbox_item(raw_content: str, config: dict) -> dict:
+def process_inbox_item(raw_content: str, config: dict, on_partial=None) -> dict:
     """
     使用 LLM 處理單一原始輸入，並回傳結構化 JSON。
+    on_partial: 串流生成期間，每當某個欄位 (例如 title) 完成時呼叫 on_partial({欄位: 值})。
     """
-    system_prompt = """
+    system_prompt = f"""
     你是一個高效的資訊處理助理。你的任務是分析使用者提供的文本，並嚴格按照指定的 JSON 格式輸出結果。
     **重要規則：你的所有輸出，包括標題、摘要和標籤，都必須使用「繁體中文」(Traditional Chinese) 來書寫，絕對不允許出現任何簡體字。**
     你的輸出必須是一個單一、有效的 JSON 物件，不包含任何額外的解釋或 markdown 標記。
     **確保所有指定的鍵都存在於 JSON 輸出中，特別是 "title"，它絕對不能被省略。**
 
-    JSON 結構應包含以下鍵：
-    - "title": (必要欄位) 為文本生成一個簡潔、精確的標題。
-    - "short_summary"(繁體中文): 生成一個不超過 5 句話的核心摘要。
-    - "extended_summary"(繁體中文): 生成一個更詳細的摘要，約 2-3 段。
-    - "category": 從以下選項中選擇最合適的一個分類：'Knowledge', 'Tool Idea', 'Process', 'Insight', 'Book Note', 'Meeting Note'。
-    - "tags": 生成 3 到 5 個相關的關鍵字標籤，以陣列形式提供。
-    """
+{INBOX_JSON_FIELDS}    """
+    # 去除多餘空白與重複行；過長的內容 (長文章、OCR 結果) 先切塊並行摘要，最後才依 token 預算截斷
+    raw_content = prepare_for_prompt(raw_content, config)
     user_prompt = f"請處理以下文本：\n\n---\n{raw_content}\n---"
     print("🧠 正在呼叫 Inbox Agent 處理內容...")
     # 使用新的 query_llm 函式
-    response_content = query_llm(system_prompt, user_prompt, config)
+    response_content = query_llm(system_prompt, user_prompt, config, on_partial=on_partial)
     if response_content:
         try:
             return json.loads(response_content)
@@ -37,6 +46,97 @@ def process_inbox_item(raw_content: str, config: dict) -> dict:
             return None
     return None
 
+def _split_into_batches(raw_contents: list, max_tokens: int, max_items: int) -> list:
+    """依 token 預算與數量上限，將 (索引, 內容) 依序切成多個批次；超過預算的單一項目自成一批。"""
+    batches, current, current_tokens = [], [], 0
+    for index, content in enumerate(raw_contents):
+        tokens = estimate_tokens(content)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append((index, content))
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _parse_batch_response(response_content: str, batch: list) -> dict:
+    """解析批次回應，返回 {在批次中的序號: 結果}；缺少或不含 title 的項目不會出現在結果中。"""
+    try:
+        data = json.loads(response_content)
+    except json.JSONDecodeError as e:
+        print(f"❌ 無法解析批次回應為 JSON: {e}")
+        return {}
+    results = data.get("results") if isinstance(data, dict) else data
+    if not isinstance(results, list):
+        return {}
+
+    parsed = {}
+    for position, result in enumerate(results):
+        if not isinstance(result, dict):
+            continue
+        # 優先使用模型回傳的 id 對應輸入；沒有 id 時才依陣列順序對應
+        item_id = result.pop("id", None)
+        number = item_id - 1 if isinstance(item_id, int) else position
+        if 0 <= number < len(batch) and result.get("title"):
+            parsed.setdefault(number, result)
+    return parsed
+
+def process_inbox_items_batch(raw_contents: list, config: dict) -> list:
+    """
+    將多則短筆記打包進同一次 LLM 請求處理，省去每則筆記各自的 prompt 評估開銷。
+    每則筆記先經過 prepare_for_prompt 清理，再依 BATCH_CONFIG.max_tokens (輸入內容的估算 token 預算) 與 BATCH_CONFIG.max_items 切分批次；
+    批次回應中無法解析或缺漏的項目，會退回以 process_inbox_item 逐筆處理。
+    多個批次會透過 LLMExecutor 併發送出，以用滿伺服器的平行槽位。
+
+    Returns:
+        與 raw_contents 順序一致的結果列表；處理失敗的項目為 None。
+    """
+    batch_config = config.get("BATCH_CONFIG", {})
+    # 與單筆處理相同，先清理 (過長的筆記會先被摘要)，批次切分也以精簡後的長度計算
+    raw_contents = [prepare_for_prompt(content, config) for content in raw_contents]
+    batches = _split_into_batches(raw_contents, batch_config.get("max_tokens", 3000), batch_config.get("max_items", 20))
+    results = [None] * len(raw_contents)
+
+    system_prompt = f"""
+    你是一個高效的資訊處理助理。使用者會提供多則以編號分隔的文本，你必須逐則分析，並嚴格按照指定的 JSON 格式輸出結果。
+    **重要規則：你的所有輸出，包括標題、摘要和標籤，都必須使用「繁體中文」(Traditional Chinese) 來書寫，絕對不允許出現任何簡體字。**
+    你的輸出必須是一個單一、有效的 JSON 物件，不包含任何額外的解釋或 markdown 標記，格式為：
+    {{"results": [{{"id": 1, ...}}, {{"id": 2, ...}}]}}
+    "results" 陣列必須依照輸入順序，為每一則文本各輸出一個物件，並以 "id" 標明對應的文本編號。
+    **確保每個物件都包含所有指定的鍵，特別是 "title"，它絕對不能被省略。**
+
+    每個物件的{INBOX_JSON_FIELDS.strip()}
+    """
+
+    def process_batch(numbered_batch):
+        batch_number, batch = numbered_batch
+        if len(batch) == 1:
+            index, content = batch[0]
+            return [(index, process_inbox_item(content, config))]
+
+        sections = "\n\n".join(f"[{number}]\n---\n{content}\n---" for number, (_, content) in enumerate(batch, start=1))
+        user_prompt = f"請處理以下 {len(batch)} 則文本：\n\n{sections}"
+        print(f"🧠 正在呼叫 Inbox Agent 批次處理第 {batch_number}/{len(batches)} 批 ({len(batch)} 則)...")
+        response_content = query_llm(system_prompt, user_prompt, config)
+        parsed = _parse_batch_response(response_content, batch) if response_content else {}
+
+        batch_results = []
+        for number, (index, content) in enumerate(batch):
+            if number in parsed:
+                batch_results.append((index, parsed[number]))
+            else:
+                print(f"⚠️ 批次回應缺少第 {number + 1} 則的有效結果，改為單獨處理...")
+                batch_results.append((index, process_inbox_item(content, config)))
+        return batch_results
+
+    # 各批次同時送出，在途請求數等於 LLM 後端的平行槽位數
+    for batch_results in get_llm_executor(config).map(process_batch, list(enumerate(batches, start=1))):
+        for index, result in batch_results or []:
+            results[index] = result
+
+    return results
+
 # def get_content_from_url(url: str) -> str:
 #     """
 #     從 URL 抓取主要文章內容，並偽裝成瀏覽器以避免 403 錯誤。
@@ -54,77 +154,143 @@ def process_inbox_item(raw_content: str, config: dict) -> dict:
 #         print(f"❌ 從 URL 抓取內容失敗: {e}")
 #         return None
 
-def get_content_from_url(url: str) -> str:
-    """
-    抓取文章內容，並顯示是用哪一種方法成功
-    """
-    print(f"🕸️ 正在從 URL 抓取內容: {url}")
+def _fetch_with_newspaper(url: str, app_config: dict) -> str:
+    config = Config()
+    config.browser_user_agent = "Mozilla/5.0"
+    config.request_timeout = 10
 
-    # --- Tier 1: newspaper ---
-    try:
-        config = Config()
-        config.browser_user_agent = "Mozilla/5.0"
-        config.request_timeout = 10
+    # 由共用 session 串流下載 (含大小上限與條件式請求)，newspaper 只負責解析
+    html = fetch_html(url, app_config, session=get_http_session(app_config), timeout=10)
+    article = Article(url, config=config)
+    article.download(input_html=html)
+    article.parse()
+    if article.text.strip():
+        return f"Title: {article.title}\n\n{article.text}"
+    return None
 
-        article = Article(url, config=config)
-        article.download()
-        article.parse()
+def _fetch_with_cloudscraper(url: str, app_config: dict) -> str:
+    text = extract_main_text(fetch_html(url, app_config, session=get_scraper(), timeout=15))
+    if text.strip():
+        return f"(cloudscraper)\n\n{text.strip()}"
+    return None
 
-        if article.text.strip():
-            print("✅ 成功 (newspaper)")
-            return f"Title: {article.title}\n\n{article.text}"
+def _fetch_with_playwright(url: str, app_config: dict) -> str:
+    # 使用長駐的瀏覽器與分頁池，不再為每個網址啟動一次 Chromium
+    text = extract_main_text(get_browser_pool(app_config).fetch_html(url))
+    if text.strip():
+        return f"(playwright)\n\n{text.strip()}"
+    return None
 
-    except Exception as e:
-        print(f"⚠️ newspaper 失敗: {e}")
+FETCH_TIERS = {
+    "newspaper": _fetch_with_newspaper,
+    "cloudscraper": _fetch_with_cloudscraper,
+    "playwright": _fetch_with_playwright,
+}
 
-    # --- Tier 2: cloudscraper ---
+def _run_fetch_tier(tier: str, url: str, app_config: dict, min_chars: int) -> str:
+    """執行一個抓取方法並記錄成效；抽取到的文字少於 min_chars 時視為失敗 (例如驗證頁、付費牆)，但仍返回文字。"""
+    strategy = get_fetch_strategy(app_config)
+    start = time.perf_counter()
     try:
-        scraper = cloudscraper.create_scraper()
-        res = scraper.get(url, timeout=15)
-
-        if res.status_code == 200:
-            soup = BeautifulSoup(res.text, "html.parser")
-
-            article_tag = soup.find("article") or soup.find("main")
-            text = article_tag.get_text(separator="\n") if article_tag else soup.get_text()
+        text = FETCH_TIERS[tier](url, app_config)
+    except Exception as e:
+        print(f"⚠️ {tier} 失敗: {e}")
+        text = None
+    chars = len(text.strip()) if text else 0
+    if strategy:
+        strategy.record(get_domain(url), tier, chars >= min_chars, time.perf_counter() - start, chars)
+    return text
 
-            if text.strip():
-                print("✅ 成功 (cloudscraper)")
-                return f"(cloudscraper)\n\n{text.strip()}"
+_race_pool = None
+_race_pool_lock = threading.Lock()
 
-    except Exception as e:
-        print(f"⚠️ cloudscraper 失敗: {e}")
+def _get_race_pool(app_config: dict) -> ThreadPoolExecutor:
+    """
+    返回進程內共用、大小固定 (FETCH_CONFIG.race_workers) 的競速執行緒池。
+    執行緒會被重複使用，所以各執行緒的 cloudscraper session (見 http_fetcher.get_scraper) 也能跨網址沿用；
+    批次匯入時同時競速的網址再多，執行緒數也不會超過上限 (多出的工作排隊)。
+    """
+    global _race_pool
+    with _race_pool_lock:
+        if _race_pool is None:
+            workers = (app_config or {}).get("FETCH_CONFIG", {}).get("race_workers", 8)
+            _race_pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="fetch-race")
+        return _race_pool
 
-    # --- Tier 3: playwright ---
-    try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            page = browser.new_page()
+def _race_fetch_tiers(tiers: list, url: str, app_config: dict, min_chars: int):
+    """同時執行多個抓取方法，返回 (最先達到 min_chars 的方法, 文字)；都不合格時返回文字最多的結果。"""
+    pool = _get_race_pool(app_config)
+    # 較慢的方法留在背景完成 (仍會記錄成效)，不等待它們
+    futures = {pool.submit(_run_fetch_tier, tier, url, app_config, min_chars): tier for tier in tiers}
+    best_tier, best_text = None, None
+    for future in as_completed(futures):
+        text = future.result()
+        if text and len(text.strip()) >= min_chars:
+            return futures[future], text
+        if text and (best_text is None or len(text) > len(best_text)):
+            best_tier, best_text = futures[future], text
+    return best_tier, best_text
 
-            page.goto(url, timeout=20000)
-            content = page.content()
+def get_content_from_url(url: str, app_config: dict = None) -> str:
+    """
+    抓取文章內容，並顯示是用哪一種方法成功
+    app_config 用於讀取 FETCH_CONFIG 與 BROWSER_POOL 等設定 (省略時使用預設值)。
+    - 嘗試順序依該網域過去的成功率與耗時排序 (見 fetch_strategy)，新網域仍為 newspaper → cloudscraper → playwright。
+    - FETCH_CONFIG.race 為 true 時，排在最前面的便宜方法 (race_tiers) 會同時執行，採用第一個合格的結果。
+    """
+    print(f"🕸️ 正在從 URL 抓取內容: {url}")
+    fetch_config = (app_config or {}).get("FETCH_CONFIG", {})
+    min_chars = fetch_config.get("min_chars", 200)
+    race_tiers = set(fetch_config.get("race_tiers", ["newspaper", "cloudscraper"]))
 
-            soup = BeautifulSoup(content, "html.parser")
-            article_tag = soup.find("article") or soup.find("main")
-            text = article_tag.get_text(separator="\n") if article_tag else soup.get_text()
+    tiers = list(FETCH_TIERS)
+    strategy = get_fetch_strategy(app_config)
+    if strategy:
+        learned = strategy.order(get_domain(url), tiers)
+        if learned != tiers:
+            print(f"🧭 依據 {get_domain(url)} 的抓取紀錄，嘗試順序: {' → '.join(learned)}")
+        tiers = learned
 
-            browser.close()
+    fallback_tier, fallback_text = None, None
+    if fetch_config.get("race", False):
+        leading = []
+        for tier in tiers:
+            if tier not in race_tiers:
+                break
+            leading.append(tier)
+        if len(leading) > 1:
+            tier, text = _race_fetch_tiers(leading, url, app_config, min_chars)
+            if text and len(text.strip()) >= min_chars:
+                print(f"✅ 成功 ({tier})")
+                return text
+            fallback_tier, fallback_text = tier, text
+            tiers = tiers[len(leading):]
 
-            if text.strip():
-                print("✅ 成功 (playwright)")
-                return f"(playwright)\n\n{text.strip()}"
+    for tier in tiers:
+        text = _run_fetch_tier(tier, url, app_config, min_chars)
+        if text and len(text.strip()) >= min_chars:
+            print(f"✅ 成功 ({tier})")
+            return text
+        if text and (fallback_text is None or len(text) > len(fallback_text)):
+            fallback_tier, fallback_text = tier, text
 
-    except Exception as e:
-        print(f"❌ playwright 失敗: {e}")
+    # 沒有方法抽取到足夠的文字時，仍返回最長的結果 (可能本來就是短內容)
+    if fallback_text:
+        print(f"✅ 成功 ({fallback_tier}，內容較短)")
+        return fallback_text
 
     print("❌ 全部方法失敗")
     return None
 
-def get_text_from_image(image_path: str) -> str:
-    """從圖片路徑使用 OCR 提取文字。"""
+def get_text_from_image(image_path: str, app_config: dict = None) -> str:
+    """
+    從圖片路徑使用 OCR 提取文字。
+    圖片會先縮小/二值化並切成多個文字區域，各區域平行辨識 (見 ocr_engine，設定為 OCR_CONFIG)。
+    """
     try:
         print(f"🖼️ 正在從圖片進行 OCR: {image_path}")
-        text = pytesseract.image_to_string(Image.open(image_path), lang='eng+chi_tra')
+        text, timings = get_ocr_engine(app_config).recognize(image_path)
+        print(f"⏱️ OCR 耗時: {format_timings(timings)}")
         return text
     except FileNotFoundError:
         print(f"❌ 找不到圖片檔案: {image_path}")
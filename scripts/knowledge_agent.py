@@ -1,8 +1,9 @@
 import json
 from .llm_handler import query_llm # 導入新的 query_llm
+from .chunking import condense_long_content
 
 # 修改函式簽名
-def create_knowledge_node(content: str, config: dict) -> dict:
+def create_knowledge_node(content: str, config: dict, on_partial=None) -> dict:
     system_prompt = """
     你是一位知識整合專家。你的任務是將輸入的筆記和摘要，提煉成一個結構化的知識節點。
      **重要規則：你的所有輸出，包括標題、摘要和標籤，都必須使用「繁體中文」(Traditional Chinese) 來書寫，絕對不允許出現任何簡體字。**
@@ -15,12 +16,14 @@ def create_knowledge_node(content: str, config: dict) -> dict:
     - "key_insights"(繁體中文): 提煉出 2-4 個關鍵的洞見或啟發。
     - "use_cases"(繁體中文): 思考並列出該知識的潛在應用場景。
     """
+    # 過長的內容先切塊並行摘要，再以摘要生成知識節點
+    content = condense_long_content(content, config)
     user_prompt = f"請將以下內容轉換為知識節點：\n\n---\n{content}\n---"
     # ---------------------------
     
     print("🧠 正在呼叫 Knowledge Agent 生成知識節點...")
     # 使用新的 query_llm 函式
-    response_content = query_llm(system_prompt, user_prompt, config, use_json_format=True)
+    response_content = query_llm(system_prompt, user_prompt, config, use_json_format=True, on_partial=on_partial)
     if response_content:
         try:
             return json.loads(response_content)
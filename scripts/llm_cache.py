@@ -0,0 +1,109 @@
+# scripts/llm_cache.py
+# LLM 回應的磁碟快取 (SQLite)。鍵為 provider + model + system prompt + user prompt + 輸出格式的雜湊。
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import closing
+
+DEFAULT_CACHE_PATH = os.path.join("data", "llm_cache.db")
+
+class LLMCache:
+    """
+    以 SQLite 儲存 LLM 回應，支援依存活時間與總大小的 LRU 淘汰。
+    同一進程內的多個執行緒可共用一個實例。
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = 200 * 1024 * 1024, max_age_days: float = 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 86400
+        self.lock = threading.Lock()
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses (last_access)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def make_key(provider: str, model: str, system_prompt: str, user_prompt: str, use_json_format: bool) -> str:
+        payload = json.dumps([provider, model, system_prompt, user_prompt, use_json_format], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """返回快取的回應；不存在或已過期時返回 None。命中時更新最後存取時間。"""
+        now = time.time()
+        with self.lock, closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if not row:
+                return None
+            response, created_at = row
+            if now - created_at > self.max_age_seconds:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            return response
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self.lock, closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        """先刪除過期項目，再依最後存取時間 (LRU) 刪除，直到總大小低於上限。"""
+        conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        stale_keys = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            stale_keys.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+
+    def clear(self):
+        with self.lock, closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM responses")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_llm_cache(config: dict):
+    """返回進程內共用的 LLMCache；若 LLM_CACHE.enabled 為 false 則返回 None。"""
+    global _cache
+    cache_config = config.get("LLM_CACHE", {})
+    if not cache_config.get("enabled", True):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache(
+                path=cache_config.get("path", DEFAULT_CACHE_PATH),
+                max_bytes=int(cache_config.get("max_mb", 200) * 1024 * 1024),
+                max_age_days=cache_config.get("max_age_days", 30),
+            )
+        return _cache
@@ -0,0 +1,95 @@
+# scripts/llm_executor.py
+# 有界的 LLM 併發執行器：同時在途的請求數等於 LLM 後端的平行槽位數 (例如 Ollama 的 OLLAMA_NUM_PARALLEL)。
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+_worker_state = threading.local()
+
+def get_parallel_slots(config: dict) -> int:
+    """
+    返回 LLM 後端可同時處理的請求數。
+    優先使用 {PROVIDER}_CONFIG.NUM_PARALLEL；本地模式未設定時，讀取與 Ollama 伺服器相同的環境變數 OLLAMA_NUM_PARALLEL；否則為 1。
+    (Ollama 的 API 不會回報平行槽位數，所以只能由設定或環境變數得知。)
+    """
+    provider = config.get("LLM_PROVIDER", "local")
+    slots = config.get(f"{provider.upper()}_CONFIG", {}).get("NUM_PARALLEL")
+    if slots is None and provider == "local":
+        try:
+            slots = int(os.environ.get("OLLAMA_NUM_PARALLEL", ""))
+        except ValueError:
+            slots = None
+    return max(1, int(slots or 1))
+
+class LLMExecutor:
+    """
+    以執行緒池包裝 LLM 呼叫。query_llm 本身是阻塞的串流請求，多個執行緒就能讓伺服器的多個槽位同時工作。
+    真正的上限是槽位號誌 (slot())：query_llm 只在實際送出請求時持有一個槽位，所以不論呼叫端是執行器的工作、
+    巢狀的切塊摘要，還是直接在主執行緒呼叫，在途請求都不會超過伺服器的容量 (多出的會在本地排隊)。
+    等待子工作的外層工作不持有槽位，所以巢狀提交不會死鎖。
+    """
+
+    def __init__(self, slots: int = 1):
+        self.slots = max(1, slots)
+        self.semaphore = threading.BoundedSemaphore(self.slots)
+        self.pool = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix="llm")
+        # 外層工作 (例如一則筆記) 內的 map (例如長文切塊摘要) 使用另一個池，避免外層工作佔滿執行緒後等不到子工作
+        self.nested_pool = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix="llm-nested")
+
+    @contextmanager
+    def slot(self):
+        """在一次實際的模型請求期間佔用一個槽位。"""
+        with self.semaphore:
+            yield
+
+    def submit(self, func, *args, **kwargs):
+        """提交一個 LLM 工作，返回 concurrent.futures.Future。"""
+        return self.pool.submit(self._run_in_worker, 1, func, *args, **kwargs)
+
+    @staticmethod
+    def _run_in_worker(depth: int, func, *args, **kwargs):
+        _worker_state.depth = depth
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _worker_state.depth = 0
+
+    def map(self, func, items: list) -> list:
+        """
+        併發地對每個項目呼叫 func，返回與 items 順序一致的結果列表。
+        單一項目拋出例外時，該項目的結果為 None，不影響其他項目。
+        在執行器的工作中呼叫時 (巢狀提交)，子工作交給 nested_pool 併發執行；再下一層才改為依序就地執行。
+        """
+        depth = getattr(_worker_state, "depth", 0)
+        if depth == 0:
+            calls = [self.submit(func, item).result for item in items]
+        elif depth == 1:
+            calls = [self.nested_pool.submit(self._run_in_worker, 2, func, item).result for item in items]
+        else:
+            calls = [lambda item=item: func(item) for item in items]
+
+        results = []
+        for call in calls:
+            try:
+                results.append(call())
+            except Exception as e:
+                print(f"❌ LLM 工作執行失敗: {e}")
+                results.append(None)
+        return results
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+        self.nested_pool.shutdown(wait=True)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_llm_executor(config: dict) -> LLMExecutor:
+    """返回進程內共用的 LLMExecutor，大小由 get_parallel_slots 決定。"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = LLMExecutor(get_parallel_slots(config))
+            print(f"⚙️ LLM 併發執行器已建立：同時最多 {_executor.slots} 個請求。")
+        return _executor
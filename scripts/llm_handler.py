@@ -3,89 +3,284 @@ import requests
 import json
 import re
 
-def query_llm(system_prompt: str, user_prompt: str, config: dict, use_json_format: bool = True) -> str:
+from .scheduler import get_scheduler
+from .llm_cache import LLMCache, get_llm_cache
+from .llm_executor import get_llm_executor
+
+def query_llm(system_prompt: str, user_prompt: str, config: dict, use_json_format: bool = True, use_cache: bool = True,
+              on_token=None, on_partial=None) -> str:
     """
     根據設定，向本地或雲端 Ollama 服務發送請求。
+    相同 (provider, model, prompts, 格式) 的請求會優先從磁碟快取返回；use_cache=False 可略過快取。
+
+    請求一律以串流方式進行，逾時只計算「沒有收到新 token」的閒置時間，長但持續輸出的生成不會被中斷。
+    - on_token(token): 每收到一段文字就呼叫一次。
+    - on_partial(fields): JSON 模式下，每當頂層欄位 (例如 "title") 生成完整時，以 {欄位: 值} 呼叫一次。
     """
     provider = config.get("LLM_PROVIDER", "local")
     debug_mode = config.get("DEBUG_MODE", False) # 讀取偵錯模式開關
+    model = config.get("CLOUD_CONFIG" if provider == "cloud" else "LOCAL_CONFIG", {}).get("LLM_MODEL_NAME")
+
+    cache = get_llm_cache(config) if use_cache else None
+    cache_key = LLMCache.make_key(provider, model, system_prompt, user_prompt, use_json_format) if cache else None
+    if cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f"⚡ 命中 LLM 快取 (模型 '{model}')，略過模型呼叫。")
+            if on_partial and use_json_format:
+                on_partial(json.loads(cached))
+            return cached
+
+    token_callback = on_token
+    if on_partial and use_json_format:
+        parser = PartialJSONFields()
+
+        def token_callback(token: str):
+            if on_token:
+                on_token(token)
+            completed = parser.feed(token)
+            if completed:
+                on_partial(completed)
+
+    # 先取得槽位 (在途請求數不超過 NUM_PARALLEL)，再統計每個 LLM 後端的延遲與在途請求數，逾時/連線錯誤會回報給自適應排程器
+    with get_llm_executor(config).slot(), get_scheduler(config).track(f"llm:{provider}"):
+        if provider == "cloud":
+            print("☁️ 正在使用 Ollama Cloud...")
+            # 雲端模式通常比較穩定，暫不為其添加複雜的偵錯日誌
+            response = query_ollama_cloud(system_prompt, user_prompt, config.get("CLOUD_CONFIG", {}), use_json_format, token_callback)
+        else:
+            # 將 debug_mode 傳遞給本地處理函式
+            response = query_ollama_local(system_prompt, user_prompt, config.get("LOCAL_CONFIG", {}), use_json_format, debug_mode, token_callback)
+
+    if cache and response and _is_cacheable(response, use_json_format):
+        cache.put(cache_key, response)
+    return response
 
+def stream_llm(system_prompt: str, user_prompt: str, config: dict, use_json_format: bool = True):
+    """逐段產出模型生成的文字 (不經過快取)。連線錯誤或閒置逾時會拋出 requests.exceptions.RequestException。"""
+    provider = config.get("LLM_PROVIDER", "local")
     if provider == "cloud":
-        print("☁️ 正在使用 Ollama Cloud...")
-        # 雲端模式通常比較穩定，暫不為其添加複雜的偵錯日誌
-        return query_ollama_cloud(system_prompt, user_prompt, config.get("CLOUD_CONFIG", {}), use_json_format)
+        yield from _stream_ollama_cloud(system_prompt, user_prompt, config.get("CLOUD_CONFIG", {}), use_json_format)
     else:
-        # 將 debug_mode 傳遞給本地處理函式
-        return query_ollama_local(system_prompt, user_prompt, config.get("LOCAL_CONFIG", {}), use_json_format, debug_mode)
+        yield from _stream_ollama_local(system_prompt, user_prompt, config.get("LOCAL_CONFIG", {}), use_json_format)
 
-def query_ollama_cloud(system_prompt: str, user_prompt: str, cloud_config: dict, use_json_format: bool):
-    """處理對 Ollama Cloud API 的呼叫 (使用新版 /v1 API)。"""
+class PartialJSONFields:
+    """
+    增量 JSON 欄位解析器：逐段餵入模型輸出的文字，每當頂層物件中某個欄位的值完整出現時，就將其解析出來。
+    用於在生成尚未結束時，提早取得 "title" 之類的欄位。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.expecting_value = False
+        self.key_start = None
+        self.key = None
+        self.value_start = None
+        self.fields = {}
+
+    def _complete_value(self, end: int, completed: dict):
+        try:
+            value = json.loads(self.buffer[self.value_start:end])
+        except json.JSONDecodeError:
+            value = None
+        if value is not None and self.key is not None:
+            self.fields[self.key] = value
+            completed[self.key] = value
+        self.key = None
+        self.value_start = None
+        self.expecting_value = False
+
+    def feed(self, chunk: str) -> dict:
+        """餵入一段文字，返回本次新完成的欄位 {key: value}。"""
+        self.buffer += chunk
+        completed = {}
+        while self.pos < len(self.buffer):
+            i, char = self.pos, self.buffer[self.pos]
+            self.pos += 1
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1 and not self.expecting_value and self.key_start is not None:
+                        self.key = json.loads(self.buffer[self.key_start:i + 1])
+                        self.key_start = None
+                    elif self.depth == 1 and self.value_start is not None:
+                        self._complete_value(i + 1, completed)
+                continue
+
+            if self.depth == 0:
+                # 忽略 JSON 物件之前的任何前言文字
+                if char == "{":
+                    self.depth = 1
+                continue
+
+            if char == '"':
+                self.in_string = True
+                if self.depth == 1:
+                    if self.expecting_value and self.value_start is None:
+                        self.value_start = i
+                    elif not self.expecting_value:
+                        self.key_start = i
+            elif char in "{[":
+                if self.depth == 1 and self.expecting_value and self.value_start is None:
+                    self.value_start = i
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 1 and self.value_start is not None:
+                    self._complete_value(i + 1, completed)
+                elif self.depth == 0 and self.value_start is not None:
+                    self._complete_value(i, completed)
+            elif self.depth == 1:
+                if char == ":":
+                    self.expecting_value = True
+                elif char == ",":
+                    if self.value_start is not None:
+                        self._complete_value(i, completed)
+                    self.expecting_value = False
+                elif not char.isspace() and self.expecting_value and self.value_start is None:
+                    # 數字、true/false/null 等原始值
+                    self.value_start = i
+        return completed
+
+_CJK_PATTERN = re.compile(r'[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]')
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文字的 token 數 (不依賴特定模型的 tokenizer)：
+    中日韓文字約 1 字 1 token，其餘文字約 4 個字元 1 token。用於切分批次與預算控制，寧可高估。
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+def _is_cacheable(response: str, use_json_format: bool) -> bool:
+    """只快取可用的回應：要求 JSON 格式時，必須能被解析，避免重試時一再拿到同一個壞掉的結果。"""
+    if not use_json_format:
+        return bool(response.strip())
+    try:
+        json.loads(response)
+        return True
+    except json.JSONDecodeError:
+        return False
+
+def _stream_ollama_cloud(system_prompt: str, user_prompt: str, cloud_config: dict, use_json_format: bool):
+    """以 SSE 串流呼叫 Ollama Cloud (/v1 API)，逐段產出文字。"""
     api_key = cloud_config.get("OLLAMA_API_KEY")
     model = cloud_config.get("LLM_MODEL_NAME")
     api_url = "https://ollama.com/v1/chat/completions"
-
-    if not api_key or "YOUR_OLLAMA_CLOUD_API_KEY" in api_key:
-        print("❌ 錯誤：Ollama Cloud API 金鑰未設定。請在 config.json 中填寫。")
-        return None
+    idle_timeout = cloud_config.get("IDLE_TIMEOUT", 600)
 
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {api_key}"
     }
-    
+
     payload = {
         "model": model,
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
-        ]
+        ],
+        "stream": True
     }
-    
+
     if use_json_format:
         payload["response_format"] = {"type": "json_object"}
 
-    try:
-        response = requests.post(api_url, headers=headers, data=json.dumps(payload), timeout=600)
+    # timeout=(連線逾時, 讀取逾時)：讀取逾時是兩次收到資料之間的最長間隔，而不是整體生成時間
+    with requests.post(api_url, headers=headers, data=json.dumps(payload), stream=True, timeout=(10, idle_timeout)) as response:
         response.raise_for_status()
-        response_data = response.json()
-        content = response_data['choices'][0]['message']['content']
-        return content
-    except requests.exceptions.RequestException as e:
-        print(f"❌ 與 Ollama Cloud 連接時發生錯誤: {e}\n   錯誤詳情: {response.text}")
+        for line in response.iter_lines():
+            line = line.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            delta = json.loads(data)['choices'][0].get('delta', {})
+            if delta.get('content'):
+                yield delta['content']
+
+def query_ollama_cloud(system_prompt: str, user_prompt: str, cloud_config: dict, use_json_format: bool, on_token=None):
+    """處理對 Ollama Cloud API 的呼叫 (使用新版 /v1 API)。"""
+    api_key = cloud_config.get("OLLAMA_API_KEY")
+    if not api_key or "YOUR_OLLAMA_CLOUD_API_KEY" in api_key:
+        print("❌ 錯誤：Ollama Cloud API 金鑰未設定。請在 config.json 中填寫。")
         return None
-    except (KeyError, IndexError) as e:
-        print(f"❌ 解析 Ollama Cloud 回應時發生錯誤: {e}\n   收到的原始回應: {response.text}")
+
+    chunks = []
+    try:
+        for token in _stream_ollama_cloud(system_prompt, user_prompt, cloud_config, use_json_format):
+            chunks.append(token)
+            if on_token:
+                on_token(token)
+        return "".join(chunks)
+    except requests.exceptions.RequestException as e:
+        error_text = e.response.text if e.response is not None else ""
+        print(f"❌ 與 Ollama Cloud 連接時發生錯誤: {e}\n   錯誤詳情: {error_text}")
+        # 429、5xx、逾時與連線錯誤與本地模式相同地拋出，讓排程器記錄為節流；其他 4xx (例如金鑰錯誤) 重試也沒有用
+        status = e.response.status_code if e.response is not None else None
+        if status is not None and status != 429 and status < 500:
+            return None
+        raise e
+    except (json.JSONDecodeError, KeyError, IndexError) as e:
+        print(f"❌ 解析 Ollama Cloud 回應時發生錯誤: {e}\n   已收到的內容: {''.join(chunks)}")
         return None
 
-def query_ollama_local(system_prompt: str, user_prompt: str, local_config: dict, use_json_format: bool, debug_mode: bool = False):
-    """處理對本地 Ollama 的呼叫，並根據 debug_mode 決定是否打印詳細日誌。"""
+def _stream_ollama_local(system_prompt: str, user_prompt: str, local_config: dict, use_json_format: bool):
+    """以串流方式呼叫本地 Ollama 的 /api/generate，逐段產出文字。"""
     api_url = local_config.get("LLM_API_BASE_URL")
     model = local_config.get("LLM_MODEL_NAME")
     generate_url = f"{api_url}/api/generate"
     full_prompt = f"{system_prompt}\n\n{user_prompt}"
+    idle_timeout = local_config.get("IDLE_TIMEOUT", 120)
 
-    payload = {"model": model, "prompt": full_prompt, "stream": False}
+    # keep_alive 讓模型在批次處理期間保持常駐，不必每次重新載入
+    payload = {"model": model, "prompt": full_prompt, "stream": True, "keep_alive": local_config.get("KEEP_ALIVE", "30m")}
     if use_json_format:
         payload["format"] = "json"
 
+    # timeout=(連線逾時, 讀取逾時)：讀取逾時是兩次收到 token 之間的最長間隔，而不是整體生成時間
+    with requests.post(generate_url, data=json.dumps(payload), stream=True, timeout=(10, idle_timeout)) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise ValueError(data["error"])
+            if data.get("response"):
+                yield data["response"]
+            if data.get("done"):
+                break
+
+def query_ollama_local(system_prompt: str, user_prompt: str, local_config: dict, use_json_format: bool, debug_mode: bool = False,
+                       on_token=None):
+    """處理對本地 Ollama 的呼叫，並根據 debug_mode 決定是否打印詳細日誌。"""
+    model = local_config.get("LLM_MODEL_NAME")
+
     if debug_mode:
-        print(f"🐞 [偵錯模式] 正在使用模型 '{model}' 透過 API: {generate_url}")
+        print(f"🐞 [偵錯模式] 正在使用模型 '{model}' 透過 API: {local_config.get('LLM_API_BASE_URL')}/api/generate (串流)")
     else:
         print(f"💻 正在使用本地 Ollama 模型 '{model}'...")
 
+    chunks = []
     try:
-        response = requests.post(generate_url, data=json.dumps(payload), timeout=120)
-        response.raise_for_status()
-        
-        response_text = response.text.strip()
-        last_json_str = next((line for line in reversed(response_text.splitlines()) if line.strip()), None)
-        
-        if not last_json_str:
-            if debug_mode: print("🐞 [偵錯模式] AI 模型返回的原始 HTTP 回應為空或無效。")
-            return None
-
-        response_data = json.loads(last_json_str)
-        content = response_data.get('response', '')
+        for token in _stream_ollama_local(system_prompt, user_prompt, local_config, use_json_format):
+            chunks.append(token)
+            if on_token:
+                on_token(token)
+        content = "".join(chunks)
 
         if debug_mode:
             print("\n" + "="*20 + " [偵錯模式] AI 原始回應 " + "="*20)
@@ -107,10 +302,10 @@ def query_ollama_local(system_prompt: str, user_prompt: str, local_config: dict,
                 if debug_mode: print("🐞 [偵錯模式] 在 AI 回應中未找到有效的 JSON 結構。")
                 return None
         return content
-        
+
     except requests.exceptions.RequestException as e:
-        if debug_mode: print(f"🐞 [偵錯模式] 與本地 Ollama 連接時發生錯誤: {e}")
+        if debug_mode: print(f"🐞 [偵錯模式] 與本地 Ollama 連接時發生錯誤 (或超過閒置逾時): {e}")
         raise e
     except (json.JSONDecodeError, KeyError, IndexError, ValueError) as e:
-        if debug_mode: print(f"🐞 [偵錯模式] 解析本地 Ollama 原始回應時發生錯誤: {e}\n   收到的原始回應: {response.text}")
+        if debug_mode: print(f"🐞 [偵錯模式] 解析本地 Ollama 串流回應時發生錯誤: {e}\n   已收到的內容: {''.join(chunks)}")
         return None
@@ -0,0 +1,213 @@
+# scripts/mirror_handler.py
+# Notion 資料庫的本地 SQLite 鏡像，依 last_edited_time 水位線進行增量同步。
+import os
+import json
+import sqlite3
+from datetime import datetime, timezone, timedelta
+
+from .notion_handler import NotionClient, get_notion_client
+
+DEFAULT_MIRROR_PATH = os.path.join("data", "notion_mirror.db")
+
+def _get_mirror_config(config: dict) -> dict:
+    mirror_config = config.get("MIRROR_CONFIG", {})
+    return {
+        "enabled": mirror_config.get("enabled", True),
+        "path": mirror_config.get("path", DEFAULT_MIRROR_PATH),
+        "full_sync_hours": mirror_config.get("full_sync_hours", 24),
+    }
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    """開啟鏡像資料庫，並確保資料表存在。"""
+    db_dir = os.path.dirname(db_path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pages (
+            id TEXT PRIMARY KEY,
+            database_id TEXT NOT NULL,
+            created_time TEXT,
+            last_edited_time TEXT,
+            data TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_db ON pages (database_id, created_time)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            database_id TEXT PRIMARY KEY,
+            watermark TEXT,
+            last_full_sync TEXT
+        )
+    """)
+    return conn
+
+def _parse_time(value: str) -> datetime:
+    """將 Notion 的 ISO 時間 (或純日期) 轉換為帶時區的 datetime。"""
+    if len(value) == 10:
+        return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def _is_live(page: dict) -> bool:
+    """已封存或已移到垃圾桶的頁面不應再被處理。"""
+    return not page.get("archived") and not page.get("in_trash")
+
+def sync_database(client: NotionClient, database_id: str, db_path: str = DEFAULT_MIRROR_PATH,
+                  full: bool = False, full_sync_hours: int = 24, debug_mode: bool = False) -> int:
+    """
+    將單一 Notion 資料庫同步到本地鏡像。
+
+    - 增量同步：只查詢 last_edited_time 不早於水位線的頁面 (Notion 的時間精度為分鐘，所以使用 on_or_after 並以 upsert 處理重複)。
+    - 完整同步：首次同步、指定 full=True，或距上次完整同步超過 full_sync_hours 時執行，並移除已在 Notion 端刪除/封存的頁面。
+
+    返回本次寫入鏡像的頁面數量。
+    """
+    conn = _connect(db_path)
+    try:
+        row = conn.execute(
+            "SELECT watermark, last_full_sync FROM sync_state WHERE database_id = ?", (database_id,)
+        ).fetchone()
+        watermark, last_full_sync = row if row else (None, None)
+
+        now = datetime.now(timezone.utc)
+        if not full and (not watermark or not last_full_sync
+                         or now - _parse_time(last_full_sync) > timedelta(hours=full_sync_hours)):
+            full = True
+
+        if full:
+            filter_payload = {}
+        else:
+            filter_payload = {"timestamp": "last_edited_time", "last_edited_time": {"on_or_after": watermark}}
+
+        if debug_mode:
+            print(f"🐞 [偵錯模式] 同步鏡像 {database_id} ({'完整' if full else f'增量，水位線 {watermark}'})")
+
+        pages = client.query_database(database_id, filter_payload, debug_mode)
+
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO pages (id, database_id, created_time, last_edited_time, data) VALUES (?, ?, ?, ?, ?)",
+                [(p["id"], database_id, p.get("created_time"), p.get("last_edited_time"), json.dumps(p, ensure_ascii=False))
+                 for p in pages if _is_live(p)]
+            )
+            conn.executemany("DELETE FROM pages WHERE id = ?", [(p["id"],) for p in pages if not _is_live(p)])
+            # 完整同步時，清除 Notion 端已不存在的頁面；若查詢失敗 (返回空列表) 則保留現有鏡像
+            if full and pages:
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen_ids (id TEXT PRIMARY KEY)")
+                conn.execute("DELETE FROM seen_ids")
+                conn.executemany("INSERT OR IGNORE INTO seen_ids (id) VALUES (?)", [(p["id"],) for p in pages])
+                conn.execute(
+                    "DELETE FROM pages WHERE database_id = ? AND id NOT IN (SELECT id FROM seen_ids)", (database_id,)
+                )
+
+            edited_times = [p["last_edited_time"] for p in pages if p.get("last_edited_time")]
+            if edited_times:
+                newest = max(edited_times, key=_parse_time)
+                if not watermark or _parse_time(newest) > _parse_time(watermark):
+                    watermark = newest
+            if full and pages:
+                last_full_sync = now.isoformat()
+            if watermark:
+                conn.execute(
+                    "INSERT OR REPLACE INTO sync_state (database_id, watermark, last_full_sync) VALUES (?, ?, ?)",
+                    (database_id, watermark, last_full_sync)
+                )
+        return len(pages)
+    finally:
+        conn.close()
+
+def _match_filter(page: dict, filter_payload: dict) -> bool:
+    """在本地評估 Notion 過濾器。僅支援本專案使用到的過濾器形式。"""
+    if not filter_payload:
+        return True
+    if "and" in filter_payload:
+        return all(_match_filter(page, f) for f in filter_payload["and"])
+    if "or" in filter_payload:
+        return any(_match_filter(page, f) for f in filter_payload["or"])
+
+    if "timestamp" in filter_payload:
+        field = filter_payload["timestamp"]
+        value = page.get(field)
+        if not value:
+            return False
+        page_time = _parse_time(value)
+        condition = filter_payload.get(field, {})
+        checks = {
+            "on_or_after": lambda t: page_time >= t,
+            "after": lambda t: page_time > t,
+            "on_or_before": lambda t: page_time <= t,
+            "before": lambda t: page_time < t,
+        }
+        for op, target in condition.items():
+            if op not in checks:
+                raise ValueError(f"不支援的時間過濾條件: {op}")
+            if not checks[op](_parse_time(target)):
+                return False
+        return True
+
+    if "property" in filter_payload and "select" in filter_payload:
+        prop = page.get("properties", {}).get(filter_payload["property"], {})
+        selected = (prop.get("select") or {}).get("name")
+        condition = filter_payload["select"]
+        if "equals" in condition:
+            return selected == condition["equals"]
+        if "does_not_equal" in condition:
+            return selected != condition["does_not_equal"]
+        if "is_empty" in condition:
+            return selected is None
+        raise ValueError(f"不支援的 select 過濾條件: {condition}")
+
+    raise ValueError(f"不支援的過濾器: {json.dumps(filter_payload, ensure_ascii=False)}")
+
+def query_local_database(database_id: str, filter_payload: dict, db_path: str = DEFAULT_MIRROR_PATH) -> list:
+    """從本地鏡像讀取頁面，並套用 Notion 格式的過濾器。結果按建立時間由舊到新排序。"""
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT data FROM pages WHERE database_id = ? ORDER BY created_time", (database_id,)
+        ).fetchall()
+    finally:
+        conn.close()
+    pages = (json.loads(data) for (data,) in rows)
+    return [page for page in pages if _is_live(page) and _match_filter(page, filter_payload)]
+
+def query_database_cached(config: dict, database_id: str, filter_payload: dict, live: bool = False) -> list:
+    """
+    先增量同步鏡像，再從本地查詢。
+    如果鏡像被停用、過濾器無法在本地評估，或指定 live=True，則直接查詢 Notion。
+    增量同步看不到在 Notion 端被刪除的頁面 (要等下一次完整同步才會清除)，
+    所以結果會被拿來處理、不能包含已刪除頁面的查詢 (例如待合成的 Inbox 項目) 應使用 live=True。
+    """
+    debug_mode = config.get("DEBUG_MODE", False)
+    mirror_config = _get_mirror_config(config)
+    client = get_notion_client(config['NOTION_TOKEN'], config)
+    if live or not mirror_config["enabled"]:
+        return [page for page in client.query_database(database_id, filter_payload, debug_mode) if _is_live(page)]
+
+    try:
+        sync_database(client, database_id, mirror_config["path"],
+                      full_sync_hours=mirror_config["full_sync_hours"], debug_mode=debug_mode)
+        results = query_local_database(database_id, filter_payload, mirror_config["path"])
+    except (sqlite3.Error, ValueError) as e:
+        print(f"⚠️ 本地鏡像無法使用 ({e})，改為直接查詢 Notion。")
+        return [page for page in client.query_database(database_id, filter_payload, debug_mode) if _is_live(page)]
+
+    if filter_payload:
+        print(f"✅ 成功從本地鏡像查詢到 {len(results)} 筆資料。")
+    return results
+
+def sync_all_databases(config: dict, full: bool = False) -> dict:
+    """同步 Inbox、Knowledge Base 與 Periodic Reviews 三個資料庫，返回各資料庫寫入的頁面數量。"""
+    mirror_config = _get_mirror_config(config)
+    client = get_notion_client(config['NOTION_TOKEN'], config)
+    counts = {}
+    for key in ("INBOX_DB_ID", "KNOWLEDGE_DB_ID", "REVIEW_DB_ID"):
+        database_id = config.get(key)
+        if not database_id:
+            continue
+        counts[key] = sync_database(client, database_id, mirror_config["path"], full=full,
+                                    full_sync_hours=mirror_config["full_sync_hours"],
+                                    debug_mode=config.get("DEBUG_MODE", False))
+    return counts
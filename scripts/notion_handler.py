@@ -2,6 +2,8 @@
 import requests
 import json
 import ast
+import time
+import threading
 from datetime import datetime, timedelta, date # 確保在檔案頂部導入
 
 # --- 新增：可重用的輔助函式 ---
@@ -32,44 +34,282 @@ def _format_list_content(content) -> str:
     # 其他情況（如數字等），轉換為字串返回
     return str(content)
 
-# --- create_notion_page, format_inbox_properties, query_notion_database, update_notion_page_status, get_page_content_as_text 保持不變 ---
-# ... (這裡省略了未修改的函式，您無需改動它們) ...
 
-def create_notion_page(token: str, database_id: str, properties: dict, page_content: str = None) -> dict:
-    url = "https://api.notion.com/v1/pages"
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json", "Notion-Version": "2022-06-28"}
-    payload = {"parent": {"database_id": database_id}, "properties": properties}
-    # --- 核心修改：如果提供了頁面內容，就將其加入 payload ---
-    if page_content:
-        # Notion 的 rich_text 陣列中，每個 text 物件有 2000 字的限制。
-        # 我們將長文本切分成多個 2000 字的塊。
-        content_chunks = [page_content[i:i + 2000] for i in range(0, len(page_content), 2000)]
-        
-        rich_text_objects = [{"type": "text", "text": {"content": chunk}} for chunk in content_chunks]
-        
-        # 將切分好的文本塊放入一個程式碼區塊中
-        payload["children"] = [
-            {
-                "object": "block",
-                "type": "code",
-                "code": {
-                    "rich_text": rich_text_objects,
-                    # --- 核心修改：將 "text" 改為 "plain text" ---
-                    "language": "plain text"
-                    # -------------------------------------------
+def _block_to_text(block: dict):
+    """
+    提取單一區塊的純文字；沒有文字的區塊返回 None。
+    同一區塊內的多個 rich_text 片段 (例如粗體、連結，或 create_page 切分的 2000 字塊) 直接相連，不插入換行。
+    """
+    block_type = block.get("type")
+    block_body = block.get(block_type) or {}
+    if block_type == "table_row":
+        cells = ["".join(t.get("plain_text", "") for t in cell) for cell in block_body.get("cells", [])]
+        return " | ".join(cells) if any(cells) else None
+    if block_body.get("rich_text"):
+        return "".join(text_obj.get("plain_text", "") for text_obj in block_body["rich_text"])
+    return None
+
+def _should_descend(block: dict) -> bool:
+    """子頁面與子資料庫是獨立的頁面，不應展開到目前頁面的正文中。"""
+    return block.get("has_children", False) and block.get("type") not in ("child_page", "child_database")
+
+# --- Notion API 客戶端：共用連線池、令牌桶限速，並在 429 時遵守 Retry-After ---
+NOTION_API_BASE = "https://api.notion.com/v1"
+NOTION_VERSION = "2022-06-28"
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """執行緒安全的令牌桶限速器。"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.pause_listeners = []
+        self.lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """嘗試取得一個令牌；成功時返回 0，否則返回建議等待的秒數 (供 asyncio 版本使用)。"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """取得一個令牌；令牌不足或處於暫停期間時會阻塞等待。"""
+        while (wait := self.try_acquire()) > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """讓所有共用此限速器的執行緒暫停發送請求 (用於回應 429)。"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+        for listener in self.pause_listeners:
+            listener(seconds)
+
+    def add_pause_listener(self, listener):
+        """註冊在 429 暫停時被呼叫的回呼 (參數為暫停秒數)，例如自適應排程器。"""
+        self.pause_listeners.append(listener)
+
+class NotionClient:
+    """
+    對 Notion API 的封裝。所有請求共用同一個 requests.Session (keep-alive 連線池)，
+    經過令牌桶限速 (預設約 3 req/s)，並在 429/5xx 時依 Retry-After 或指數退避重試。
+    """
+
+    def __init__(self, token: str, requests_per_second: float = 3.0, max_retries: int = 5,
+                 pool_size: int = 10, timeout: int = 30, max_block_depth: int = 5):
+        self.token = token
+        self.max_block_depth = max_block_depth
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+            "Notion-Version": NOTION_VERSION,
+        })
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+
+    @classmethod
+    def from_config(cls, config: dict) -> "NotionClient":
+        notion_config = config.get("NOTION_CONFIG", {})
+        return cls(
+            config['NOTION_TOKEN'],
+            requests_per_second=notion_config.get("requests_per_second", 3.0),
+            max_retries=notion_config.get("max_retries", 5),
+            pool_size=notion_config.get("pool_size", 10),
+            timeout=notion_config.get("timeout", 30),
+            max_block_depth=notion_config.get("max_block_depth", 5),
+        )
+
+    def request(self, method: str, path: str, payload: dict = None, params: dict = None) -> requests.Response:
+        """發送請求；可重試的錯誤會自動退避重試，最終失敗時拋出 requests.exceptions.RequestException。"""
+        url = f"{NOTION_API_BASE}{path}"
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.request(method, url, json=payload, params=params, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(min(2 ** attempt, 30))
+                continue
+
+            if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                retry_after = response.headers.get("Retry-After")
+                try:
+                    wait = float(retry_after) if retry_after else min(2 ** attempt, 30)
+                except ValueError:
+                    wait = min(2 ** attempt, 30)
+                print(f"⏳ Notion 回應 {response.status_code}，{wait:.1f} 秒後重試 ({attempt + 1}/{self.max_retries})...")
+                if response.status_code == 429:
+                    self.rate_limiter.pause(wait)
+                else:
+                    time.sleep(wait)
+                continue
+
+            response.raise_for_status()
+            return response
+
+    def create_page(self, database_id: str, properties: dict, page_content: str = None) -> dict:
+        payload = {"parent": {"database_id": database_id}, "properties": properties}
+        # --- 核心修改：如果提供了頁面內容，就將其加入 payload ---
+        if page_content:
+            # Notion 的 rich_text 陣列中，每個 text 物件有 2000 字的限制。
+            # 我們將長文本切分成多個 2000 字的塊。
+            content_chunks = [page_content[i:i + 2000] for i in range(0, len(page_content), 2000)]
+
+            rich_text_objects = [{"type": "text", "text": {"content": chunk}} for chunk in content_chunks]
+
+            # 將切分好的文本塊放入一個程式碼區塊中
+            payload["children"] = [
+                {
+                    "object": "block",
+                    "type": "code",
+                    "code": {
+                        "rich_text": rich_text_objects,
+                        "language": "plain text"
+                    }
                 }
-            }
-        ]
-
-    # ----------------------------------------------------    
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        response.raise_for_status()
-        print(f"✅ 成功將頁面 '{properties.get('Title', {}).get('title', [{}])[0].get('text', {}).get('content', 'N/A')}' 新增至 Notion！")
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"❌ 新增 Notion 頁面時發生錯誤: {e}\n   錯誤詳情: {response.text}")
-        return None
+            ]
+
+        try:
+            response = self.request("POST", "/pages", payload)
+            print(f"✅ 成功將頁面 '{properties.get('Title', {}).get('title', [{}])[0].get('text', {}).get('content', 'N/A')}' 新增至 Notion！")
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            error_text = e.response.text if e.response is not None else ""
+            print(f"❌ 新增 Notion 頁面時發生錯誤: {e}\n   錯誤詳情: {error_text}")
+            return None
+
+    def query_database(self, database_id: str, filter_payload: dict, debug_mode: bool = False) -> list:
+        """
+        查詢 Notion 資料庫，並根據 debug_mode 決定是否打印詳細日誌。
+        如果 filter_payload 為空，則獲取所有頁面。
+        """
+        results, has_more, start_cursor = [], True, None
+
+        if debug_mode:
+            print(f"🐞 [偵錯模式] 準備查詢 Notion 資料庫...")
+            print(f"   - Database ID: {database_id}")
+            if filter_payload:
+                print(f"   - Filter Payload: {json.dumps(filter_payload, indent=2)}")
+            else:
+                print("   - Filter Payload: (無，將獲取所有頁面)")
+
+        while has_more:
+            # 只有在 filter_payload 非空時，才將 "filter" 鍵加入 payload
+            payload = {"page_size": 100}
+            if filter_payload:
+                payload["filter"] = filter_payload
+            if start_cursor:
+                payload["start_cursor"] = start_cursor
+
+            try:
+                data = self.request("POST", f"/databases/{database_id}/query", payload).json()
+                results.extend(data.get("results", []))
+                has_more = data.get("has_more", False)
+                start_cursor = data.get("next_cursor")
+
+            except requests.exceptions.RequestException as e:
+                print(f"❌ 查詢 Notion 資料庫時發生嚴重錯誤: {e}")
+                if e.response is not None:
+                    try:
+                        # 嘗試解析並打印 Notion 返回的詳細錯誤 JSON
+                        error_details = e.response.json()
+                        print(f"   - Notion API 返回的錯誤詳情: {json.dumps(error_details, indent=2, ensure_ascii=False)}")
+                    except ValueError:
+                        print(f"   - Notion API 返回的原始錯誤文本: {e.response.text}")
+
+                if debug_mode:
+                    print("🐞 [偵錯模式] 檢查點:")
+                    print("   1. 請確認您的 `config.json` 中的 `NOTION_TOKEN` 和資料庫 ID 是否正確。")
+                    print("   2. 請確認您的 Integration 是否已分享給目標資料庫。")
+                    print("   3. 請仔細閱讀上面的『錯誤詳情』，它通常會明確指出哪個屬性名稱或類型有問題。")
+
+                return [] # 發生錯誤時返回空列表
+
+        # 只有在有過濾條件時才打印成功訊息，避免在儀表板每次刷新時都打印
+        if filter_payload:
+            print(f"✅ 成功從 Notion 查詢到 {len(results)} 筆資料。")
+
+        return results
+
+    def update_page_status(self, page_id: str, status: str):
+        payload = {"properties": {"Status": {"select": {"name": status}}}}
+        try:
+            self.request("PATCH", f"/pages/{page_id}", payload)
+            print(f"✅ 成功更新頁面 {page_id} 狀態為 '{status}'")
+        except requests.exceptions.RequestException as e:
+            error_text = e.response.text if e.response is not None else ""
+            print(f"❌ 更新 Notion 頁面狀態時發生錯誤: {e}\n   錯誤詳情: {error_text}")
+
+    def iter_block_children(self, block_id: str):
+        """逐頁 (每頁 100 個) 產出區塊的直接子區塊，會跟隨 next_cursor 直到 has_more 為 False。"""
+        params = {"page_size": 100}
+        while True:
+            data = self.request("GET", f"/blocks/{block_id}/children", params=params).json()
+            yield from data.get("results", [])
+            if not data.get("has_more"):
+                return
+            params["start_cursor"] = data.get("next_cursor")
+
+    def iter_block_text(self, block_id: str, max_depth: int = 5, _depth: int = 0):
+        """
+        深度優先走訪區塊樹，邊抓取邊產出每個區塊的文字。
+        會展開 toggle、column、巢狀列表等子區塊，最多展開 max_depth 層。
+        (並發抓取子樹的版本請見 AsyncNotionClient.iter_block_text)
+        """
+        for block in self.iter_block_children(block_id):
+            text = _block_to_text(block)
+            if text is not None:
+                yield text
+            if _depth < max_depth and _should_descend(block):
+                yield from self.iter_block_text(block["id"], max_depth, _depth + 1)
+
+    def get_page_blocks_as_text(self, page_id: str, max_depth: int = None) -> str:
+        """
+        獲取指定頁面 ID 下所有區塊 (包含分頁與巢狀子區塊) 的文字內容。
+        任何一次請求失敗都返回空字串，避免以不完整的內容進行合成。
+        """
+        max_depth = self.max_block_depth if max_depth is None else max_depth
+        try:
+            return "\n".join(self.iter_block_text(page_id, max_depth))
+        except requests.exceptions.RequestException as e:
+            print(f"❌ 獲取頁面區塊時發生錯誤: {e}")
+            return ""
+
+    def get_page_content_as_text(self, page: dict) -> tuple[str, dict]:
+        """從一個 Notion 頁面物件中提取用於處理的內容 (頁面正文) 和元數據 (屬性)。"""
+        content_to_process = self.get_page_blocks_as_text(page['id'])
+        return _extract_content_and_metadata(page, content_to_process)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_notion_client(token: str, config: dict = None) -> NotionClient:
+    """返回該 token 共用的 NotionClient，讓同一進程內所有呼叫共用連線池與限速器。"""
+    with _clients_lock:
+        client = _clients.get(token)
+        if client is None:
+            client = NotionClient.from_config({**(config or {}), "NOTION_TOKEN": token})
+            _clients[token] = client
+        return client
+
+def create_notion_page(token: str, database_id: str, properties: dict, page_content: str = None) -> dict:
+    return get_notion_client(token).create_page(database_id, properties, page_content)
 
 def format_inbox_properties(processed_data: dict, raw_content: str, url: str = None, source_type: str = None) -> dict:
     """將處理後的內容格式化為 Notion Inbox DB 的屬性結構。"""
@@ -147,75 +387,10 @@ def query_notion_database(token: str, database_id: str, filter_payload: dict, de
     查詢 Notion 資料庫，並根據 debug_mode 決定是否打印詳細日誌。
     如果 filter_payload 為空，則獲取所有頁面。
     """
-    url = f"https://api.notion.com/v1/databases/{database_id}/query"
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json", "Notion-Version": "2022-06-28"}
-    results, has_more, start_cursor = [], True, None
-
-    if debug_mode:
-        print(f"🐞 [偵錯模式] 準備查詢 Notion 資料庫...")
-        print(f"   - Database ID: {database_id}")
-        if filter_payload:
-            print(f"   - Filter Payload: {json.dumps(filter_payload, indent=2)}")
-        else:
-            print("   - Filter Payload: (無，將獲取所有頁面)")
-
-    while has_more:
-        # 建立一個空的 payload 字典
-        payload = {}
-        
-        # 只有在 filter_payload 非空時，才將 "filter" 鍵加入 payload
-        if filter_payload:
-            payload["filter"] = filter_payload
-        
-        # 如果有分頁游標，也加入 payload
-        if start_cursor:
-            payload["start_cursor"] = start_cursor
-        
-        try:
-            # 將 payload 字典轉換為 JSON 字串並發送
-            response = requests.post(url, headers=headers, data=json.dumps(payload))
-            response.raise_for_status()  # 如果狀態碼不是 2xx，則拋出異常
-            
-            data = response.json()
-            results.extend(data.get("results", []))
-            has_more = data.get("has_more", False)
-            start_cursor = data.get("next_cursor")
-
-        except requests.exceptions.RequestException as e:
-            print(f"❌ 查詢 Notion 資料庫時發生嚴重錯誤: {e}")
-            try:
-                # 嘗試解析並打印 Notion 返回的詳細錯誤 JSON
-                error_details = response.json()
-                print(f"   - Notion API 返回的錯誤詳情: {json.dumps(error_details, indent=2, ensure_ascii=False)}")
-            except (json.JSONDecodeError, AttributeError):
-                # 如果解析失敗，就打印原始文本
-                print(f"   - Notion API 返回的原始錯誤文本: {response.text}")
-            
-            if debug_mode:
-                print("🐞 [偵錯模式] 檢查點:")
-                print("   1. 請確認您的 `config.json` 中的 `NOTION_TOKEN` 和資料庫 ID 是否正確。")
-                print("   2. 請確認您的 Integration 是否已分享給目標資料庫。")
-                print("   3. 請仔細閱讀上面的『錯誤詳情』，它通常會明確指出哪個屬性名稱或類型有問題。")
-
-            return [] # 發生錯誤時返回空列表
-
-    # 只有在有過濾條件時才打印成功訊息，避免在儀表板每次刷新時都打印
-    if filter_payload:
-        print(f"✅ 成功從 Notion 查詢到 {len(results)} 筆資料。")
-        
-    return results
+    return get_notion_client(token).query_database(database_id, filter_payload, debug_mode)
 
 def update_notion_page_status(token: str, page_id: str, status: str):
-    url = f"https://api.notion.com/v1/pages/{page_id}"
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json", "Notion-Version": "2022-06-28"}
-    properties = {"Status": {"select": {"name": status}}}
-    payload = {"properties": properties}
-    try:
-        response = requests.patch(url, headers=headers, data=json.dumps(payload))
-        response.raise_for_status()
-        print(f"✅ 成功更新頁面 {page_id} 狀態為 '{status}'")
-    except requests.exceptions.RequestException as e:
-        print(f"❌ 更新 Notion 頁面狀態時發生錯誤: {e}\n   錯誤詳情: {response.text}")
+    get_notion_client(token).update_page_status(page_id, status)
 
 # --- 核心修改 1：讓 get_page_content_as_text 返回一個包含元數據的字典 ---
 def get_page_content_as_text(token: str, page: dict) -> tuple[str, dict]:
@@ -229,24 +404,26 @@ def get_page_content_as_text(token: str, page: dict) -> tuple[str, dict]:
     防呆設計:
     - 如果頁面正文為空，將返回空的內容字串，並由上層呼叫者決定如何處理（例如，跳過該項目）。
     """
+    return get_notion_client(token).get_page_content_as_text(page)
+
+def _extract_content_and_metadata(page: dict, content_to_process: str) -> tuple[str, dict]:
+    """將已獲取的頁面正文與頁面屬性中的元數據組合起來。"""
     page_id = page['id']
     props = page.get("properties", {})
 
-    # --- 1. 獲取內容 (唯一來源：頁面正文) ---
-    content_to_process = get_page_blocks_as_text(token, page_id)
-    
     if not content_to_process or not content_to_process.strip():
         # 防呆：明確告知此頁面因無內容而被跳過
         print(f"   - ⚠️ 警告: 頁面 {page_id} 的正文為空，無法進行知識合成。已跳過。")
         print(f"     (這可能是一個舊的、沒有頁面正文的筆記)")
-        
-    # --- 2. 提取元數據 (從屬性中獲取) ---
+        content_to_process = ""
+
+    # --- 提取元數據 (從屬性中獲取) ---
     metadata = {
         "url": props.get("URL", {}).get("url"),
         "category": props.get("Category", {}).get("select"),
         "tags": props.get("Tags", {}).get("multi_select", [])
     }
-    
+
     # 我們仍然返回 content_to_process (可能是空字串)，讓上層函式做最終判斷
     return content_to_process.strip(), metadata
 
@@ -326,26 +503,7 @@ def format_review_properties(review_data: dict, period: str, start_date: date, e
     }
     return properties
 
-# scripts/notion_handler.py
 
 def get_page_blocks_as_text(token: str, page_id: str) -> str:
     """獲取指定頁面 ID 下所有區塊的文字內容。"""
-    url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-    headers = {"Authorization": f"Bearer {token}", "Notion-Version": "2022-06-28"}
-    
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        blocks = response.json().get("results", [])
-        
-        full_text = []
-        for block in blocks:
-            block_type = block.get("type")
-            if block_type in block and "rich_text" in block[block_type]:
-                for text_obj in block[block_type]["rich_text"]:
-                    full_text.append(text_obj.get("plain_text", ""))
-        
-        return "\n".join(full_text)
-    except requests.exceptions.RequestException as e:
-        print(f"❌ 獲取頁面區塊時發生錯誤: {e}")
-        return ""
+    return get_notion_client(token).get_page_blocks_as_text(page_id)
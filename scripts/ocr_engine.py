@@ -0,0 +1,229 @@
+# scripts/ocr_engine.py
+# OCR 流水線：載入 → 前處理 (灰階、縮小過大的圖片、二值化) → 偵測文字區域並裁切 → 各區域平行辨識 → 依順序合併。
+# 每張圖片都會記錄各步驟的耗時，方便找出時間花在哪裡。
+import os
+import math
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytesseract
+from PIL import Image, ImageOps
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff", ".gif")
+
+def _otsu_threshold(gray: np.ndarray) -> int:
+    """
+    以 Otsu 法找出使前景/背景類間變異數最大的灰階門檻。
+    只有單一灰階 (空白或純色圖片) 時無法分出兩類，返回 -1，使墨水遮罩為空。
+    """
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = gray.size
+    cumulative = np.cumsum(histogram)
+    cumulative_mean = np.cumsum(histogram * np.arange(256))
+    global_mean = cumulative_mean[-1] / total
+    background = cumulative / total
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (global_mean * background - cumulative_mean / total) ** 2 / (background * (1 - background))
+    if np.isnan(between).all():
+        return -1
+    return int(np.nanargmax(between))
+
+def preprocess_image(image: Image.Image, max_pixels: int = 4_000_000, binarize: bool = True):
+    """
+    轉為灰階；像素數超過 max_pixels 時等比例縮小 (手機截圖的字夠大，縮小後辨識率幾乎不變，但 Tesseract 快很多)；
+    binarize 為 True 時以 Otsu 門檻二值化，深色模式 (淺色字深色底) 會先反轉為深色字淺色底。
+    返回 (交給 Tesseract 的圖片, 文字像素為 True 的布林陣列)。
+    """
+    gray = ImageOps.exif_transpose(image).convert("L")
+    if gray.width * gray.height > max_pixels:
+        scale = math.sqrt(max_pixels / (gray.width * gray.height))
+        gray = gray.resize((max(1, int(gray.width * scale)), max(1, int(gray.height * scale))), Image.LANCZOS)
+
+    pixels = np.asarray(gray)
+    threshold = _otsu_threshold(pixels)
+    ink = pixels <= threshold
+    # 文字只占畫面的少數；若「墨水」超過一半，表示是深色背景
+    if ink.mean() > 0.5:
+        ink = ~ink
+        gray = ImageOps.invert(gray)
+    if binarize:
+        gray = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8))
+    return gray, ink
+
+def _runs(mask: np.ndarray) -> list:
+    """返回布林序列中連續 True 的 [start, end) 區間。"""
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return list(zip(edges[0::2], edges[1::2]))
+
+def detect_text_regions(ink: np.ndarray, target_height: int, min_gap: int = 8, margin: int = 6) -> list:
+    """
+    以水平投影偵測文字區域：有墨水的連續列為一行文字，間距小於 min_gap 的行合併；
+    再把相鄰的行依序組成高度約 target_height 的區塊 (只在行與行之間切開，不會切斷文字)，並裁掉左右空白。
+    返回 (left, top, right, bottom) 列表，由上而下排序；空白的上下區域不會出現在任何區塊中。
+    """
+    height, width = ink.shape
+    row_has_ink = ink.sum(axis=1) > max(1, int(width * 0.002))
+    lines = []
+    for start, end in _runs(row_has_ink):
+        if lines and start - lines[-1][1] < min_gap:
+            lines[-1] = (lines[-1][0], end)
+        else:
+            lines.append((start, end))
+
+    blocks = []
+    for start, end in lines:
+        if blocks and end - blocks[-1][0] <= target_height:
+            blocks[-1] = (blocks[-1][0], end)
+        else:
+            blocks.append((start, end))
+
+    regions = []
+    for top, bottom in blocks:
+        columns = np.flatnonzero(ink[top:bottom].any(axis=0))
+        if columns.size == 0:
+            continue
+        regions.append((
+            max(0, int(columns[0]) - margin), max(0, top - margin),
+            min(width, int(columns[-1]) + 1 + margin), min(height, bottom + margin),
+        ))
+    return regions
+
+def _recognize(image: Image.Image, lang: str, tesseract_config: str) -> tuple:
+    """返回 (文字, 辨識耗時, 完成時間點)。"""
+    start = time.perf_counter()
+    text = pytesseract.image_to_string(image, lang=lang, config=tesseract_config)
+    finished = time.perf_counter()
+    return text, finished - start, finished
+
+class OCREngine:
+    """
+    pytesseract 每次辨識都會啟動一個獨立的 tesseract 程序，所以用執行緒池就能讓多個 tesseract 程序同時在不同核心上執行，
+    不需要再包一層 multiprocessing (在 Windows 與 Streamlit 下也不必處理 spawn 的問題)。
+    每個 tesseract 程序限制為單執行緒 (OMP_THREAD_LIMIT=1)，避免多個程序的 OpenMP 執行緒互相搶占核心。
+    """
+
+    def __init__(self, workers: int = None, lang: str = "eng+chi_tra", max_pixels: int = 4_000_000,
+                 binarize: bool = True, regions: bool = True, tesseract_config: str = ""):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.lang = lang
+        self.max_pixels = max_pixels
+        self.binarize = binarize
+        self.regions = regions
+        self.tesseract_config = tesseract_config
+        if self.workers > 1:
+            os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ocr")
+
+    def _prepare(self, image_path: str) -> dict:
+        """載入、前處理並切出區域，提交辨識工作；返回尚未完成的工作與已量測的耗時。"""
+        timings = {}
+        start = time.perf_counter()
+        with Image.open(image_path) as image:
+            image.load()
+            timings["load"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            prepared, ink = preprocess_image(image, self.max_pixels, self.binarize)
+            timings["preprocess"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        crops = [prepared]
+        if not ink.any():
+            # 沒有任何墨水 (空白或純色圖片)，不必啟動 tesseract
+            crops = []
+        elif self.regions and self.workers > 1:
+            # 區塊數約為工作數的兩倍，讓較慢的區塊不會拖住整張圖
+            target_height = max(300, math.ceil(prepared.height / (self.workers * 2)))
+            boxes = detect_text_regions(ink, target_height)
+            if len(boxes) > 1:
+                crops = [prepared.crop(box) for box in boxes]
+            elif not boxes:
+                crops = []
+        timings["detect"] = time.perf_counter() - start
+
+        started = time.perf_counter()
+        futures = [self.pool.submit(_recognize, crop, self.lang, self.tesseract_config) for crop in crops]
+        return {"futures": futures, "timings": timings, "started": started}
+
+    @staticmethod
+    def _collect(job: dict) -> tuple[str, dict]:
+        results = [future.result() for future in job["futures"]]
+        timings = job["timings"]
+        # 以最後一個區域完成的時間點計算，不含呼叫端稍後才來取結果的等待
+        timings["ocr_wall"] = max((finished for _, _, finished in results), default=job["started"]) - job["started"]
+        timings["ocr_cpu"] = sum(seconds for _, seconds, _ in results)
+        timings["regions"] = len(results)
+        return "\n".join(text.strip() for text, _, _ in results if text.strip()), timings
+
+    def recognize(self, image_path: str) -> tuple[str, dict]:
+        """辨識單張圖片，返回 (文字, 耗時明細)。"""
+        return self._collect(self._prepare(image_path))
+
+    def recognize_many(self, image_paths: list, prefetch: int = 2):
+        """
+        依序產出 (路徑, 文字, 耗時明細)；某張圖片失敗時文字為 None、耗時明細為錯誤訊息。
+        前一張圖片的區域還在辨識時，先載入並前處理接下來最多 prefetch 張圖片 (只預先處理少量，限制記憶體用量)。
+        """
+        pending = deque()
+        paths = iter(image_paths)
+
+        def prepare_next():
+            path = next(paths, None)
+            if path is None:
+                return False
+            try:
+                pending.append((path, self._prepare(path)))
+            except Exception as e:
+                pending.append((path, e))
+            return True
+
+        while len(pending) <= prefetch and prepare_next():
+            pass
+        while pending:
+            path, job = pending.popleft()
+            prepare_next()
+            if isinstance(job, Exception):
+                yield path, None, str(job)
+                continue
+            try:
+                text, timings = self._collect(job)
+                yield path, text, timings
+            except Exception as e:
+                yield path, None, str(e)
+
+def format_timings(timings: dict) -> str:
+    total = timings["load"] + timings["preprocess"] + timings["detect"] + timings["ocr_wall"]
+    return (
+        f"載入 {timings['load']:.2f}s｜前處理 {timings['preprocess']:.2f}s｜區域偵測 {timings['detect']:.2f}s｜"
+        f"辨識 {timings['ocr_wall']:.2f}s ({timings['regions']} 個區域，累計 {timings['ocr_cpu']:.2f}s)｜總計 {total:.2f}s"
+    )
+
+def list_image_files(directory: str) -> list:
+    """返回資料夾中的圖片檔 (不含子資料夾)，依檔名排序。"""
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(directory, name))
+    )
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_ocr_engine(config: dict = None) -> OCREngine:
+    """返回進程內共用的 OCREngine，設定來自 OCR_CONFIG。"""
+    global _engine
+    ocr_config = (config or {}).get("OCR_CONFIG", {})
+    with _engine_lock:
+        if _engine is None:
+            _engine = OCREngine(
+                workers=ocr_config.get("workers"),
+                lang=ocr_config.get("lang", "eng+chi_tra"),
+                max_pixels=ocr_config.get("max_pixels", 4_000_000),
+                binarize=ocr_config.get("binarize", True),
+                regions=ocr_config.get("regions", True),
+                tesseract_config=ocr_config.get("tesseract_config", ""),
+            )
+        return _engine
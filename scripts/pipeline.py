@@ -0,0 +1,91 @@
+# scripts/pipeline.py
+# 以執行緒與有界佇列實作的多階段生產者/消費者流水線。
+import queue
+import threading
+
+_STOP = object()
+
+class Stage:
+    """
+    流水線中的一個階段。
+
+    Args:
+        name: 階段名稱 (用於日誌)。
+        func: 處理函式，接收上一階段的產出並返回交給下一階段的物件；返回 None 表示丟棄該項目。
+        workers: 此階段的工作執行緒數量。
+        queue_size: 此階段輸入佇列的容量；佇列滿時上游會被阻塞 (背壓)。
+    """
+
+    def __init__(self, name: str, func, workers: int = 1, queue_size: int = 4):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+
+def run_pipeline(source, stages: list, on_done=None, log=print) -> dict:
+    """
+    讓 source 中的每個項目依序流過所有階段，不同項目可同時處在不同階段
+    (例如項目 N+1 在 LLM 階段時，項目 N 正在寫入 Notion)。
+
+    Args:
+        source: 任意可迭代物件，作為第一個階段的輸入。
+        stages: Stage 列表。
+        on_done: 每個項目離開流水線時呼叫 on_done(ok)；ok 為 True 表示走完所有階段。
+        log: 日誌函式。
+
+    Returns:
+        {"completed": 走完全部階段的數量, "dropped": 被丟棄或出錯的數量}
+    """
+    queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+    remaining_workers = [stage.workers for stage in stages]
+    stats = {"completed": 0, "dropped": 0}
+    lock = threading.Lock()
+
+    def finish(ok: bool):
+        # 在鎖內呼叫 on_done，讓回呼不必自行處理多執行緒下的計數
+        with lock:
+            stats["completed" if ok else "dropped"] += 1
+            if on_done:
+                on_done(ok)
+
+    def worker(index: int):
+        stage = stages[index]
+        while (item := queues[index].get()) is not _STOP:
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                log(f"❌ [{stage.name}] 處理項目時發生錯誤: {e}")
+                result = None
+
+            if result is None:
+                finish(False)
+            elif index + 1 < len(stages):
+                queues[index + 1].put(result)
+            else:
+                finish(True)
+
+        # 此階段最後一個結束的工作執行緒，負責通知下一階段的所有工作執行緒停止
+        with lock:
+            remaining_workers[index] -= 1
+            is_last = remaining_workers[index] == 0
+        if is_last and index + 1 < len(stages):
+            for _ in range(stages[index + 1].workers):
+                queues[index + 1].put(_STOP)
+
+    threads = [
+        threading.Thread(target=worker, args=(index,), name=f"pipeline-{stage.name}-{n}", daemon=True)
+        for index, stage in enumerate(stages) for n in range(stage.workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for item in source:
+            queues[0].put(item)
+    finally:
+        for _ in range(stages[0].workers):
+            queues[0].put(_STOP)
+        for thread in threads:
+            thread.join()
+
+    return stats
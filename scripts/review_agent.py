@@ -1,10 +1,22 @@
 # scripts/review_agent.py
+import os
 import json
-from .llm_handler import query_llm
+import time
+import sqlite3
+import hashlib
+from contextlib import closing
+from datetime import datetime, timedelta
 
-def generate_periodic_review(consolidated_notes: str, period: str, config: dict) -> dict:
+from .llm_handler import query_llm, estimate_tokens
+from .llm_executor import get_llm_executor
+from .similarity_handler import get_embeddings, cluster_embeddings, pick_representative
+
+DEFAULT_DIGEST_PATH = os.path.join("data", "review_digests.db")
+
+def generate_periodic_review(consolidated_notes: str, period: str, config: dict, on_partial=None) -> dict:
     """
     分析一段時間內的筆記合集，生成趨勢和洞見。
+    on_partial: 串流生成期間，每當某個欄位完成時呼叫 on_partial({欄位: 值})。
     """
     system_prompt = f"""
     你是一位頂尖的戰略分析師和研究員。你的任務是分析使用者在過去一段時間（{period}）內收集的筆記合集，從中提煉出高層次的洞見。
@@ -26,7 +38,7 @@ def generate_periodic_review(consolidated_notes: str, period: str, config: dict)
     user_prompt = f"這是我的筆記合集，請進行分析：\n\n---\n{consolidated_notes}\n---"
     
     print("🧠 正在呼叫趨勢分析 Agent... (這將花費較長時間，請耐心等待)")
-    response_content = query_llm(system_prompt, user_prompt, config, use_json_format=True)
+    response_content = query_llm(system_prompt, user_prompt, config, use_json_format=True, on_partial=on_partial)
     
     if response_content:
         try:
@@ -35,3 +47,172 @@ def generate_periodic_review(consolidated_notes: str, period: str, config: dict)
             print(f"❌ 無法解析趨勢分析 Agent 的回應為 JSON: {e}")
             return None
     return None
+
+def _first_text(prop: dict, key: str) -> str:
+    """安全地取出 Notion title/rich_text 屬性的第一段文字；屬性為空時返回空字串。"""
+    items = prop.get(key) or [{}]
+    return items[0].get("text", {}).get("content", "")
+
+def format_note_for_review(note: dict) -> str:
+    """將一個知識節點濃縮為「標題 + 核心概念」；標題以 💡 開頭的原創想法會加上 [ORIGINAL IDEA] 標記。"""
+    props = note.get("properties", {})
+    title = _first_text(props.get("Title", {}), "title")
+    core_idea = _first_text(props.get("Core Idea", {}), "rich_text")
+    note_prefix = "[ORIGINAL IDEA] " if title.strip().startswith("💡") else ""
+    return f"## {note_prefix}{title}\n> {core_idea}\n"
+
+def compress_notes_for_review(notes: list, config: dict) -> list:
+    """
+    將語意相近的筆記聚類，只保留每群的代表筆記並標註該群的筆記數，減少回顧 prompt 中的重複內容。
+    [ORIGINAL IDEA] 筆記一律原樣保留，不參與聚類。返回格式化後的筆記文字列表。
+    REVIEW_CONFIG.cluster_notes 為 false，或嵌入模型無法載入時，返回所有筆記原文。
+    """
+    review_config = config.get("REVIEW_CONFIG", {})
+    formatted = [format_note_for_review(note) for note in notes]
+    if not review_config.get("cluster_notes", True):
+        return formatted
+
+    original_ideas = [text for text in formatted if text.startswith("## [ORIGINAL IDEA]")]
+    candidates = [text for text in formatted if not text.startswith("## [ORIGINAL IDEA]")]
+    if len(candidates) < 2:
+        return formatted
+
+    try:
+        embeddings = get_embeddings(candidates, config=config)
+    except Exception as e:
+        print(f"⚠️ 無法載入嵌入模型，略過筆記聚類: {e}")
+        return formatted
+
+    compressed = list(original_ideas)
+    for group in cluster_embeddings(embeddings, review_config.get("cluster_threshold", 0.85)):
+        representative = candidates[pick_representative(embeddings, group)]
+        if len(group) > 1:
+            representative = f"{representative}(此主題共有 {len(group)} 篇相似筆記)\n"
+        compressed.append(representative)
+
+    before = sum(estimate_tokens(text) for text in formatted)
+    after = sum(estimate_tokens(text) for text in compressed)
+    print(f"🗜️ 筆記聚類：{len(formatted)} 篇 → {len(compressed)} 篇，prompt 約 {before} → {after} tokens (減少 {before - after})。")
+    return compressed
+
+def _week_start(note: dict) -> str:
+    """返回筆記建立時間所在週的星期一 (ISO 日期字串)。"""
+    created = datetime.fromisoformat(note.get("created_time", "").replace("Z", "+00:00")).date()
+    return (created - timedelta(days=created.weekday())).isoformat()
+
+def _connect_digests(db_path: str) -> sqlite3.Connection:
+    db_dir = os.path.dirname(db_path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS weekly_digests (
+            week_start TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (week_start, content_hash)
+        )
+    """)
+    return conn
+
+def generate_weekly_digest(week_start: str, week_text: str, config: dict) -> dict:
+    """為單一週的筆記生成精簡摘要，作為月度/季度回顧的輸入。"""
+    system_prompt = """
+    你是一位研究助理。你的任務是把使用者一週內的筆記合集，濃縮成一份精簡的週摘要，供之後的月度或季度趨勢分析使用。
+
+    **重要規則：**
+    1.  你的所有輸出都必須使用「繁體中文」(Traditional Chinese)。
+    2.  標題前帶有 `[ORIGINAL IDEA]` 標記的是使用者的原創想法，必須完整保留在 "original_ideas" 中，不可省略。
+    3.  你的輸出必須是單一、有效的 JSON 物件，不包含任何額外解釋。
+
+    JSON 結構應包含以下鍵：
+    - "summary": (繁體中文) 用 3-5 句話總結本週的主要學習與思考。
+    - "themes": (繁體中文) 一個列表，列出本週反覆出現的主題。
+    - "original_ideas": (繁體中文) 一個列表，列出本週 `[ORIGINAL IDEA]` 筆記的標題與核心概念；沒有則為空列表。
+    - "open_questions": (繁體中文) 一個列表，列出本週筆記引發的問題。
+    """
+    user_prompt = f"這是我在 {week_start} 這一週的筆記合集，請生成週摘要：\n\n---\n{week_text}\n---"
+    print(f"🧠 正在生成 {week_start} 當週的摘要...")
+    response_content = query_llm(system_prompt, user_prompt, config, use_json_format=True)
+    if response_content:
+        try:
+            return json.loads(response_content)
+        except json.JSONDecodeError as e:
+            print(f"❌ 無法解析週摘要的回應為 JSON: {e}")
+            return None
+    return None
+
+def _format_digest(week_start: str, note_count: int, digest: dict) -> str:
+    lines = [f"## 週摘要：{week_start} 起的一週 ({note_count} 篇筆記)", f"> {digest.get('summary', '')}"]
+    for label, key, prefix in (("主題", "themes", ""), ("原創想法", "original_ideas", "[ORIGINAL IDEA] "), ("待探索問題", "open_questions", "")):
+        values = digest.get(key) or []
+        if values:
+            lines.append(f"{label}：")
+            lines.extend(f"- {prefix}{value}" for value in values)
+    return "\n".join(lines) + "\n"
+
+def build_review_input(notes: list, period: str, config: dict) -> str:
+    """
+    為 generate_periodic_review 準備輸入文字。語意相近的筆記會先以 compress_notes_for_review 聚類壓縮。
+    週回顧直接使用 (壓縮後的) 筆記；月度/季度回顧則先把筆記依週分組，每週生成一次週摘要並快取在本地
+    (以週起始日 + 該週筆記內容與模型的雜湊為鍵)，再以各週摘要作為輸入。
+    重跑同一期間的回顧時，內容未變的週直接使用快取，只剩最後一次小的彙整呼叫。
+    REVIEW_CONFIG.hierarchical 為 false 時，所有期間都使用筆記本身。
+    """
+    review_config = config.get("REVIEW_CONFIG", {})
+    if period == "weekly" or not review_config.get("hierarchical", True):
+        return "\n---\n".join(compress_notes_for_review(notes, config))
+
+    notes_by_week = {}
+    for note in notes:
+        notes_by_week.setdefault(_week_start(note), []).append(note)
+    # 每週各自聚類，讓一週的輸入只取決於該週的筆記，週摘要快取才能重複使用
+    weeks = {week: compress_notes_for_review(week_notes, config) for week, week_notes in notes_by_week.items()}
+
+    provider = config.get("LLM_PROVIDER", "local")
+    model = config.get("CLOUD_CONFIG" if provider == "cloud" else "LOCAL_CONFIG", {}).get("LLM_MODEL_NAME")
+    week_texts = {week: "\n---\n".join(sorted(texts)) for week, texts in weeks.items()}
+    hashes = {
+        week: hashlib.sha256(json.dumps([provider, model, text], ensure_ascii=False).encode("utf-8")).hexdigest()
+        for week, text in week_texts.items()
+    }
+
+    digests = {}
+    try:
+        with closing(_connect_digests(review_config.get("digest_path", DEFAULT_DIGEST_PATH))) as conn, conn:
+            for week, content_hash in hashes.items():
+                row = conn.execute(
+                    "SELECT digest FROM weekly_digests WHERE week_start = ? AND content_hash = ?", (week, content_hash)
+                ).fetchone()
+                if row:
+                    digests[week] = json.loads(row[0])
+    except sqlite3.Error as e:
+        print(f"⚠️ 讀取週摘要快取失敗，將重新生成: {e}")
+
+    missing = sorted(week for week in week_texts if week not in digests)
+    print(f"📚 共 {len(week_texts)} 週的筆記：{len(week_texts) - len(missing)} 週使用快取的週摘要，{len(missing)} 週需要生成。")
+    generated = get_llm_executor(config).map(lambda week: generate_weekly_digest(week, week_texts[week], config), missing)
+
+    new_rows = []
+    for week, digest in zip(missing, generated):
+        if digest:
+            digests[week] = digest
+            new_rows.append((week, hashes[week], json.dumps(digest, ensure_ascii=False), time.time()))
+    if new_rows:
+        try:
+            with closing(_connect_digests(review_config.get("digest_path", DEFAULT_DIGEST_PATH))) as conn, conn:
+                conn.executemany("INSERT OR REPLACE INTO weekly_digests VALUES (?, ?, ?, ?)", new_rows)
+        except sqlite3.Error as e:
+            print(f"⚠️ 寫入週摘要快取失敗: {e}")
+
+    sections = []
+    for week in sorted(week_texts):
+        if week in digests:
+            sections.append(_format_digest(week, len(notes_by_week[week]), digests[week]))
+        else:
+            # 週摘要生成失敗時，退回使用該週的原始筆記，避免遺漏
+            print(f"⚠️ {week} 當週摘要生成失敗，改用原始筆記。")
+            sections.append(week_texts[week])
+    return "\n---\n".join(sections)
@@ -0,0 +1,138 @@
+# scripts/scheduler.py
+# 自適應節流排程器：依各後端 (Notion、LLM) 實際觀察到的 429、5xx 與逾時決定項目之間的間隔，取代固定的 sleep。
+# (請求的排隊由 LLMExecutor 的槽位負責，排程器只對真正的節流訊號放慢節奏。)
+import time
+import threading
+from contextlib import contextmanager
+
+import httpx
+import requests
+
+def is_throttle_error(error: Exception) -> bool:
+    """逾時、連線錯誤、HTTP 429 與 5xx 代表後端忙不過來；其他錯誤 (例如回應格式錯誤) 與負載無關。"""
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                          httpx.TimeoutException, httpx.NetworkError)):
+        return True
+    response = getattr(error, "response", None)
+    if isinstance(error, (requests.exceptions.HTTPError, httpx.HTTPStatusError)) and response is not None:
+        return response.status_code == 429 or response.status_code >= 500
+    return False
+
+class BackendStats:
+    """單一後端的觀測數據。"""
+
+    def __init__(self):
+        self.in_flight = 0             # 本進程目前送往該後端、尚未完成的請求數
+        self.delay = 0.0               # 目前建議的間隔秒數
+        self.throttle_count = 0
+        self.throttled_since_wait = False
+        self.ewma_latency = None
+        self.completed = 0
+
+class AdaptiveScheduler:
+    """
+    以 AIMD 方式調整節奏：後端出現 429/逾時時倍增間隔；若處理一個項目期間該後端沒有再被節流，間隔按比例縮小。
+    沒有任何壓力訊號時間隔為 0，也就是全速處理。
+    """
+
+    def __init__(self, max_delay: float = 60.0, backoff_factor: float = 2.0, recovery_factor: float = 0.5,
+                 min_backoff: float = 1.0):
+        self.max_delay = max_delay
+        self.backoff_factor = backoff_factor
+        self.recovery_factor = recovery_factor
+        self.min_backoff = min_backoff
+        self.backends = {}
+        self.lock = threading.Lock()
+
+    def _stats(self, backend: str) -> BackendStats:
+        if backend not in self.backends:
+            self.backends[backend] = BackendStats()
+        return self.backends[backend]
+
+    def record_throttle(self, backend: str, retry_after: float = None):
+        """記錄一次節流 (429 或逾時)。若後端提供 Retry-After，間隔至少為該值。"""
+        with self.lock:
+            stats = self._stats(backend)
+            stats.throttle_count += 1
+            stats.throttled_since_wait = True
+            stats.delay = min(self.max_delay, max(retry_after or 0.0, stats.delay * self.backoff_factor, self.min_backoff))
+
+    def record_success(self, backend: str, latency: float = None):
+        with self.lock:
+            stats = self._stats(backend)
+            stats.completed += 1
+            if latency is not None:
+                stats.ewma_latency = latency if stats.ewma_latency is None else 0.8 * stats.ewma_latency + 0.2 * latency
+
+    @contextmanager
+    def track(self, backend: str):
+        """
+        包住一次對後端的呼叫：統計在途請求數與延遲。
+        逾時、連線錯誤、429 與 5xx 視為節流訊號 (見 is_throttle_error)；其他例外照常拋出，不影響節奏。
+        """
+        with self.lock:
+            self._stats(backend).in_flight += 1
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if is_throttle_error(e):
+                self.record_throttle(backend)
+            raise
+        else:
+            self.record_success(backend, time.monotonic() - start)
+        finally:
+            with self.lock:
+                self._stats(backend).in_flight -= 1
+
+    def next_delay(self) -> float:
+        """所有後端中最保守的建議間隔。"""
+        with self.lock:
+            return max((stats.delay for stats in self.backends.values()), default=0.0)
+
+    def wait(self) -> float:
+        """在兩個項目之間呼叫：先讓上一個項目期間未被節流的後端恢復，再依目前的壓力訊號暫停，返回實際等待的秒數。"""
+        with self.lock:
+            for stats in self.backends.values():
+                if not stats.throttled_since_wait:
+                    stats.delay *= self.recovery_factor
+                    if stats.delay < 0.05:
+                        stats.delay = 0.0
+                stats.throttled_since_wait = False
+        delay = self.next_delay()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def describe(self) -> str:
+        """返回各後端狀態的簡短摘要，用於日誌。"""
+        with self.lock:
+            parts = []
+            for name, stats in self.backends.items():
+                latency = f"{stats.ewma_latency:.1f}s" if stats.ewma_latency is not None else "-"
+                parts.append(f"{name}: 延遲 {latency}, 節流 {stats.throttle_count} 次, 間隔 {stats.delay:.1f}s")
+            return "; ".join(parts)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler(config: dict) -> AdaptiveScheduler:
+    """
+    返回進程內共用的排程器。首次建立時會掛載到 Notion 客戶端的限速器上，
+    讓同步與非同步 Notion 請求遇到 429 時都能回報。
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            from .notion_handler import get_notion_client
+            scheduler_config = config.get("SCHEDULER_CONFIG", {})
+            _scheduler = AdaptiveScheduler(
+                max_delay=scheduler_config.get("max_delay", 60.0),
+                backoff_factor=scheduler_config.get("backoff_factor", 2.0),
+                recovery_factor=scheduler_config.get("recovery_factor", 0.5),
+            )
+            if config.get('NOTION_TOKEN'):
+                get_notion_client(config['NOTION_TOKEN'], config).rate_limiter.add_pause_listener(
+                    lambda seconds: _scheduler.record_throttle("notion", seconds)
+                )
+        return _scheduler
@@ -1,18 +1,167 @@
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+import os
+import glob
+import threading
 
-# 載入一個輕量且高效的模型。模型會在第一次使用時自動下載。
+import numpy as np
+
+from .embedding_cache import EmbeddingCache, DEFAULT_CACHE_PATH
+from .vector_store import get_vector_store, knowledge_node_text
+
+# 一個輕量且高效的模型。模型會在第一次使用時自動下載。
 # 'all-MiniLM-L6-v2' 是一個優秀的英文模型。
 # 'paraphrase-multilingual-MiniLM-L12-v2' 支援多語言，包含中文。
-MODEL = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+
+DEFAULT_MODEL_DIR = os.path.join("data", "models")
+
+_models = {}
+_model_lock = threading.Lock()
+_cache = None
+_cache_lock = threading.Lock()
+
+def _get_backend(config: dict = None) -> tuple[str, str]:
+    """從 EMBEDDING_CONFIG 讀取推論後端 ("torch" 或 "onnx-int8") 與 int8 量化所針對的 CPU 指令集。"""
+    embedding_config = (config or {}).get("EMBEDDING_CONFIG", {})
+    return embedding_config.get("backend", "torch"), embedding_config.get("quantization", "avx2")
+
+def _backend_key(config: dict = None) -> str:
+    """不同後端產生的向量略有差異，快取鍵需要區分；torch 後端沿用原本的鍵。"""
+    backend, quantization = _get_backend(config)
+    return MODEL_NAME if backend == "torch" else f"{MODEL_NAME}:{backend}:{quantization}"
+
+def _load_onnx_int8_model(quantization: str, model_dir: str):
+    """
+    以 ONNX Runtime 執行 int8 動態量化後的模型。
+    第一次使用時，將模型匯出為 ONNX 並量化，存到 model_dir 之下；之後直接載入量化後的檔案。
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
 
-def get_embedding(text: str):
+    local_path = os.path.join(model_dir, f"{os.path.basename(MODEL_NAME)}-onnx")
+    # 量化後的權重型別依指令集而定 (例如 avx2 為 quint8，avx512_vnni 為 qint8)，所以以萬用字元尋找檔名
+    pattern = os.path.join(local_path, "onnx", f"model_*int8_{quantization}.onnx")
+    if not glob.glob(pattern):
+        print(f"🔧 正在將 '{MODEL_NAME}' 匯出為 ONNX 並進行 int8 量化 ({quantization})，只需執行一次...")
+        onnx_model = SentenceTransformer(MODEL_NAME, backend="onnx")
+        onnx_model.save(local_path)
+        export_dynamic_quantized_onnx_model(onnx_model, quantization, local_path)
+    file_name = os.path.relpath(glob.glob(pattern)[0], local_path).replace(os.sep, "/")
+    return SentenceTransformer(local_path, backend="onnx", model_kwargs={"file_name": file_name})
+
+def get_model(config: dict = None):
+    """
+    返回共用的嵌入模型 (依 EMBEDDING_CONFIG.backend 選擇 PyTorch 或 ONNX Runtime int8)。
+    模型 (以及 sentence-transformers/torch) 只在第一次需要向量時才載入，
+    只匯入本模組的進程不必付出數秒的載入時間與數百 MB 記憶體；多個執行緒同時呼叫時只會載入一次。
+    """
+    key = _backend_key(config)
+    if key not in _models:
+        with _model_lock:
+            if key not in _models:
+                backend, quantization = _get_backend(config)
+                print(f"⏳ 正在載入嵌入模型 '{MODEL_NAME}' (後端: {backend})...")
+                if backend == "onnx-int8":
+                    model_dir = (config or {}).get("EMBEDDING_CONFIG", {}).get("model_dir", DEFAULT_MODEL_DIR)
+                    _models[key] = _load_onnx_int8_model(quantization, model_dir)
+                elif backend == "torch":
+                    from sentence_transformers import SentenceTransformer
+                    _models[key] = SentenceTransformer(MODEL_NAME)
+                else:
+                    raise ValueError(f"不支援的嵌入後端: {backend}")
+    return _models[key]
+
+def _get_cache(config: dict = None):
+    """返回進程內共用的 EmbeddingCache (路徑為 EMBEDDING_CONFIG.cache_path)；若 EMBEDDING_CONFIG.cache_enabled 為 false 則返回 None。"""
+    global _cache
+    embedding_config = (config or {}).get("EMBEDDING_CONFIG", {})
+    if not embedding_config.get("cache_enabled", True):
+        return None
+    # 與模型載入分開上鎖：第一次載入模型可能要數十秒，不應擋住快取的建立
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache(embedding_config.get("cache_path", DEFAULT_CACHE_PATH))
+        return _cache
+
+def get_embedding(text: str, config: dict = None):
     """為單段文本生成向量嵌入。"""
-    return MODEL.encode(text)
+    return get_embeddings([text], config=config)[0]
+
+def get_embeddings(texts: list, batch_size: int = 32, use_cache: bool = True, config: dict = None):
+    """
+    為多段文本批次生成向量嵌入，返回形狀為 (len(texts), 維度) 的 float32 矩陣 (順序與 texts 一致)。
+
+    - 先以內容雜湊查詢磁碟快取，只有未快取的文本才送進模型。
+    - 未快取的文本依長度排序後分批編碼，讓同一批的長度相近，減少補齊 (padding) 的浪費。
+    - config: 用於選擇推論後端與快取設定 (EMBEDDING_CONFIG)；省略時使用 PyTorch 後端與預設的快取路徑。
+    """
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+
+    cache = _get_cache(config) if use_cache else None
+    model_key = _backend_key(config)
+    keys = [EmbeddingCache.make_key(model_key, text) for text in texts]
+    found = cache.get_many(list(set(keys))) if cache else {}
+
+    # 相同內容只需編碼一次
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in missing:
+            missing[key] = text
+    if missing:
+        missing_keys = sorted(missing, key=lambda key: len(missing[key]))
+        vectors = get_model(config).encode([missing[key] for key in missing_keys], batch_size=batch_size, convert_to_numpy=True)
+        computed = dict(zip(missing_keys, np.asarray(vectors, dtype=np.float32)))
+        if cache:
+            cache.put_many(computed)
+        found.update(computed)
+
+    return np.stack([found[key] for key in keys]).astype(np.float32)
+
+def cluster_embeddings(embeddings, threshold: float = 0.85) -> list:
+    """
+    以平均連結 (average linkage) 的階層式聚類，將餘弦相似度高於 threshold 的向量合併成群。
+    相似度矩陣一次以 NumPy 算出，合併時以 Lance-Williams 公式就地更新，不需重算。
+
+    Returns:
+        群組列表，每個群組是原始索引的列表 (依索引排序)。
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    count = len(vectors)
+    if count == 0:
+        return []
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    similarity = vectors @ vectors.T
+    np.fill_diagonal(similarity, -np.inf)
+    sizes = np.ones(count)
+    members = [[i] for i in range(count)]
+
+    while True:
+        i, j = np.unravel_index(np.argmax(similarity), similarity.shape)
+        if similarity[i, j] < threshold:
+            break
+        # 將群 j 併入群 i：新群與其他群的平均相似度為兩群相似度的加權平均
+        merged = (sizes[i] * similarity[i] + sizes[j] * similarity[j]) / (sizes[i] + sizes[j])
+        similarity[i, :] = merged
+        similarity[:, i] = merged
+        similarity[i, i] = -np.inf
+        similarity[j, :] = -np.inf
+        similarity[:, j] = -np.inf
+        sizes[i] += sizes[j]
+        members[i].extend(members[j])
+        members[j] = []
+
+    return [sorted(group) for group in members if group]
+
+def pick_representative(embeddings, group: list) -> int:
+    """返回群組中最接近群中心的成員索引。"""
+    vectors = np.asarray(embeddings, dtype=np.float32)[group]
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    centroid = vectors.mean(axis=0)
+    return group[int(np.argmax(vectors @ centroid))]
 
 def find_similar_items(target_embedding, existing_embeddings: list, threshold=0.7) -> list:
     """
     在現有嵌入中尋找與目標嵌入相似的項目。
+    (適用於臨時的小型列表；已存入向量庫的知識節點請使用 find_similar_nodes。)
 
     Args:
         target_embedding: 目標文本的嵌入向量。
@@ -25,17 +174,33 @@ def find_similar_items(target_embedding, existing_embeddings: list, threshold=0.
     if not existing_embeddings:
         return []
 
-    # 分離 ID 和嵌入向量
+    # 分離 ID 和嵌入向量，並以正規化後的內積計算餘弦相似度
     ids, embeddings = zip(*existing_embeddings)
-    
-    # 計算餘弦相似度
-    similarities = cosine_similarity([target_embedding], list(embeddings))[0]
-    
-    similar_items = []
-    for i, score in enumerate(similarities):
-        if score >= threshold:
-            similar_items.append({"id": ids[i], "score": score})
-            
-    # 按分數從高到低排序
-    return sorted(similar_items, key=lambda x: x['score'], reverse=True)
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    target = np.asarray(target_embedding, dtype=np.float32)
+    similarities = matrix @ (target / max(np.linalg.norm(target), 1e-12))
+
+    # 只對超過閾值的項目排序 (按分數從高到低)
+    above = np.flatnonzero(similarities >= threshold)
+    order = above[np.argsort(-similarities[above])]
+    return [{"id": ids[i], "score": float(similarities[i])} for i in order]
 
+def index_knowledge_nodes(nodes: list, config: dict) -> int:
+    """
+    將知識節點寫入本地向量庫 (已存在的節點會覆寫)。
+    nodes: [(節點 ID, 標題, 核心概念), ...]。返回寫入的數量；向量庫停用時返回 0。
+    """
+    store = get_vector_store(config)
+    if store is None or not nodes:
+        return 0
+    texts = [knowledge_node_text(title, core_idea) for _, title, core_idea in nodes]
+    store.add_many([node_id for node_id, _, _ in nodes], get_embeddings(texts, config=config))
+    return len(nodes)
+
+def find_similar_nodes(text: str, config: dict, k: int = 5, threshold: float = None, exclude: set = None) -> list:
+    """在向量庫中查詢與文字最相似的 k 個知識節點，返回 [{"id", "score"}, ...]。"""
+    store = get_vector_store(config)
+    if store is None:
+        return []
+    return store.search(get_embedding(text, config), k=k, threshold=threshold, exclude=exclude)
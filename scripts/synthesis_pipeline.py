@@ -0,0 +1,97 @@
+# scripts/synthesis_pipeline.py
+# 知識合成流水線：抓取正文 → LLM 生成知識節點 → 寫入 Notion → 更新 Inbox 狀態 → 寫入向量庫 → 發送 Email。
+from .async_notion_handler import iter_page_contents
+from .email_handler import send_email, format_knowledge_node_as_html
+from .knowledge_agent import create_knowledge_node
+from .llm_executor import get_llm_executor, get_parallel_slots
+from .notion_handler import get_notion_client, format_knowledge_properties
+from .pipeline import Stage, run_pipeline
+from .scheduler import get_scheduler
+from .similarity_handler import index_knowledge_nodes
+
+DEFAULT_QUEUE_SIZES = {"llm": 2, "write": 4, "status": 4, "index": 8, "email": 8}
+
+def run_synthesis_pipeline(config: dict, new_items: list, log=print, on_progress=None, send_emails: bool = True) -> dict:
+    """
+    以分階段的流水線處理 Inbox 中的新項目。各階段之間以有界佇列連接，
+    所以當項目 N+1 在 LLM 階段時，項目 N 的 Notion 寫入、狀態更新和 Email 在背景同時進行。
+
+    Args:
+        config: 設定檔。PIPELINE_CONFIG.queue_sizes 可覆寫各階段的佇列容量 (背壓)，PIPELINE_CONFIG.llm_workers 設定 LLM 階段的併發數，預設等於 LLM 後端的平行槽位數 (實際的模型請求一律經由共用的 LLM 執行器，在途數不會超過槽位數)。
+        new_items: 從 Inbox 查詢到的頁面物件列表。
+        log: 日誌函式。
+        on_progress: 每個項目離開流水線時呼叫 on_progress(ok)。
+        send_emails: 是否包含 Email 階段。
+
+    Returns:
+        {"completed": 成功合成的數量, "dropped": 被跳過或失敗的數量}
+    """
+    notion = get_notion_client(config['NOTION_TOKEN'], config)
+    scheduler = get_scheduler(config)
+    pipeline_config = config.get("PIPELINE_CONFIG", {})
+    queue_sizes = {**DEFAULT_QUEUE_SIZES, **pipeline_config.get("queue_sizes", {})}
+
+    def llm_stage(fetched):
+        page, content_to_process, metadata = fetched
+        if not content_to_process.strip():
+            log(f"⚠️ 項目 {page['id']} 內容為空，已跳過。")
+            return None
+
+        # 依 Notion 429 與 LLM 逾時/排隊情況自適應地放慢節奏
+        waited = scheduler.wait()
+        if waited > 0:
+            log(f"🔄 後端壓力較高，已等待 {waited:.1f} 秒 ({scheduler.describe()})")
+
+        log(f"🧠 項目 '{content_to_process[:30]}...': 正在呼叫 AI...")
+
+        def on_partial(fields):
+            if "title" in fields:
+                log(f"💬 AI 已生成標題: '{fields['title']}'，繼續生成內容...")
+
+        # 經由共用的 LLM 執行器呼叫；長文切塊的摘要會併發執行，但與其他請求共用同一組槽位，在途請求總數不會超過槽位數
+        knowledge_data = get_llm_executor(config).submit(create_knowledge_node, content_to_process, config, on_partial=on_partial).result()
+        if not knowledge_data:
+            log(f"❌ AI 未能為項目 {page['id']} 生成有效節點。")
+            return None
+        return {"page_id": page['id'], "metadata": metadata, "knowledge_data": knowledge_data}
+
+    def write_stage(item):
+        log(f"✍️ 正在寫入 Notion: '{item['knowledge_data'].get('title', 'Untitled')}'")
+        properties = format_knowledge_properties(item["knowledge_data"], metadata=item["metadata"])
+        page = notion.create_page(config['KNOWLEDGE_DB_ID'], properties)
+        if not page:
+            log(f"❌ 寫入 Notion 失敗！")
+            return None
+        item["knowledge_page_id"] = page.get("id")
+        item["title"] = properties["Title"]["title"][0]["text"]["content"]
+        return item
+
+    def status_stage(item):
+        notion.update_page_status(item["page_id"], "Processed")
+        log(f"✅ 合成成功！")
+        return item
+
+    def index_stage(item):
+        # 將新節點追加到本地向量庫，供相似節點查詢使用；失敗不影響已寫入 Notion 的節點
+        try:
+            index_knowledge_nodes([(item["knowledge_page_id"], item["title"], item["knowledge_data"].get("core_idea", ""))], config)
+        except Exception as e:
+            log(f"⚠️ 無法將節點寫入向量庫 (可稍後執行 `python main.py index` 補上): {e}")
+        return item
+
+    def email_stage(item):
+        email_subject, email_body = format_knowledge_node_as_html(item["knowledge_data"], item["metadata"])
+        send_email(f"New Knowledge Node: {email_subject}", email_body, config)
+        return item
+
+    stages = [
+        Stage("llm", llm_stage, workers=pipeline_config.get("llm_workers", get_parallel_slots(config)), queue_size=queue_sizes["llm"]),
+        Stage("write", write_stage, queue_size=queue_sizes["write"]),
+        Stage("status", status_stage, queue_size=queue_sizes["status"]),
+    ]
+    if config.get("VECTOR_STORE", {}).get("enabled", True):
+        stages.append(Stage("index", index_stage, queue_size=queue_sizes["index"]))
+    if send_emails:
+        stages.append(Stage("email", email_stage, queue_size=queue_sizes["email"]))
+
+    return run_pipeline(iter_page_contents(config, new_items), stages, on_done=on_progress, log=log)
@@ -0,0 +1,141 @@
+# scripts/text_extraction.py
+# 送進 LLM 之前的文字清理：從 HTML 擷取正文 (類 readability 的內容密度評分)、去除導覽列/頁尾等重複版面、
+# 合併空白、去除重複行，並依 token 預算截斷，減少無用的 prompt token。
+import re
+
+from bs4 import BeautifulSoup
+
+from .chunking import split_into_chunks, condense_long_content
+from .llm_handler import estimate_tokens
+
+# 不含正文的標籤，直接移除
+_JUNK_TAGS = ["script", "style", "noscript", "template", "svg", "canvas", "iframe", "form", "button", "select", "nav", "aside"]
+# class/id 符合時視為版面元素 (導覽、Cookie 提示、分享按鈕、留言、推薦文章…)
+_BOILERPLATE_PATTERN = re.compile(
+    r"nav|menu|breadcrumb|footer|sidebar|cookie|consent|gdpr|banner|popup|modal|share|social|comment|related|"
+    r"recommend|newsletter|subscribe|advert|\bads?\b|promo|sponsor|masthead|toolbar|pagination",
+    re.IGNORECASE
+)
+# class/id 同時含有這些字詞時仍視為可能的正文容器 (與 readability 的判斷相同)
+_CONTENT_PATTERN = re.compile(r"and|article|body|column|content|main|shadow", re.IGNORECASE)
+_BOILERPLATE_ROLES = {"navigation", "banner", "contentinfo", "complementary", "dialog", "alertdialog"}
+_CANDIDATE_TAGS = ["div", "section", "article", "main", "td", "body"]
+_COMMA_PATTERN = re.compile(r"[,，、;；]")
+MIN_PARAGRAPH_CHARS = 25
+# 擷取結果少於此字數時，不依 class/id 移除版面元素再擷取一次
+MIN_EXTRACT_CHARS = 250
+
+def _is_boilerplate(tag) -> bool:
+    if tag.get("aria-hidden") == "true" or tag.get("role") in _BOILERPLATE_ROLES:
+        return True
+    names = " ".join(tag.get("class") or []) + " " + (tag.get("id") or "")
+    return bool(names.strip()) and bool(_BOILERPLATE_PATTERN.search(names)) and not _CONTENT_PATTERN.search(names)
+
+def _strip_junk(soup: BeautifulSoup):
+    for tag in soup.find_all(_JUNK_TAGS):
+        tag.decompose()
+    # 文章內的 <header>/<footer> 通常是標題與作者資訊，只移除整頁層級的
+    for tag in soup.find_all(["header", "footer"]):
+        if not tag.find_parent(["article", "main"]):
+            tag.decompose()
+
+def _strip_boilerplate(soup: BeautifulSoup, keep=None):
+    """依 class/id/role 移除版面元素；包含 keep (已選定的正文容器) 的祖先元素不會被移除。"""
+    protected = set(map(id, keep.parents)) if keep is not None else set()
+    for tag in soup.find_all(True):
+        if tag.decomposed or id(tag) in protected:
+            continue
+        if tag.name not in ("html", "body", "article", "main") and _is_boilerplate(tag):
+            tag.decompose()
+
+def _link_density(tag) -> float:
+    text_length = len(tag.get_text(strip=True))
+    if not text_length:
+        return 1.0
+    link_length = sum(len(a.get_text(strip=True)) for a in tag.find_all("a"))
+    return min(1.0, link_length / text_length)
+
+def _best_candidate(soup: BeautifulSoup):
+    """
+    依內容密度找出正文容器：每個足夠長的段落依長度與逗號數給分，分數加到父元素 (祖父元素加一半)，
+    再依連結密度打折 (導覽區塊幾乎都是連結)。沒有合適的候選時返回 None。
+    """
+    scores = {}
+    for paragraph in soup.find_all(["p", "pre", "blockquote", "li", "td"]):
+        text = paragraph.get_text(" ", strip=True)
+        if len(text) < MIN_PARAGRAPH_CHARS:
+            continue
+        score = 1 + len(_COMMA_PATTERN.findall(text)) + min(len(text) / 100, 3)
+        parent = paragraph.find_parent(_CANDIDATE_TAGS)
+        if parent is None:
+            continue
+        scores[parent] = scores.get(parent, 0) + score
+        grandparent = parent.find_parent(_CANDIDATE_TAGS)
+        if grandparent is not None:
+            scores[grandparent] = scores.get(grandparent, 0) + score / 2
+    if not scores:
+        return None
+    return max(scores, key=lambda tag: scores[tag] * (1 - _link_density(tag)))
+
+def clean_text(text: str) -> str:
+    """合併每行內的連續空白、移除空行，並去除重複出現的行 (保留第一次出現)。"""
+    lines, seen = [], set()
+    for line in text.splitlines():
+        line = re.sub(r"\s+", " ", line).strip()
+        if not line or line in seen:
+            continue
+        seen.add(line)
+        lines.append(line)
+    return "\n".join(lines)
+
+def _extract(html: str, strip_classes: bool) -> str:
+    soup = BeautifulSoup(html, "html.parser")
+    _strip_junk(soup)
+    container = soup.find("article") or soup.find("main")
+    if container is not None and len(container.get_text(strip=True)) < MIN_PARAGRAPH_CHARS * 4:
+        container = None
+    if strip_classes:
+        _strip_boilerplate(soup, keep=container)
+    if container is None:
+        container = _best_candidate(soup) or soup.body or soup
+
+    title = soup.title.get_text(strip=True) if soup.title else ""
+    text = clean_text(container.get_text(separator="\n"))
+    if title and text.split("\n", 1)[0] != title:
+        text = f"Title: {title}\n\n{text}"
+    return text
+
+def extract_main_text(html: str) -> str:
+    """
+    從 HTML 擷取正文並正規化。優先使用 <article>/<main>，其次是內容密度最高的區塊，最後才是整個頁面。
+    與 readability 相同：依 class/id 移除版面元素後擷取到的文字太少時 (例如正文包在 class="has-sidebar" 的容器裡)，
+    改為不依 class/id 移除再擷取一次。
+    """
+    text = _extract(html, strip_classes=True)
+    if len(text) < MIN_EXTRACT_CHARS:
+        retry = _extract(html, strip_classes=False)
+        if len(retry) > len(text):
+            text = retry
+    return text
+
+def truncate_to_token_budget(text: str, max_tokens: int) -> str:
+    """將文本截斷到估算 token 數不超過 max_tokens，盡量在段落或句子邊界截斷。"""
+    if not max_tokens or estimate_tokens(text) <= max_tokens:
+        return text
+    chunks = split_into_chunks(text, max_tokens)
+    return chunks[0] if chunks else text
+
+def prepare_for_prompt(raw_content: str, config: dict) -> str:
+    """
+    正規化文本 → 過長時切塊摘要 (condense_long_content) → 依 EXTRACTION_CONFIG.token_budget 截斷，精簡幅度明顯時記錄於日誌。
+    截斷放在最後，只作為摘要後仍然過長時的上限，長文的後半段會先被摘要而不是直接丟掉。
+    """
+    extraction_config = config.get("EXTRACTION_CONFIG", {})
+    before = estimate_tokens(raw_content)
+    text = clean_text(raw_content)
+    text = condense_long_content(text, config)
+    text = truncate_to_token_budget(text, extraction_config.get("token_budget", 12000))
+    after = estimate_tokens(text)
+    if after < before * 0.9:
+        print(f"✂️ 已精簡輸入內容：約 {before} → {after} tokens")
+    return text
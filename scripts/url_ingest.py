@@ -0,0 +1,184 @@
+# scripts/url_ingest.py
+# 批次匯入網址：並發抓取 (全域上限 + 每個網域的禮貌限制) → LLM 智能處理 → 寫入 Notion Inbox，各階段以有界佇列連接。
+import time
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+
+from .dedup_handler import BatchDeduplicator, register_content, describe_duplicate
+from .fetch_strategy import get_domain
+from .inbox_agent import get_content_from_url, process_inbox_item
+from .llm_executor import get_llm_executor, get_parallel_slots
+from .notion_handler import get_notion_client, format_inbox_properties
+from .pipeline import Stage, run_pipeline
+from .scheduler import get_scheduler
+
+DEFAULT_QUEUE_SIZES = {"llm": 4, "write": 4}
+
+def read_url_list(lines: list) -> list:
+    """從文字行中取出網址：忽略空行與 # 開頭的註解，去除重複並保持原順序。"""
+    urls, seen = [], set()
+    for line in lines:
+        url = line.strip()
+        if not url or url.startswith("#") or url in seen:
+            continue
+        seen.add(url)
+        urls.append(url)
+    return urls
+
+def _fetch_one(url: str, config: dict) -> str:
+    try:
+        return get_content_from_url(url, config)
+    except Exception as e:
+        print(f"❌ 抓取 {url} 時發生錯誤: {e}")
+        return None
+
+def iter_url_contents(urls: list, config: dict):
+    """
+    同步產生器：並發抓取網址，每完成一個就產出 (url, content)，產出順序為完成順序；抓取失敗時 content 為 None。
+    - 同時最多 URL_INGEST.max_concurrency 個抓取。
+    - 同一網域同時最多 per_host 個抓取，且兩次開始之間至少間隔 host_delay 秒，避免對單一網站造成負擔。
+    排不上的網址留在各網域的佇列中，不會佔用工作執行緒，所以其他網域的網址不會被擋住。
+    """
+    ingest_config = config.get("URL_INGEST", {})
+    max_concurrency = max(1, ingest_config.get("max_concurrency", 8))
+    per_host = max(1, ingest_config.get("per_host", 2))
+    host_delay = ingest_config.get("host_delay", 1.0)
+
+    pending = defaultdict(deque)
+    for url in urls:
+        pending[get_domain(url)].append(url)
+    active = defaultdict(int)
+    next_start = defaultdict(float)
+    futures = {}
+
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="url-fetch") as pool:
+        while pending or futures:
+            now = time.monotonic()
+            wake_at = None
+            for host in list(pending):
+                if len(futures) >= max_concurrency:
+                    break
+                if active[host] >= per_host:
+                    continue
+                if next_start[host] > now:
+                    wake_at = next_start[host] if wake_at is None else min(wake_at, next_start[host])
+                    continue
+                url = pending[host].popleft()
+                if not pending[host]:
+                    del pending[host]
+                active[host] += 1
+                next_start[host] = now + host_delay
+                futures[pool.submit(_fetch_one, url, config)] = (url, host)
+
+            timeout = None if wake_at is None else max(0.0, wake_at - now)
+            if not futures:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                url, host = futures.pop(future)
+                active[host] -= 1
+                yield url, future.result()
+
+def run_url_ingest(config: dict, urls: list, force: bool = False, log=print) -> dict:
+    """
+    批次匯入網址到 Notion Inbox。抓取、LLM 與 Notion 寫入同時進行：
+    某些網址還在抓取時，先抓完的已經在 LLM 階段，更早的已經在寫入 Notion。
+
+    Args:
+        config: 設定檔。URL_INGEST 設定抓取的併發限制與各階段佇列容量；LLM 階段的併發數等於 LLM 後端的平行槽位數。
+        urls: 網址列表。
+        force: 為 True 時不做重複內容檢查。
+        log: 日誌函式。
+
+    Returns:
+        {"saved": [(url, 標題)], "duplicates": [(url, 說明)], "failed": [(url, 原因)], "elapsed": 秒數}
+    """
+    notion = get_notion_client(config['NOTION_TOKEN'], config)
+    scheduler = get_scheduler(config)
+    ingest_config = config.get("URL_INGEST", {})
+    queue_sizes = {**DEFAULT_QUEUE_SIZES, **ingest_config.get("queue_sizes", {})}
+    report = {"saved": [], "duplicates": [], "failed": []}
+    report_lock = threading.Lock()
+    started = time.perf_counter()
+    total = len(urls)
+
+    def add_to_report(kind: str, url: str, detail: str):
+        with report_lock:
+            report[kind].append((url, detail))
+
+    valid = []
+    for url in urls:
+        if urlparse(url).scheme in ("http", "https"):
+            valid.append(url)
+        else:
+            add_to_report("failed", url, "不是 http/https 網址")
+
+    # 比對已收錄的內容，以及本次匯入中先前已接受的網址 (例如同一篇文章的不同網址)
+    deduplicator = BatchDeduplicator(config, force)
+
+    def llm_stage(fetched):
+        url, content = fetched
+        if not content or not content.strip():
+            add_to_report("failed", url, "無法抓取內容")
+            return None
+        duplicate = deduplicator.check(content, label=url)
+        if duplicate:
+            add_to_report("duplicates", url, describe_duplicate(duplicate))
+            return None
+
+        waited = scheduler.wait()
+        if waited > 0:
+            log(f"🔄 後端壓力較高，已等待 {waited:.1f} 秒 ({scheduler.describe()})")
+        # 與其他 LLM 工作共用同一個有界執行器 (見 llm_executor)，避免本階段的執行緒再額外佔用槽位
+        processed_data = get_llm_executor(config).submit(process_inbox_item, content, config).result()
+        if not processed_data:
+            log(f"⚠️ {url} 的 AI 智能處理失敗，原始內容仍會被保存。")
+            processed_data = {}
+        return {"url": url, "content": content, "processed_data": processed_data}
+
+    def write_stage(item):
+        url, processed_data = item["url"], item["processed_data"]
+        properties = format_inbox_properties(processed_data, item["content"], url, source_type='url')
+        page = notion.create_page(config['INBOX_DB_ID'], properties, page_content=item["content"])
+        if not page:
+            add_to_report("failed", url, "寫入 Notion 失敗")
+            return None
+        register_content(item["content"], config, page_id=page.get("id"), url=url, title=processed_data.get("title"))
+        add_to_report("saved", url, processed_data.get("title") or "(無標題)")
+        return item
+
+    def on_done(ok):
+        with report_lock:
+            saved, duplicates, failed = len(report["saved"]), len(report["duplicates"]), len(report["failed"])
+        log(f"📈 進度: {saved + duplicates + failed}/{total} (新增 {saved}，重複 {duplicates}，失敗 {failed})")
+
+    stages = [
+        Stage("llm", llm_stage, workers=get_parallel_slots(config), queue_size=queue_sizes["llm"]),
+        Stage("write", write_stage, queue_size=queue_sizes["write"]),
+    ]
+    run_pipeline(iter_url_contents(valid, config), stages, on_done=on_done, log=log)
+
+    # 階段內拋出例外的項目沒有經過 add_to_report，補記為失敗
+    recorded = {url for entries in report.values() for url, _ in entries}
+    for url in urls:
+        if url not in recorded:
+            add_to_report("failed", url, "處理時發生錯誤")
+    report["elapsed"] = time.perf_counter() - started
+    return report
+
+def format_ingest_report(report: dict) -> str:
+    """批次匯入結束後的摘要與失敗清單。"""
+    lines = [
+        f"📊 批次匯入完成，耗時 {report['elapsed']:.1f} 秒：新增 {len(report['saved'])}，"
+        f"重複略過 {len(report['duplicates'])}，失敗 {len(report['failed'])}。"
+    ]
+    if report["duplicates"]:
+        lines.append("⏭️ 重複略過：")
+        lines.extend(f"   - {url}: {detail}" for url, detail in report["duplicates"])
+    if report["failed"]:
+        lines.append("❌ 失敗：")
+        lines.extend(f"   - {url}: {reason}" for url, reason in report["failed"])
+    return "\n".join(lines)
@@ -0,0 +1,422 @@
+# scripts/vector_store.py
+# 知識節點向量的本地儲存：向量以 float32 連續寫入檔案並以 memmap 讀取，節點 ID 與列號的對照存在 SQLite。
+import os
+import sqlite3
+import threading
+from contextlib import closing
+
+import numpy as np
+
+DEFAULT_STORE_PATH = os.path.join("data", "vector_store")
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """以 argpartition 取出分數最高的 k 個位置 (由高到低)，不必對全部分數排序。"""
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates])]
+
+def _encode_compact(vectors: np.ndarray, precision: str):
+    """
+    將 (已正規化的) float32 向量轉為精簡表示：
+    float16 直接轉型；int8 為每個向量各自縮放 (scale = 最大絕對值 / 127)，返回 (codes, scales)。
+    """
+    if precision == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+class VectorStore:
+    """
+    追加式的向量庫。向量寫入前先正規化，所以餘弦相似度等於內積。
+
+    - flat 模式：查詢時以整個 memmap 矩陣做一次矩陣乘法，再用 argpartition 取 top-k。
+    - ivf 模式：向量數達到 ivf_min_size 後，以 spherical k-means 訓練 n_lists 個中心，
+      每個向量歸入最近的中心；查詢時只掃描最接近查詢的 nprobe 個列表，掃描量約為 nprobe / n_lists。
+      向量數成長為訓練時的兩倍後會自動重新訓練。
+
+    precision 為 "float16" 或 "int8" 時，另外保存一份精簡向量 (分別為 float32 的 1/2 與約 1/4 大小)：
+    查詢時只掃描精簡向量 (分塊轉為 float32 後以矩陣乘法計分)，再從 float32 檔案讀出前 rerank_factor × k 個候選，
+    以完整精度重新排序。float32 檔案只會被讀到少數幾列，所以常駐記憶體主要是精簡向量的大小。
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH, mode: str = "flat", n_lists: int = None,
+                 nprobe: int = 8, ivf_min_size: int = 20000, precision: str = "float32", rerank_factor: int = 4):
+        if precision not in ("float32", "float16", "int8"):
+            raise ValueError(f"不支援的向量精度: {precision}")
+        self.path = path
+        self.mode = mode
+        self.precision = precision
+        self.rerank_factor = max(1, rerank_factor)
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.ivf_min_size = ivf_min_size
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.centroids_path = os.path.join(path, "ivf_centroids.npy")
+        self.compact_path = os.path.join(path, "vectors.f16" if precision == "float16" else "vectors.i8")
+        self.scales_path = os.path.join(path, "scales.f32")
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ids (
+                    row INTEGER PRIMARY KEY,
+                    node_id TEXT NOT NULL UNIQUE,
+                    list_id INTEGER
+                )
+            """)
+        self.dim = None
+        self.trained_count = 0
+        self.version = 0
+        self.compact_state = None
+        self.centroids = None
+        self.ids, self.rows = [], {}
+        self.list_ids = np.empty(0, dtype=np.int32)
+        self._db_state = None
+        with closing(self._connect()) as conn, conn:
+            self._refresh(conn)
+        self._ensure_compact()
+
+    def _refresh(self, conn: sqlite3.Connection):
+        """
+        其他進程 (例如 CLI 的 synthesis/index 與長駐的 Streamlit) 可能也寫入了同一個向量庫；
+        資料庫的列數或 IVF 訓練狀態與記憶體中的不同時，重新載入對照表。
+        列號可能不連續 (例如寫入失敗留下的空位)，ids 以列號為索引，空位為 None。
+        """
+        meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+        count, max_row = conn.execute("SELECT COUNT(*), COALESCE(MAX(row), -1) FROM ids").fetchone()
+        self.version = int(meta.get("version", 0))
+        self.compact_state = meta.get(self._compact_key)
+        state = (count, max_row, meta.get("ivf_trained_count"), self.version)
+        if state == self._db_state:
+            return
+        rows = conn.execute("SELECT row, node_id, list_id FROM ids ORDER BY row").fetchall()
+        self.dim = int(meta["dim"]) if "dim" in meta else None
+        self.trained_count = int(meta.get("ivf_trained_count", 0))
+        self.ids = [None] * (max_row + 1)
+        self.list_ids = np.full(max_row + 1, -1, dtype=np.int32)
+        for row, node_id, list_id in rows:
+            self.ids[row] = node_id
+            if list_id is not None:
+                self.list_ids[row] = list_id
+        self.rows = {node_id: row for row, node_id, _ in rows}
+        self.centroids = np.load(self.centroids_path) if os.path.exists(self.centroids_path) and self.trained_count else None
+        self._matrix = None
+        self._compact = None
+        self._lists = None
+        self._db_state = state
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(os.path.join(self.path, "index.db"), timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, node_id: str):
+        return node_id in self.rows
+
+    def matrix(self) -> np.ndarray:
+        """以唯讀 memmap 開啟所有向量 (形狀為 (數量, 維度))；只有實際讀到的部分才會載入記憶體。"""
+        with self.lock:
+            if self._matrix is None and self.ids:
+                self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self.ids), self.dim))
+            return self._matrix
+
+    def _compact_row_bytes(self) -> int:
+        return self.dim * (2 if self.precision == "float16" else 1)
+
+    @property
+    def _compact_key(self) -> str:
+        return f"compact_{self.precision}"
+
+    def _compact_stamp(self, version: int, rows: int) -> str:
+        """精簡向量的有效標記：對應的向量版本 (每次寫入遞增) 與列數，記錄在 meta 表中。"""
+        return f"{version}:{rows}"
+
+    def _ensure_compact(self):
+        """
+        精簡向量的標記與目前的向量版本、列數不符時 (例如既有的向量庫第一次切換精度、以另一種精度寫入過，
+        或其他進程重建了索引)，從 float32 向量分塊重建，完成後更新標記。
+        """
+        if self.precision == "float32" or not self.ids:
+            return
+        version, rows = self.version, len(self.ids)
+        if self.compact_state == self._compact_stamp(version, rows):
+            return
+        print(f"🗜️ 正在建立 {self.precision} 精簡向量 ({rows} 個)...")
+        matrix = self.matrix()
+        chunks = (_encode_compact(np.asarray(matrix[start:start + 10000]), self.precision)
+                  for start in range(0, len(self.ids), 10000))
+        with open(self.compact_path, "wb") as codes_file:
+            if self.precision == "int8":
+                with open(self.scales_path, "wb") as scales_file:
+                    for codes, scales in chunks:
+                        codes_file.write(codes.tobytes())
+                        scales_file.write(scales.tobytes())
+            else:
+                for codes, _ in chunks:
+                    codes_file.write(codes.tobytes())
+        stamp = self._compact_stamp(version, rows)
+        with closing(self._connect()) as conn, conn:
+            # 重建期間若有其他進程寫入 (版本已變)，這份精簡向量可能缺少那些列，不標記為有效，下次再重建
+            current = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if int(current[0] if current else 0) == version:
+                conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (self._compact_key, stamp))
+                self.compact_state = stamp
+        self._compact = None
+
+    def compact_matrix(self):
+        """返回 (精簡向量 memmap, 每列縮放係數或 None)；float32 精度時返回 (None, None)。"""
+        with self.lock:
+            if self.precision == "float32" or not self.ids:
+                return None, None
+            if self._compact is None:
+                dtype = np.float16 if self.precision == "float16" else np.int8
+                codes = np.memmap(self.compact_path, dtype=dtype, mode="r", shape=(len(self.ids), self.dim))
+                scales = None
+                if self.precision == "int8":
+                    scales = np.memmap(self.scales_path, dtype=np.float32, mode="r", shape=(len(self.ids),))
+                self._compact = (codes, scales)
+            return self._compact
+
+    def add(self, node_id: str, embedding):
+        """新增一個節點的向量；節點已存在時就地覆寫其向量。"""
+        self.add_many([node_id], [embedding])
+
+    def add_many(self, node_ids: list, embeddings):
+        """
+        批次新增向量：新的節點追加到檔案末尾，已存在的節點就地覆寫。
+        列號在 SQLite 的 BEGIN IMMEDIATE 交易中分配 (同一時間只有一個進程能寫入)，
+        所以多個進程同時寫入也不會覆寫彼此的列；交易提交後才更新記憶體中的狀態。
+        """
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(node_ids), -1))
+        with self.lock:
+            conn = self._connect()
+            conn.isolation_level = None
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                self._refresh(conn)
+                if self.dim is None:
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (str(vectors.shape[1]),))
+                    dim = vectors.shape[1]
+                else:
+                    dim = self.dim
+                if vectors.shape[1] != dim:
+                    raise ValueError(f"向量維度 {vectors.shape[1]} 與向量庫的維度 {dim} 不一致")
+
+                list_ids = self._assign(vectors) if self.centroids is not None else np.full(len(node_ids), -1, dtype=np.int32)
+                next_row = conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM ids").fetchone()[0]
+                assigned, new_rows, updates = {}, [], []
+                for node_id, list_id in zip(node_ids, list_ids):
+                    row = self.rows.get(node_id, assigned.get(node_id))
+                    if row is None:
+                        row = assigned[node_id] = next_row
+                        next_row += 1
+                        new_rows.append((row, node_id, int(list_id)))
+                    else:
+                        updates.append((int(list_id), row))
+                rows = [self.rows.get(node_id, assigned.get(node_id)) for node_id in node_ids]
+
+                with open(self.vectors_path, "r+b" if os.path.exists(self.vectors_path) else "wb") as f:
+                    for row, vector in zip(rows, vectors):
+                        f.seek(row * dim * 4)
+                        f.write(vector.tobytes())
+
+                # 每次寫入都遞增版本，其他精度 (或過期) 的精簡向量標記因此失效，下次以該精度開啟時會重建；
+                # 目前精度的精簡向量原本有效時，就地更新這一批並延續標記
+                version = self.version + 1
+                row_count = max(len(self.ids), max(rows) + 1)
+                compact_state = None
+                compact_valid = not self.ids or self.compact_state == self._compact_stamp(self.version, len(self.ids))
+                if self.precision != "float32" and compact_valid:
+                    self._write_compact(rows, vectors, dim)
+                    compact_state = self._compact_stamp(version, row_count)
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (self._compact_key, compact_state))
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(version),))
+
+                conn.executemany("INSERT INTO ids (row, node_id, list_id) VALUES (?, ?, ?)", new_rows)
+                conn.executemany("UPDATE ids SET list_id = ? WHERE row = ?", updates)
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+
+            # 交易已提交：列號在 BEGIN IMMEDIATE 後才分配，此時記憶體中的狀態已與其他進程的寫入同步，只需套用這一批
+            self.dim = dim
+            if new_rows:
+                grow = max(0, new_rows[-1][0] + 1 - len(self.ids))
+                self.ids.extend([None] * grow)
+                self.list_ids = np.concatenate([self.list_ids, np.full(grow, -1, dtype=np.int32)])
+            for row, node_id, list_id in zip(rows, node_ids, list_ids):
+                self.ids[row] = node_id
+                self.rows[node_id] = row
+                self.list_ids[row] = list_id
+            count, max_row, trained, _ = self._db_state
+            self.version, self.compact_state = version, compact_state
+            self._db_state = (count + len(new_rows), len(self.ids) - 1, trained, version)
+            self._matrix = None
+            self._compact = None
+            self._lists = None
+
+    def _write_compact(self, rows: list, vectors: np.ndarray, dim: int):
+        codes, scales = _encode_compact(vectors, self.precision)
+        row_bytes = dim * (2 if self.precision == "float16" else 1)
+        with open(self.compact_path, "r+b" if os.path.exists(self.compact_path) else "wb") as f:
+            for row, code in zip(rows, codes):
+                f.seek(row * row_bytes)
+                f.write(code.tobytes())
+        if scales is not None:
+            with open(self.scales_path, "r+b" if os.path.exists(self.scales_path) else "wb") as f:
+                for row, scale in zip(rows, scales):
+                    f.seek(row * 4)
+                    f.write(scale.tobytes())
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def train_ivf(self, n_lists: int = None, iterations: int = 10, seed: int = 0):
+        """以 spherical k-means 訓練 IVF 中心 (最多取樣 n_lists * 256 個向量)，再將所有向量歸入最近的中心。"""
+        with self.lock:
+            matrix = self.matrix()
+            count = len(self.ids)
+            n_lists = min(n_lists or self.n_lists or max(1, int(np.sqrt(count))), count)
+            rng = np.random.default_rng(seed)
+            sample = np.asarray(matrix[np.sort(rng.choice(count, size=min(count, n_lists * 256), replace=False))])
+            centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+
+            for _ in range(iterations):
+                assignment = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, sample)
+                counts = np.bincount(assignment, minlength=n_lists)
+                empty = counts == 0
+                # 空的列表以隨機樣本重新播種
+                sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+                centroids = _normalize(sums)
+
+            self.centroids = centroids
+            self.list_ids = np.concatenate([
+                self._assign(np.asarray(matrix[start:start + 10000])) for start in range(0, count, 10000)
+            ]).astype(np.int32)
+            np.save(self.centroids_path, centroids)
+            self.trained_count = count
+            with closing(self._connect()) as conn, conn:
+                conn.executemany("UPDATE ids SET list_id = ? WHERE row = ?",
+                                 [(int(list_id), row) for row, list_id in enumerate(self.list_ids)])
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('ivf_trained_count', ?)", (str(count),))
+            self._lists = None
+            print(f"🧭 IVF 索引已訓練：{count} 個向量，{n_lists} 個列表。")
+
+    def _maybe_train(self):
+        if self.mode != "ivf" or len(self.ids) < self.ivf_min_size:
+            return
+        if self.centroids is None or len(self.ids) >= 2 * self.trained_count:
+            self.train_ivf()
+
+    def _inverted_lists(self) -> dict:
+        if self._lists is None:
+            order = np.argsort(self.list_ids, kind="stable")
+            boundaries = np.flatnonzero(np.diff(self.list_ids[order])) + 1
+            self._lists = {int(self.list_ids[group[0]]): group for group in np.split(order, boundaries) if len(group)}
+        return self._lists
+
+    def _compact_scores(self, query: np.ndarray, rows: np.ndarray = None, block_size: int = 16384) -> np.ndarray:
+        """以精簡向量計算近似分數。分塊轉為 float32 再做矩陣乘法 (走 BLAS)，避免一次展開整個矩陣。"""
+        codes, scales = self.compact_matrix()
+        count = len(self.ids) if rows is None else len(rows)
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, block_size):
+            index = slice(start, start + block_size) if rows is None else rows[start:start + block_size]
+            scores[start:start + block_size] = np.asarray(codes[index], dtype=np.float32) @ query
+            if scales is not None:
+                scores[start:start + block_size] *= scales[index]
+        return scores
+
+    def search(self, query_embedding, k: int = 5, threshold: float = None, exclude: set = None) -> list:
+        """
+        返回與查詢向量最相似的 k 個節點：[{"id": 節點 ID, "score": 餘弦相似度}, ...]，由高到低排序。
+        threshold: 只返回分數不低於此值的節點。exclude: 要排除的節點 ID (例如查詢節點本身)。
+        """
+        with self.lock:
+            with closing(self._connect()) as conn, conn:
+                self._refresh(conn)
+            if not self.rows:
+                return []
+            self._ensure_compact()
+            self._maybe_train()
+            query = _normalize(np.asarray(query_embedding, dtype=np.float32).reshape(-1))
+            matrix = self.matrix()
+            extra = len(exclude) if exclude else 0
+
+            candidates = None
+            if self.mode == "ivf" and self.centroids is not None:
+                probes = _top_k(self.centroids @ query, self.nprobe)
+                lists = self._inverted_lists()
+                candidates = np.concatenate([lists.get(int(probe), np.empty(0, dtype=np.int64)) for probe in probes])
+                # 還沒分配列表的向量 (list_id 為 -1) 一律掃描
+                candidates = np.concatenate([candidates, lists.get(-1, np.empty(0, dtype=np.int64))])
+                candidates.sort()
+
+            if self.precision == "float32":
+                scores = np.asarray(matrix @ query if candidates is None else matrix[candidates] @ query)
+                top = _top_k(scores, k + extra)
+                best = top if candidates is None else candidates[top]
+                best_scores = scores[top]
+            else:
+                # 先以精簡向量取出較多的候選，再以 float32 向量重新計分排序
+                scores = self._compact_scores(query, candidates)
+                top = _top_k(scores, (k + extra) * self.rerank_factor)
+                shortlist = np.sort(top if candidates is None else candidates[top])
+                exact = np.asarray(matrix[shortlist]) @ query
+                order = _top_k(exact, k + extra)
+                best, best_scores = shortlist[order], exact[order]
+
+            results = []
+            for row, score in zip(best, best_scores):
+                node_id = self.ids[int(row)]
+                if node_id is None or (exclude and node_id in exclude):
+                    continue
+                if threshold is not None and score < threshold:
+                    break
+                results.append({"id": node_id, "score": float(score)})
+                if len(results) == k:
+                    break
+            return results
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_vector_store(config: dict):
+    """返回進程內共用的 VectorStore；若 VECTOR_STORE.enabled 為 false 則返回 None。"""
+    global _store
+    store_config = config.get("VECTOR_STORE", {})
+    if not store_config.get("enabled", True):
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = VectorStore(
+                path=store_config.get("path", DEFAULT_STORE_PATH),
+                mode=store_config.get("mode", "flat"),
+                n_lists=store_config.get("n_lists"),
+                nprobe=store_config.get("nprobe", 8),
+                ivf_min_size=store_config.get("ivf_min_size", 20000),
+                precision=store_config.get("precision", "float32"),
+                rerank_factor=store_config.get("rerank_factor", 4),
+            )
+        return _store
+
+def knowledge_node_text(title: str, core_idea: str) -> str:
+    """知識節點用於向量化的文字：標題 + 核心概念。"""
+    return f"{title}\n{core_idea}".strip()